@@ -1,48 +1,138 @@
 # ASR语音转文字打标
 from tqdm import tqdm
 from utils import file_util
-from funasr import AutoModel
 
+import logging
 import os
-import traceback
-import torch
+import threading
+import numpy as np
+from math import gcd
+from env_helper import EnvHelper
+
+logger = logging.getLogger(__name__)
 
 # 这三个路径是模型
 path_asr = 'ai_components/Asr/models/speech_paraformer-large_asr_nat-zh-cn-16k-common-vocab8404-pytorch'
 path_vad = 'ai_components/Asr/models/speech_fsmn_vad_zh-cn-16k-common-pytorch'
 path_punc = 'ai_components/Asr/models/punc_ct-transformer_zh-cn-common-vocab272727-pytorch'
 
+# 模型版本，也作为结果缓存键的一部分
+ASR_MODEL_REVISION = "v2.0.4"
+
+# 每个批次最多包含多少秒音频，<=0 时退化为逐个文件识别
+ASR_BATCH_SECONDS = EnvHelper.get_float('ASR_BATCH_SECONDS', 300)
+# 流式识别时攒多少个批次的音频一起按时长排序装箱，越大 padding 越少、占用内存越多
+ASR_SORT_WINDOW_BATCHES = EnvHelper.get_int('ASR_SORT_WINDOW_BATCHES', 4)
+
+# 模型输入采样率
+ASR_SAMPLE_RATE = 16000
+
+# 配置了模型服务地址时，本进程不加载模型，识别请求交给共享的模型服务进程
+ASR_SERVER_ADDRESS = EnvHelper.get_env_value('ASR_SERVER_ADDRESS', '')
+# 为空时使用模型服务启动时生成的密钥（<ASR_SERVER_ADDRESS>.key）
+ASR_SERVER_AUTHKEY = EnvHelper.get_env_value('ASR_SERVER_AUTHKEY')
+
+# 模型在第一次使用时才加载（或由 main.py 启动后在后台预热），import 本模块不会加载 torch/funasr
+model = None
 voice_device = None
-if torch.cuda.is_available():
-    voice_device = "cuda"
-else:
-    voice_device = "cpu"
-
-model = AutoModel(
-    model=path_asr,
-    model_revision="v2.0.4",
-    vad_model=path_vad,
-    vad_model_revision="v2.0.4",
-    punc_model=path_punc,
-    punc_model_revision="v2.0.4",
-    disable_update=True,  # 关闭检查更新
-    device=voice_device,
-)
+_client = None
+_model_lock = threading.Lock()
+_model_loading = False
+_model_error = None
+
+
+def load_model():
+    global model, voice_device, _model_loading, _model_error
+    if model is not None:
+        return model
+
+    with _model_lock:
+        if model is None:
+            _model_loading = True
+            try:
+                import torch
+                from funasr import AutoModel
+
+                voice_device = "cuda" if torch.cuda.is_available() else "cpu"
+                model = AutoModel(
+                    model=path_asr,
+                    model_revision=ASR_MODEL_REVISION,
+                    vad_model=path_vad,
+                    vad_model_revision=ASR_MODEL_REVISION,
+                    punc_model=path_punc,
+                    punc_model_revision=ASR_MODEL_REVISION,
+                    disable_update=True,  # 关闭检查更新
+                    device=voice_device,
+                )
+                _model_error = None
+            except Exception as e:
+                _model_error = str(e)
+                raise
+            finally:
+                _model_loading = False
+    return model
+
+
+def model_status():
+    """
+    模型加载状态，供就绪检查使用
+    """
+    if ASR_SERVER_ADDRESS and model is None:
+        return {'mode': 'server', 'address': ASR_SERVER_ADDRESS, 'loaded': False, 'loading': False,
+                'error': None}
+    return {
+        'mode': 'local',
+        'loaded': model is not None,
+        'loading': _model_loading,
+        'device': voice_device,
+        'error': _model_error,
+    }
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        from ai_components.Asr.model_server import ASRClient
+        _client = ASRClient(ASR_SERVER_ADDRESS, ASR_SERVER_AUTHKEY)
+    return _client
 
 
 class ASR:
-    def __init__(self, input_wav_folder="./", output_folder="./", language="zh"):
+    def __init__(self, input_wav_folder="./", output_folder="./", language="zh", batch_seconds=None):
         self.asr_model_name = '达摩 ASR (中文)'
         self.asr_model_scale = 'large'
         self.asr_language = language
+        self.batch_seconds = ASR_BATCH_SECONDS if batch_seconds is None else float(batch_seconds)
 
         self.input_wav_folder = file_util.path_strip(input_wav_folder)
         self.output_folder = file_util.path_strip(output_folder)
 
-    def open_asr(self):
+    def open_asr(self, progress_callback=None):
+        """
+        识别 input_wav_folder 下的所有文件
+        :param progress_callback: 每识别完一批调用一次 progress_callback(已识别的文件数, 文件总数)
+        :return: {文件路径: text}
+        """
         return _execute_asr(
             input_folder=self.input_wav_folder,
             language=self.asr_language,
+            batch_seconds=self.batch_seconds,
+            progress_callback=progress_callback,
+        )
+
+    def transcribe_chunks(self, chunks, progress_callback=None):
+        """
+        直接识别内存中的音频片段，不经过中间 wav 文件
+        :param chunks: 可迭代对象，产出 (key, 音频, 采样率)，音频为 int16 或 -1~1 的浮点数
+        :param progress_callback: 每识别完一批调用一次 progress_callback(已识别的片段数, None)，
+            片段边切分边产出，总数事先未知，所以第二个参数总是 None
+        :return: {key: text}
+        """
+        return _execute_asr_chunks(
+            chunks,
+            language=self.asr_language,
+            batch_seconds=self.batch_seconds,
+            progress_callback=progress_callback,
         )
 
     def stop(self):
@@ -65,19 +155,141 @@ class ASR:
         ]
 
 
-def _execute_asr(input_folder, language):
+def _execute_asr(input_folder, language, batch_seconds=ASR_BATCH_SECONDS, progress_callback=None):
     input_file_names = os.listdir(input_folder)
     input_file_names.sort()
+    file_paths = [f"{input_folder}/{name}" for name in input_file_names]
+
+    texts = {}
+    done = 0
+
+    for batch in tqdm(_make_batches(file_paths, batch_seconds)):
+        for file_path, text in zip(batch, _generate_batch(batch, language, batch_seconds)):
+            texts[file_path] = text
+
+        done += len(batch)
+        if progress_callback is not None:
+            progress_callback(done, len(file_paths))
 
+    # 保持和输入文件名一致的顺序
+    return {file_path: texts[file_path] for file_path in file_paths}
+
+
+def _execute_asr_chunks(chunks, language, batch_seconds=ASR_BATCH_SECONDS, progress_callback=None):
     output = {}
+    keys = []
+    window = []
+    window_seconds = 0.0
+    # 片段边切分边产出，不能像 _make_batches 那样全部排序；攒够若干批的时长后在窗口内按时长排序装箱，
+    # 同一批里的片段长短接近，padding 少，而缓存的音频最多几个批次
+    window_limit = batch_seconds * max(ASR_SORT_WINDOW_BATCHES, 1)
+
+    def flush():
+        for batch in _pack_batches([duration for _, _, duration in window], batch_seconds):
+            texts = _generate_batch([window[index][1] for index in batch], language, batch_seconds)
+            for index, text in zip(batch, texts):
+                output[window[index][0]] = text
+            if progress_callback is not None:
+                progress_callback(len(output), None)
+        window.clear()
+
+    for key, chunk, sr in chunks:
+        audio = _to_asr_input(chunk, sr)
+        duration = len(audio) / float(ASR_SAMPLE_RATE)
+        if window and (batch_seconds <= 0 or window_seconds + duration > window_limit):
+            flush()
+            window_seconds = 0.0
+        keys.append(key)
+        window.append((key, audio, duration))
+        window_seconds += duration
+    if window:
+        flush()
+
+    # 保持和片段产出一致的顺序
+    return {key: output[key] for key in keys}
+
+
+def _generate_batch(inputs, language, batch_seconds):
+    """
+    一次 generate 调用识别一批输入（文件路径或 16k 音频），按输入顺序返回文本
+    """
+    try:
+        if model is None and ASR_SERVER_ADDRESS:
+            texts = _get_client().generate(inputs, language, batch_seconds)
+        else:
+            texts = generate_local(inputs, language, batch_seconds)
+        if len(texts) != len(inputs):
+            raise RuntimeError(f"expect {len(inputs)} results, got {len(texts)}")
+        return texts
+    except Exception as e:
+        logger.exception(f"asr batch of {len(inputs)} inputs failed")
+        raise RuntimeError(f"Failed to asr: {e}") from e
+
+
+def generate_local(inputs, language, batch_seconds):
+    """
+    使用本进程的模型识别
+    """
+    kwargs = {'batch_size_s': batch_seconds} if batch_seconds > 0 else {}
+    if not isinstance(inputs[0], str):
+        kwargs['fs'] = ASR_SAMPLE_RATE
+    results = load_model().generate(input=inputs if len(inputs) > 1 else inputs[0], language=language, **kwargs)
+    return [result["text"] for result in results]
+
+
+def input_duration(item):
+    """
+    输入的时长（秒），item 是 wav 路径或 16k 音频
+    """
+    if isinstance(item, str):
+        return file_util.wav_duration(item)
+    return len(item) / float(ASR_SAMPLE_RATE)
+
+
+def _to_asr_input(chunk, sr):
+    # 在内存里转成 16k 单声道 float32
+    if chunk.dtype == np.int16:
+        audio = chunk.astype(np.float32) / 32768.0
+    else:
+        audio = chunk.astype(np.float32, copy=False)
+    if sr != ASR_SAMPLE_RATE:
+        # scipy.signal 导入较慢，用到时再导入
+        from scipy.signal import resample_poly
+
+        g = gcd(int(sr), ASR_SAMPLE_RATE)
+        audio = resample_poly(audio, ASR_SAMPLE_RATE // g, int(sr) // g).astype(np.float32)
+    return audio
+
+
+def _make_batches(file_paths, batch_seconds):
+    """
+    按时长排序后装箱，每个批次的总时长不超过 batch_seconds（单个超长文件自成一批）
+    """
+    if batch_seconds <= 0:
+        return [[file_path] for file_path in file_paths]
+
+    durations = [file_util.wav_duration(file_path) for file_path in file_paths]
+    return [[file_paths[index] for index in batch] for batch in _pack_batches(durations, batch_seconds)]
+
 
-    for name in tqdm(input_file_names):
-        try:
-            text = model.generate(input="%s/%s" % (input_folder, name), language=language)[0]["text"]
-            file_path = f"{input_folder}/{name}"
-            output[file_path] = text
-        except Exception as e:
-            print(traceback.format_exc())
-            raise RuntimeError(f"Failed to asr: {e}")
+def _pack_batches(durations, batch_seconds):
+    """
+    按时长排序后装箱，返回每个批次的下标列表，每个批次的总时长不超过 batch_seconds（单个超长输入自成一批）
+    """
+    if batch_seconds <= 0:
+        return [[index] for index in range(len(durations))]
 
-    return output
+    batches = []
+    current = []
+    current_seconds = 0.0
+    for index in sorted(range(len(durations)), key=lambda x: durations[x]):
+        duration = durations[index]
+        if current and current_seconds + duration > batch_seconds:
+            batches.append(current)
+            current = []
+            current_seconds = 0.0
+        current.append(index)
+        current_seconds += duration
+    if current:
+        batches.append(current)
+    return batches
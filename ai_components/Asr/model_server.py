@@ -0,0 +1,231 @@
+# ASR 模型服务：单独的进程持有一份模型，各个 API worker 通过 Unix socket 提交识别请求，
+# 服务端把时间窗口内到达的请求合并成一个批次调用模型
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+
+def load_authkey(address, configured=None, create=False):
+    """
+    优先使用配置的 ASR_SERVER_AUTHKEY；没有配置时服务端（create）生成随机密钥写到 <address>.key，
+    只有当前用户可读，客户端从这个文件读取
+    """
+    if configured:
+        return configured.encode('utf-8') if isinstance(configured, str) else configured
+    path = f"{address}.key"
+    if create:
+        key = secrets.token_bytes(32)
+        if os.path.exists(path):
+            os.remove(path)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        return key
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        raise RuntimeError(f"ASR_SERVER_AUTHKEY is not configured and {path} does not exist")
+
+
+class _PendingRequest:
+    def __init__(self, inputs, language, duration, batch_seconds):
+        self.inputs = inputs
+        self.language = language
+        self.duration = duration
+        self.batch_seconds = batch_seconds
+        self.texts = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ASRModelServer:
+    """
+    :param address: Unix socket 路径
+    :param authkey: 连接认证用的密钥，为空时生成随机密钥，见 load_authkey
+    :param batch_window: 收到第一个请求后最多再等多少秒合并后续请求
+    :param batch_seconds: 客户端没有指定时，每个合并批次最多包含多少秒音频
+    """
+
+    def __init__(self, address, authkey=None, batch_window=0.05, batch_seconds=300.0):
+        self.address = address
+        self.authkey = authkey
+        self.batch_window = batch_window
+        self.batch_seconds = batch_seconds
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._listener = None
+
+    def serve_forever(self):
+        from ai_components.Asr import asr
+
+        asr.load_model()
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        generated = not self.authkey
+        self.authkey = load_authkey(self.address, self.authkey, create=True)
+        if generated:
+            logger.warning(f"ASR_SERVER_AUTHKEY is not configured, generated a key in {self.address}.key")
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        threading.Thread(target=self._batch_loop, args=(asr,), name='asr-batcher', daemon=True).start()
+        logger.warning(f"ASR model server listening on {self.address}")
+
+        try:
+            while not self._closed.is_set():
+                try:
+                    conn = self._listener.accept()
+                except Exception as e:
+                    if self._closed.is_set():
+                        break
+                    logger.warning(f"ASR model server accept failed: {e}")
+                    continue
+                threading.Thread(target=self._handle_connection, args=(asr, conn), daemon=True).start()
+        finally:
+            self.close()
+
+    def close(self):
+        self._closed.set()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        for path in (self.address, f"{self.address}.key"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _handle_connection(self, asr, conn):
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                inputs = message['inputs']
+                batch_seconds = message.get('batch_seconds')
+                pending = _PendingRequest(inputs, message.get('language'),
+                                          sum(asr.input_duration(item) for item in inputs),
+                                          self.batch_seconds if batch_seconds is None else float(batch_seconds))
+                self._queue.put(pending)
+                pending.done.wait()
+                if pending.error is not None:
+                    conn.send({'error': pending.error})
+                else:
+                    conn.send({'texts': pending.texts})
+        finally:
+            conn.close()
+
+    def _batch_loop(self, asr):
+        # 不能并入当前批次的请求作为下一个批次的第一个，保持到达顺序
+        held = None
+        while not self._closed.is_set():
+            first = held if held is not None else self._queue.get()
+            held = None
+            batch = [first]
+            total = first.duration
+            deadline = time.monotonic() + self.batch_window
+            # 在时间窗口内继续收集语言和批次时长相同的请求，直到达到时长上限
+            while total < first.batch_seconds:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if (item.language != first.language or item.batch_seconds != first.batch_seconds
+                        or total + item.duration > first.batch_seconds):
+                    held = item
+                    break
+                batch.append(item)
+                total += item.duration
+
+            self._run_batch(asr, batch)
+
+    def _run_batch(self, asr, batch):
+        inputs = [item for pending in batch for item in pending.inputs]
+        try:
+            texts = asr.generate_local(inputs, batch[0].language, batch[0].batch_seconds)
+            if len(texts) != len(inputs):
+                raise RuntimeError(f"expect {len(inputs)} results, got {len(texts)}")
+        except Exception as e:
+            logger.error(f"ASR batch failed: {e}\n{traceback.format_exc()}")
+            for pending in batch:
+                pending.error = str(e)
+                pending.done.set()
+            return
+
+        offset = 0
+        for pending in batch:
+            pending.texts = texts[offset: offset + len(pending.inputs)]
+            offset += len(pending.inputs)
+            pending.done.set()
+
+
+class ASRClient:
+    """
+    模型服务的客户端，每个线程复用一条连接，连接断开后自动重连一次。
+    authkey 为空时每次连接前从服务端生成的密钥文件读取（服务端重启后密钥会变化）
+    """
+
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def generate(self, inputs, language, batch_seconds=None):
+        message = {'inputs': list(inputs), 'language': language, 'batch_seconds': batch_seconds}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.send(message)
+                reply = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._reset()
+                if attempt == 1:
+                    raise RuntimeError(f"ASR model server unavailable: {self.address}")
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['texts']
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = Client(self.address, family='AF_UNIX', authkey=load_authkey(self.address, self.authkey))
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise RuntimeError(f"ASR model server unavailable: {e}")
+            self._local.conn = conn
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+
+def main():
+    from env_helper import EnvHelper
+    from ai_components.Asr.asr import ASR_BATCH_SECONDS
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    address = EnvHelper.get_env_value('ASR_SERVER_ADDRESS', '/tmp/saga_asr.sock')
+    authkey = EnvHelper.get_env_value('ASR_SERVER_AUTHKEY')
+    window_ms = EnvHelper.get_float('ASR_SERVER_BATCH_WINDOW_MS', 50)
+
+    server = ASRModelServer(address, authkey, batch_window=window_ms / 1000.0, batch_seconds=ASR_BATCH_SECONDS)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,264 +1,567 @@
-import numpy as np
-
-
-# This function is obtained from librosa.
-def get_rms(
-        y,
-        frame_length=2048,
-        hop_length=512,
-        pad_mode="constant",
-):
-    padding = (int(frame_length // 2), int(frame_length // 2))
-    y = np.pad(y, padding, mode=pad_mode)
-
-    axis = -1
-    # put our new within-frame axis at the end for now
-    out_strides = y.strides + tuple([y.strides[axis]])
-    # Reduce the shape on the framing axis
-    x_shape_trimmed = list(y.shape)
-    x_shape_trimmed[axis] -= frame_length - 1
-    out_shape = tuple(x_shape_trimmed) + tuple([frame_length])
-    xw = np.lib.stride_tricks.as_strided(y, shape=out_shape, strides=out_strides)
-    if axis < 0:
-        target_axis = axis - 1
-    else:
-        target_axis = axis + 1
-    xw = np.moveaxis(xw, -1, target_axis)
-    # Downsample along the target axis
-    slices = [slice(None)] * xw.ndim
-    slices[axis] = slice(0, None, hop_length)
-    x = xw[tuple(slices)]
-
-    # Calculate power
-    power = np.mean(np.abs(x) ** 2, axis=-2, keepdims=True)
-
-    return np.sqrt(power)
-
-
-class Slicer:
-    def __init__(
-            self,
-            sr: int,
-            threshold: float = -40.0,
-            min_length: int = 5000,
-            min_interval: int = 300,
-            hop_size: int = 20,
-            max_sil_kept: int = 5000,
-    ):
-        if not min_length >= min_interval >= hop_size:
-            raise ValueError(
-                "The following condition must be satisfied: min_length >= min_interval >= hop_size"
-            )
-        if not max_sil_kept >= hop_size:
-            raise ValueError(
-                "The following condition must be satisfied: max_sil_kept >= hop_size"
-            )
-        min_interval = sr * min_interval / 1000
-        self.threshold = 10 ** (threshold / 20.0)
-        self.hop_size = round(sr * hop_size / 1000)
-        self.win_size = min(round(min_interval), 4 * self.hop_size)
-        self.min_length = round(sr * min_length / 1000 / self.hop_size)
-        self.min_interval = round(min_interval / self.hop_size)
-        self.max_sil_kept = round(sr * max_sil_kept / 1000 / self.hop_size)
-
-    def _apply_slice(self, waveform, begin, end):
-        if len(waveform.shape) > 1:
-            return waveform[
-                   :, begin * self.hop_size: min(waveform.shape[1], end * self.hop_size)
-                   ]
-        else:
-            return waveform[
-                   begin * self.hop_size: min(waveform.shape[0], end * self.hop_size)
-                   ]
-
-    # @timeit
-    def slice(self, waveform):
-        if len(waveform.shape) > 1:
-            samples = waveform.mean(axis=0)
-        else:
-            samples = waveform
-        if samples.shape[0] <= self.min_length:
-            return [waveform]
-        rms_list = get_rms(
-            y=samples, frame_length=self.win_size, hop_length=self.hop_size
-        ).squeeze(0)
-        sil_tags = []
-        silence_start = None
-        clip_start = 0
-        for i, rms in enumerate(rms_list):
-            # Keep looping while frame is silent.
-            if rms < self.threshold:
-                # Record start of silent frames.
-                if silence_start is None:
-                    silence_start = i
-                continue
-            # Keep looping while frame is not silent and silence start has not been recorded.
-            if silence_start is None:
-                continue
-            # Clear recorded silence start if interval is not enough or clip is too short
-            is_leading_silence = silence_start == 0 and i > self.max_sil_kept
-            need_slice_middle = (
-                    i - silence_start >= self.min_interval
-                    and i - clip_start >= self.min_length
-            )
-            if not is_leading_silence and not need_slice_middle:
-                silence_start = None
-                continue
-            # Need slicing. Record the range of silent frames to be removed.
-            if i - silence_start <= self.max_sil_kept:
-                pos = rms_list[silence_start: i + 1].argmin() + silence_start
-                if silence_start == 0:
-                    sil_tags.append((0, pos))
-                else:
-                    sil_tags.append((pos, pos))
-                clip_start = pos
-            elif i - silence_start <= self.max_sil_kept * 2:
-                pos = rms_list[
-                      i - self.max_sil_kept: silence_start + self.max_sil_kept + 1
-                      ].argmin()
-                pos += i - self.max_sil_kept
-                pos_l = (
-                        rms_list[
-                        silence_start: silence_start + self.max_sil_kept + 1
-                        ].argmin()
-                        + silence_start
-                )
-                pos_r = (
-                        rms_list[i - self.max_sil_kept: i + 1].argmin()
-                        + i
-                        - self.max_sil_kept
-                )
-                if silence_start == 0:
-                    sil_tags.append((0, pos_r))
-                    clip_start = pos_r
-                else:
-                    sil_tags.append((min(pos_l, pos), max(pos_r, pos)))
-                    clip_start = max(pos_r, pos)
-            else:
-                pos_l = (
-                        rms_list[
-                        silence_start: silence_start + self.max_sil_kept + 1
-                        ].argmin()
-                        + silence_start
-                )
-                pos_r = (
-                        rms_list[i - self.max_sil_kept: i + 1].argmin()
-                        + i
-                        - self.max_sil_kept
-                )
-                if silence_start == 0:
-                    sil_tags.append((0, pos_r))
-                else:
-                    sil_tags.append((pos_l, pos_r))
-                clip_start = pos_r
-            silence_start = None
-        # Deal with trailing silence.
-        total_frames = rms_list.shape[0]
-        if (
-                silence_start is not None
-                and total_frames - silence_start >= self.min_interval
-        ):
-            silence_end = min(total_frames, silence_start + self.max_sil_kept)
-            pos = rms_list[silence_start: silence_end + 1].argmin() + silence_start
-            sil_tags.append((pos, total_frames + 1))
-        # Apply and return slices.
-
-        ####音频+起始时间+终止时间
-        if len(sil_tags) == 0:
-            return [[waveform, 0, int(total_frames * self.hop_size)]]
-        else:
-            chunks = []
-            if sil_tags[0][0] > 0:
-                chunks.append([self._apply_slice(waveform, 0, sil_tags[0][0]), 0, int(sil_tags[0][0] * self.hop_size)])
-            for i in range(len(sil_tags) - 1):
-                chunks.append(
-                    [self._apply_slice(waveform, sil_tags[i][1], sil_tags[i + 1][0]),
-                     int(sil_tags[i][1] * self.hop_size), int(sil_tags[i + 1][0] * self.hop_size)]
-                )
-            if sil_tags[-1][1] < total_frames:
-                chunks.append(
-                    [self._apply_slice(waveform, sil_tags[-1][1], total_frames), int(sil_tags[-1][1] * self.hop_size),
-                     int(total_frames * self.hop_size)]
-                )
-            return chunks
-
-
-def main():
-    import os.path
-    from argparse import ArgumentParser
-
-    import librosa
-    import soundfile
-
-    parser = ArgumentParser()
-    parser.add_argument("audio", type=str, help="The audio to be sliced")
-    parser.add_argument(
-        "--out", type=str, help="Output directory of the sliced audio clips"
-    )
-    parser.add_argument(
-        "--db_thresh",
-        type=float,
-        required=False,
-        default=-40,
-        help="The dB threshold for silence detection",
-    )
-    parser.add_argument(
-        "--min_length",
-        type=int,
-        required=False,
-        default=5000,
-        help="The minimum milliseconds required for each sliced audio clip",
-    )
-    parser.add_argument(
-        "--min_interval",
-        type=int,
-        required=False,
-        default=300,
-        help="The minimum milliseconds for a silence part to be sliced",
-    )
-    parser.add_argument(
-        "--hop_size",
-        type=int,
-        required=False,
-        default=10,
-        help="Frame length in milliseconds",
-    )
-    parser.add_argument(
-        "--max_sil_kept",
-        type=int,
-        required=False,
-        default=500,
-        help="The maximum silence length kept around the sliced clip, presented in milliseconds",
-    )
-    args = parser.parse_args()
-    out = args.out
-    if out is None:
-        out = os.path.dirname(os.path.abspath(args.audio))
-    audio, sr = librosa.load(args.audio, sr=None, mono=False)
-    slicer = Slicer(
-        sr=sr,
-        threshold=args.db_thresh,
-        min_length=args.min_length,
-        min_interval=args.min_interval,
-        hop_size=args.hop_size,
-        max_sil_kept=args.max_sil_kept,
-    )
-    chunks = slicer.slice(audio)
-    if not os.path.exists(out):
-        os.makedirs(out)
-    for i, chunk in enumerate(chunks):
-        if len(chunk.shape) > 1:
-            chunk = chunk.T
-        soundfile.write(
-            os.path.join(
-                out,
-                f"%s_%d.wav"
-                % (os.path.basename(args.audio).rsplit(".", maxsplit=1)[0], i),
-            ),
-            chunk,
-            sr,
-        )
-
-
-if __name__ == "__main__":
-    main()
+import numpy as np
+
+
+# This function is obtained from librosa.
+def get_rms(
+        y,
+        frame_length=2048,
+        hop_length=512,
+        pad_mode="constant",
+):
+    padding = (int(frame_length // 2), int(frame_length // 2))
+    y = np.pad(y, padding, mode=pad_mode)
+    return _framed_rms(y, frame_length, hop_length)
+
+
+def _framed_rms(y, frame_length, hop_length):
+    # y 已经补齐，第 j 帧是 y[j * hop_length: j * hop_length + frame_length]
+    axis = -1
+    # put our new within-frame axis at the end for now
+    out_strides = y.strides + tuple([y.strides[axis]])
+    # Reduce the shape on the framing axis
+    x_shape_trimmed = list(y.shape)
+    x_shape_trimmed[axis] -= frame_length - 1
+    out_shape = tuple(x_shape_trimmed) + tuple([frame_length])
+    xw = np.lib.stride_tricks.as_strided(y, shape=out_shape, strides=out_strides)
+    if axis < 0:
+        target_axis = axis - 1
+    else:
+        target_axis = axis + 1
+    xw = np.moveaxis(xw, -1, target_axis)
+    # Downsample along the target axis
+    slices = [slice(None)] * xw.ndim
+    slices[axis] = slice(0, None, hop_length)
+    x = xw[tuple(slices)]
+
+    # Calculate power
+    power = np.mean(np.abs(x) ** 2, axis=-2, keepdims=True)
+
+    return np.sqrt(power)
+
+
+def _window_argmin(values, starts, ends):
+    """
+    每个窗口 values[starts[k]: ends[k]] 中第一个最小值的位置（values 中的下标），窗口非空，可以重叠。
+    把所有窗口的元素收集到一起，用 minimum.reduceat 求每个窗口的最小值，再取每个窗口第一个等于最小值的元素
+    """
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    labels = np.repeat(np.arange(len(starts)), lengths)
+    index = np.arange(int(lengths.sum())) - np.repeat(offsets - starts, lengths)
+    window_values = values[index]
+    minimums = np.minimum.reduceat(window_values, offsets)
+    hits = np.flatnonzero(window_values == minimums[labels])
+    _, first = np.unique(labels[hits], return_index=True)
+    return index[hits[first]]
+
+
+class Slicer:
+    def __init__(
+            self,
+            sr: int,
+            threshold: float = -40.0,
+            min_length: int = 5000,
+            min_interval: int = 300,
+            hop_size: int = 20,
+            max_sil_kept: int = 5000,
+    ):
+        if not min_length >= min_interval >= hop_size:
+            raise ValueError(
+                "The following condition must be satisfied: min_length >= min_interval >= hop_size"
+            )
+        if not max_sil_kept >= hop_size:
+            raise ValueError(
+                "The following condition must be satisfied: max_sil_kept >= hop_size"
+            )
+        min_interval = sr * min_interval / 1000
+        self.threshold = 10 ** (threshold / 20.0)
+        self.hop_size = round(sr * hop_size / 1000)
+        self.win_size = min(round(min_interval), 4 * self.hop_size)
+        self.min_length = round(sr * min_length / 1000 / self.hop_size)
+        self.min_interval = round(min_interval / self.hop_size)
+        self.max_sil_kept = round(sr * max_sil_kept / 1000 / self.hop_size)
+
+    def _apply_slice(self, waveform, begin, end):
+        if len(waveform.shape) > 1:
+            return waveform[
+                   :, begin * self.hop_size: min(waveform.shape[1], end * self.hop_size)
+                   ]
+        else:
+            return waveform[
+                   begin * self.hop_size: min(waveform.shape[0], end * self.hop_size)
+                   ]
+
+    def _get_sil_tags(self, rms_list):
+        """
+        计算需要去掉的静音区间 [(起始帧, 终止帧)]。
+        先对静音帧做游程编码得到所有静音段，过滤掉不可能成为切点的静音段，
+        再一次性算出每个候选静音段各个窗口的 argmin（_window_argmin），不逐帧、也不逐段切片。
+        是否切分取决于上一个切点（clip_start），只能按顺序决定，这一步是对候选静音段的标量循环
+        """
+        total_frames = rms_list.shape[0]
+        silent = rms_list < self.threshold
+        edges = np.diff(silent.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+        run_starts = np.flatnonzero(edges == 1)
+        run_ends = np.flatnonzero(edges == -1)  # 静音段之后第一个非静音帧
+
+        # 延伸到结尾的静音段单独处理
+        trailing_start = None
+        if len(run_starts) > 0 and run_ends[-1] == total_frames:
+            trailing_start = int(run_starts[-1])
+            run_starts = run_starts[:-1]
+            run_ends = run_ends[:-1]
+
+        # 太短又不在开头的静音段一定不会切，直接过滤掉
+        candidates = ((run_ends - run_starts) >= self.min_interval) | (
+                (run_starts == 0) & (run_ends > self.max_sil_kept))
+        starts = run_starts[candidates]
+        ends = run_ends[candidates]
+
+        # 每个候选静音段 [s, i) 可能用到的三个切点，窗口都包含结束帧 i，见 _choose_cut
+        msk = self.max_sil_kept
+        pos_l = _window_argmin(rms_list, starts, np.minimum(ends + 1, starts + msk + 1))
+        pos_r = _window_argmin(rms_list, np.maximum(starts, ends - msk), ends + 1)
+        pos_mid = np.zeros_like(pos_l)
+        middle = ((ends - starts) > msk) & ((ends - starts) <= 2 * msk)
+        pos_mid[middle] = _window_argmin(rms_list, ends[middle] - msk, starts[middle] + msk + 1)
+
+        sil_tags = []
+        clip_start = 0
+        for silence_start, i, left, right, mid in zip(starts.tolist(), ends.tolist(), pos_l.tolist(),
+                                                      pos_r.tolist(), pos_mid.tolist()):
+            if self._needs_cut(silence_start, i, clip_start):
+                tag, clip_start = self._choose_cut(silence_start, i, left, right, mid)
+                sil_tags.append(tag)
+        # Deal with trailing silence.
+        if (
+                trailing_start is not None
+                and total_frames - trailing_start >= self.min_interval
+        ):
+            silence_end = min(total_frames, trailing_start + self.max_sil_kept)
+            pos = rms_list[trailing_start: silence_end + 1].argmin() + trailing_start
+            sil_tags.append((pos, total_frames + 1))
+        return sil_tags
+
+    def _cut_run(self, rms_list, base, silence_start, i, clip_start):
+        """
+        静音段 [silence_start, i) 结束于第 i 帧时的切分决策，rms_list[k - base] 是第 k 帧的音量，
+        需要包含 silence_start 到 i 的所有帧。流式切分逐段调用，整段切分用 _get_sil_tags 里批量算出的 argmin。
+        不需要切分时返回 None，否则返回 (静音区间, 新的 clip_start)
+        """
+        if not self._needs_cut(silence_start, i, clip_start):
+            return None
+        msk = self.max_sil_kept
+        pos_l = rms_list[silence_start - base: min(i, silence_start + msk) + 1 - base].argmin() + silence_start
+        right = max(silence_start, i - msk)
+        pos_r = rms_list[right - base: i + 1 - base].argmin() + right
+        pos_mid = 0
+        if msk < i - silence_start <= msk * 2:
+            pos_mid = rms_list[i - msk - base: silence_start + msk + 1 - base].argmin() + i - msk
+        return self._choose_cut(silence_start, i, pos_l, pos_r, pos_mid)
+
+    def _needs_cut(self, silence_start, i, clip_start):
+        # Clear recorded silence start if interval is not enough or clip is too short
+        is_leading_silence = silence_start == 0 and i > self.max_sil_kept
+        need_slice_middle = (
+                i - silence_start >= self.min_interval
+                and i - clip_start >= self.min_length
+        )
+        return is_leading_silence or need_slice_middle
+
+    def _choose_cut(self, silence_start, i, pos_l, pos_r, pos_mid):
+        """
+        需要切分的静音段 [silence_start, i) 要去掉的区间，返回 (静音区间, 新的 clip_start)。
+        pos_l：[silence_start, min(i, silence_start + max_sil_kept)] 的最小音量帧（短静音段就是整段）；
+        pos_r：[max(silence_start, i - max_sil_kept), i] 的最小音量帧；
+        pos_mid：[i - max_sil_kept, silence_start + max_sil_kept] 的最小音量帧，只在静音段长度介于
+        max_sil_kept 和 2 * max_sil_kept 之间时使用
+        """
+        # Need slicing. Record the range of silent frames to be removed.
+        if i - silence_start <= self.max_sil_kept:
+            if silence_start == 0:
+                return (0, pos_l), pos_l
+            else:
+                return (pos_l, pos_l), pos_l
+        elif i - silence_start <= self.max_sil_kept * 2:
+            if silence_start == 0:
+                return (0, pos_r), pos_r
+            else:
+                return (min(pos_l, pos_mid), max(pos_r, pos_mid)), max(pos_r, pos_mid)
+        else:
+            if silence_start == 0:
+                return (0, pos_r), pos_r
+            else:
+                return (pos_l, pos_r), pos_r
+
+    # @timeit
+    def slice(self, waveform):
+        if len(waveform.shape) > 1:
+            samples = waveform.mean(axis=0)
+        else:
+            samples = waveform
+        if samples.shape[0] <= self.min_length:
+            return [waveform]
+        return list(self.iter_slice(waveform))
+
+    def iter_slice(self, waveform):
+        """
+        和 slice 相同的切分结果，但以生成器的方式逐段产出 [音频, 起始采样点, 终止采样点]，
+        过短的音频整段产出
+        """
+        if len(waveform.shape) > 1:
+            samples = waveform.mean(axis=0)
+        else:
+            samples = waveform
+        if samples.shape[0] <= self.min_length:
+            yield [waveform, 0, int(samples.shape[0])]
+            return
+        rms_list = get_rms(
+            y=samples, frame_length=self.win_size, hop_length=self.hop_size
+        ).squeeze(0)
+        sil_tags = self._get_sil_tags(rms_list)
+        total_frames = rms_list.shape[0]
+        # Apply and return slices.
+
+        ####音频+起始时间+终止时间
+        if len(sil_tags) == 0:
+            yield [waveform, 0, int(total_frames * self.hop_size)]
+        else:
+            if sil_tags[0][0] > 0:
+                yield [self._apply_slice(waveform, 0, sil_tags[0][0]), 0, int(sil_tags[0][0] * self.hop_size)]
+            for i in range(len(sil_tags) - 1):
+                yield [self._apply_slice(waveform, sil_tags[i][1], sil_tags[i + 1][0]),
+                       int(sil_tags[i][1] * self.hop_size), int(sil_tags[i + 1][0] * self.hop_size)]
+            if sil_tags[-1][1] < total_frames:
+                yield [self._apply_slice(waveform, sil_tags[-1][1], total_frames), int(sil_tags[-1][1] * self.hop_size),
+                       int(total_frames * self.hop_size)]
+
+    def iter_slice_stream(self, blocks):
+        """
+        流式切分：blocks 依次产出单声道音频块，切出的片段一旦确定就以
+        [音频, 起始采样点, 终止采样点]（整条音频中的绝对位置）产出，结果与对整条音频调用 iter_slice 相同。
+        只保留计算音量需要的尾部样本、当前静音段的音量和尚未产出的片段音频，
+        内存占用取决于最长的片段而不是输入总长度
+        """
+        return _StreamSlicer(self).run(blocks)
+
+
+class _SampleBuffer:
+    """
+    按绝对采样点位置访问的音频缓冲，可以丢弃不再需要的前部
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.origin = 0  # blocks[0][0] 的绝对位置
+        self.total = 0  # 已写入的采样点总数
+
+    def append(self, block):
+        if len(block) > 0:
+            self.blocks.append(block)
+            self.total += len(block)
+
+    def take(self, begin, end):
+        # 返回 [begin, end) 的拷贝
+        end = min(end, self.total)
+        pieces = []
+        pos = self.origin
+        for block in self.blocks:
+            block_end = pos + len(block)
+            if block_end > begin and pos < end:
+                pieces.append(block[max(begin - pos, 0): end - pos])
+            pos = block_end
+            if pos >= end:
+                break
+        if not pieces:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(pieces)
+
+    def drop_before(self, pos):
+        while self.blocks and self.origin + len(self.blocks[0]) <= pos:
+            self.origin += len(self.blocks[0])
+            self.blocks.pop(0)
+        if self.blocks and pos > self.origin:
+            self.blocks[0] = self.blocks[0][pos - self.origin:]
+            self.origin = pos
+
+
+class _StreamSlicer:
+    def __init__(self, slicer):
+        self.slicer = slicer
+        self.hop = slicer.hop_size
+        self.win = slicer.win_size
+        self.msk = slicer.max_sil_kept
+        # 静音段超过这个帧数后一定会被切分，可以只保留它的首尾
+        self.long_run = max(2 * self.msk + 1, slicer.min_interval, slicer.min_length)
+
+        self.audio = _SampleBuffer()
+        # 计算音量用的补齐样本，pcm[0] 对应第 next_frame 帧的起点
+        self.pcm = np.zeros(self.win // 2, dtype=np.float32)
+        self.next_frame = 0
+
+        self.clip_start = 0
+        self.has_tag = False
+        self.resume = 0  # 上一个静音区间的终止帧，也就是下一个片段的起始帧
+
+        # 当前未结束的静音段
+        self.run_start = None
+        self.run_rms = []  # 未压缩时是 [run_start, next_frame) 的音量
+        self.compacted = False
+        self.tail_base = 0  # 压缩后 run_rms 只保存 [tail_base, next_frame) 的音量
+        self.pos_l = None
+        self.leading_chunk = None
+
+    def run(self, blocks):
+        # 和 slice 一样，总长度不超过 min_length 个采样点时整段返回
+        head = []
+        head_samples = 0
+        for block in blocks:
+            block = np.asarray(block, dtype=np.float32)
+            if head is not None:
+                head.append(block)
+                head_samples += len(block)
+                if head_samples <= self.slicer.min_length:
+                    continue
+                block = np.concatenate(head)
+                head = None
+            self.audio.append(block)
+            yield from self._feed(block)
+
+        if head is not None:
+            audio = np.concatenate(head) if head else np.zeros(0, dtype=np.float32)
+            yield [audio, 0, int(len(audio))]
+            return
+
+        yield from self._finish()
+
+    def _feed(self, block):
+        self.pcm = np.concatenate([self.pcm, block])
+        count = (len(self.pcm) - self.win) // self.hop + 1 if len(self.pcm) >= self.win else 0
+        if count <= 0:
+            return
+        frames = _framed_rms(self.pcm[:(count - 1) * self.hop + self.win], self.win, self.hop).squeeze(0)
+        self.pcm = self.pcm[count * self.hop:]
+        yield from self._process_frames(frames)
+
+    def _finish(self):
+        self.pcm = np.concatenate([self.pcm, np.zeros(self.win // 2, dtype=np.float32)])
+        if len(self.pcm) >= self.win:
+            count = (len(self.pcm) - self.win) // self.hop + 1
+            frames = _framed_rms(self.pcm[:(count - 1) * self.hop + self.win], self.win, self.hop).squeeze(0)
+            yield from self._process_frames(frames)
+
+        slicer = self.slicer
+        total_frames = self.next_frame
+        # Deal with trailing silence.
+        if self.run_start is not None:
+            silence_start = self.run_start
+            if self.compacted:
+                if silence_start == 0:
+                    pos, chunk = self.leading_chunk
+                    if pos > 0:
+                        yield [chunk, 0, int(pos * self.hop)]
+                self.has_tag = True
+                self.resume = total_frames + 1
+            elif total_frames - silence_start >= slicer.min_interval:
+                run_rms = np.concatenate(self.run_rms)
+                silence_end = min(total_frames, silence_start + self.msk)
+                pos = run_rms[:silence_end + 1 - silence_start].argmin() + silence_start
+                yield from self._emit_until(pos)
+                self.resume = total_frames + 1
+
+        ####音频+起始时间+终止时间
+        if not self.has_tag:
+            yield [self.audio.take(0, self.audio.total), 0, int(total_frames * self.hop)]
+        elif self.resume < total_frames:
+            yield [self.audio.take(self.resume * self.hop, total_frames * self.hop), int(self.resume * self.hop),
+                   int(total_frames * self.hop)]
+
+    def _process_frames(self, frames):
+        base = self.next_frame
+        self.next_frame += len(frames)
+        silent = frames < self.slicer.threshold
+        edges = np.diff(silent.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+        run_starts = np.flatnonzero(edges == 1).tolist()
+        run_ends = np.flatnonzero(edges == -1).tolist()
+
+        if self.run_start is not None:
+            if run_starts and run_starts[0] == 0:
+                # 上一块的静音段延续到这一块
+                end = run_ends[0]
+                run_starts.pop(0)
+                run_ends.pop(0)
+                yield from self._extend_run(frames[:end], base)
+                if end < len(frames):
+                    yield from self._close_run(frames[end], base + end)
+            else:
+                yield from self._close_run(frames[0], base)
+
+        for start, end in zip(run_starts, run_ends):
+            if end < len(frames):
+                # 块内完整的静音段，直接在这一块的音量上决策
+                cut = self.slicer._cut_run(frames, base, base + start, base + end, self.clip_start)
+                if cut is not None:
+                    yield from self._apply_cut(cut)
+            else:
+                self.run_start = base + start
+                self.run_rms = []
+                self.compacted = False
+                yield from self._extend_run(frames[start:], base + start)
+
+        if self.run_start is not None and self.compacted:
+            # 超长静音段中间的音频不会出现在任何片段里
+            self.audio.drop_before(max(self.next_frame - self.msk, 0) * self.hop)
+        yield from ()
+
+    def _extend_run(self, frames, first_frame):
+        self.run_rms.append(frames)
+        run_end = first_frame + len(frames)
+        if self.compacted:
+            self._trim_tail(run_end)
+            return
+        if run_end - self.run_start <= self.long_run:
+            return
+
+        # 静音段已经足够长，左边界只取决于开头 max_sil_kept + 1 帧，先把左边的片段确定下来
+        run_rms = np.concatenate(self.run_rms)
+        silence_start = self.run_start
+        self.pos_l = run_rms[:self.msk + 1].argmin() + silence_start
+        if silence_start == 0:
+            # 开头的静音段：正常结束时切分点是 (0, pos_r)，一直静音到结尾时是 (pos_l, 结尾)
+            self.leading_chunk = (self.pos_l, self.audio.take(0, self.pos_l * self.hop))
+        else:
+            yield from self._emit_until(self.pos_l)
+        self.compacted = True
+        self.tail_base = silence_start
+        self.run_rms = [run_rms]
+        self._trim_tail(run_end)
+
+    def _trim_tail(self, run_end):
+        # 静音段结束时只会用到最后 max_sil_kept 帧和结束帧的音量
+        keep_from = run_end - self.msk
+        if keep_from <= self.tail_base:
+            return
+        run_rms = np.concatenate(self.run_rms)
+        self.run_rms = [run_rms[keep_from - self.tail_base:]]
+        self.tail_base = keep_from
+
+    def _close_run(self, frame_rms, i):
+        # 静音段在第 i 帧结束，frame_rms 是第 i 帧的音量
+        silence_start = self.run_start
+        run_rms = np.concatenate(self.run_rms + [np.asarray([frame_rms], dtype=np.float32)])
+        self.run_start = None
+        self.run_rms = []
+        if not self.compacted:
+            cut = self.slicer._cut_run(run_rms, silence_start, silence_start, i, self.clip_start)
+            if cut is not None:
+                yield from self._apply_cut(cut)
+            return
+
+        self.compacted = False
+        pos_r = run_rms[i - self.msk - self.tail_base: i + 1 - self.tail_base].argmin() + i - self.msk
+        self.has_tag = True
+        self.clip_start = pos_r
+        self._set_resume(pos_r)
+        yield from ()
+
+    def _apply_cut(self, cut):
+        (begin, end), self.clip_start = cut
+        yield from self._emit_until(begin)
+        self._set_resume(end)
+
+    def _emit_until(self, begin):
+        # 新的静音区间从 begin 开始：产出它左边的片段
+        hop = self.hop
+        if not self.has_tag:
+            self.has_tag = True
+            if begin > 0:
+                yield [self.audio.take(0, begin * hop), 0, int(begin * hop)]
+        else:
+            yield [self.audio.take(self.resume * hop, begin * hop), int(self.resume * hop), int(begin * hop)]
+
+    def _set_resume(self, end):
+        self.resume = end
+        self.audio.drop_before(end * self.hop)
+
+
+def main():
+    import os.path
+    from argparse import ArgumentParser
+
+    import librosa
+    import soundfile
+
+    parser = ArgumentParser()
+    parser.add_argument("audio", type=str, help="The audio to be sliced")
+    parser.add_argument(
+        "--out", type=str, help="Output directory of the sliced audio clips"
+    )
+    parser.add_argument(
+        "--db_thresh",
+        type=float,
+        required=False,
+        default=-40,
+        help="The dB threshold for silence detection",
+    )
+    parser.add_argument(
+        "--min_length",
+        type=int,
+        required=False,
+        default=5000,
+        help="The minimum milliseconds required for each sliced audio clip",
+    )
+    parser.add_argument(
+        "--min_interval",
+        type=int,
+        required=False,
+        default=300,
+        help="The minimum milliseconds for a silence part to be sliced",
+    )
+    parser.add_argument(
+        "--hop_size",
+        type=int,
+        required=False,
+        default=10,
+        help="Frame length in milliseconds",
+    )
+    parser.add_argument(
+        "--max_sil_kept",
+        type=int,
+        required=False,
+        default=500,
+        help="The maximum silence length kept around the sliced clip, presented in milliseconds",
+    )
+    args = parser.parse_args()
+    out = args.out
+    if out is None:
+        out = os.path.dirname(os.path.abspath(args.audio))
+    audio, sr = librosa.load(args.audio, sr=None, mono=False)
+    slicer = Slicer(
+        sr=sr,
+        threshold=args.db_thresh,
+        min_length=args.min_length,
+        min_interval=args.min_interval,
+        hop_size=args.hop_size,
+        max_sil_kept=args.max_sil_kept,
+    )
+    chunks = slicer.slice(audio)
+    if not os.path.exists(out):
+        os.makedirs(out)
+    for i, chunk in enumerate(chunks):
+        if len(chunk.shape) > 1:
+            chunk = chunk.T
+        soundfile.write(
+            os.path.join(
+                out,
+                f"%s_%d.wav"
+                % (os.path.basename(args.audio).rsplit(".", maxsplit=1)[0], i),
+            ),
+            chunk,
+            sr,
+        )
+
+
+if __name__ == "__main__":
+    main()
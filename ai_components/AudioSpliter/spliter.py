@@ -1,70 +1,163 @@
 # 语料分离器
+import inspect
 import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from utils import file_util
+from env_helper import EnvHelper
 import os
-import traceback
 from ai_components.AudioSpliter.slicer import Slicer
 import numpy as np
 from scipy.io import wavfile
 
 
+# 影响切分结果的构造参数，_params 和 default_params 都按这个顺序
+SPLIT_PARAMS = ('volume_threshold', 'hop_size', 'min_split_interval', 'max_sil_kept', 'min_length',
+                'max_amplitude', 'alpha_mix')
+
+
 class Splitter:
-    def __init__(self, input_path="./", output_path="./out"):
+    # 切分使用的采样率
+    sample_rate = 32000
+
+    def __init__(self, input_path="./", output_path="./out", write_clips=True, max_workers=None,
+                 volume_threshold=-34, hop_size=10, min_split_interval=300, max_sil_kept=500, min_length=4000,
+                 max_amplitude=0.9, alpha_mix=0.25):
         # volume_threshold: 音量小于这个值视作静音的备选切割点
-        self.volume_threshold = -34
+        self.volume_threshold = volume_threshold
         # hop_size: 怎么算音量曲线，越小精度越大计算量越高（不是精度越大效果越好）
-        self.hop_size = 10
+        self.hop_size = hop_size
         # split_interval: 最短切割间隔
-        self.min_split_interval = 300
+        self.min_split_interval = min_split_interval
         # split_interval 每段最小多长，如果第一段太短一直和后面段连起来直到超过这个值，单位毫秒
         # max_sil_kept: 切完后静音最多留多长, 单位毫秒
-        self.max_sil_kept = 500
+        self.max_sil_kept = max_sil_kept
         # min_length: 每段最小多长，如果第一段太短一直和后面段连起来直到超过这个值
-        self.min_length = 4000
+        self.min_length = min_length
         self.input_path = file_util.path_strip(input_path)
         self.output_path = file_util.path_strip(output_path)
+        # 是否把切出来的片段写成 wav 文件，关闭后只在内存里产出
+        self.write_clips = write_clips
+        # 当前处理进度 0~1，供 iter_chunks 的调用方读取
+        self.progress = 0.0
 
         # 音频归一化后最大值
-        self._max = 0.9
+        self._max = max_amplitude
         # 混多少比例归一化后音频进来
-        self.alpha_mix = 0.25
+        self.alpha_mix = alpha_mix
 
-        # 处理进程列表，用于join
-        self.thread_list = []
+        # 目录输入时并行切分的进程数
+        if max_workers is None:
+            max_workers = EnvHelper.get_int('SPLIT_WORKERS') or os.cpu_count() or 1
+        self.max_workers = max(1, int(max_workers))
+        self._executor = None
 
         self.exit_event = threading.Event()
 
     def begin_slice(self):
+        """
+        切分所有输入文件并写入 output_path
+        :return: 成功返回 None，否则返回错误信息
+        """
         if not os.path.exists(self.input_path):
             return "输入路径不存在"
 
         os.makedirs(self.output_path, exist_ok=True)
+        input_files = self._input_files()
+
+        errors = []
+        if len(input_files) <= 1 or self.max_workers <= 1:
+            for one_file in input_files:
+                if self.exit_event.is_set():
+                    break
+                try:
+                    self._split_wav_file(one_file)
+                except Exception as e:
+                    errors.append(f"{one_file}: {e}")
+        else:
+            # 每个文件在独立进程里解码和切分，绕开 GIL；进程数有上限
+            params = self._params()
+            with ProcessPoolExecutor(max_workers=min(self.max_workers, len(input_files))) as executor:
+                self._executor = executor
+                futures = {executor.submit(_split_file_worker, one_file, self.output_path, params): one_file
+                           for one_file in input_files}
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(f"{futures[future]}: {e}")
+            self._executor = None
+
+        if errors:
+            return "\n".join(errors)
+        return None
 
+    def close_slice(self):
+        self.exit_event.set()
+        executor = self._executor
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _input_files(self):
         input_files = []  # 待处理的文件列表
         if os.path.isfile(self.input_path):
             input_files = [self.input_path]
         elif os.path.isdir(self.input_path):
             input_files = [os.path.join(self.input_path, name) for name in sorted(list(os.listdir(self.input_path)))]
+        return input_files
 
-        for one_file in input_files:
-            t = threading.Thread(target=self._split_wav_file, args=(one_file,))
-            t.start()
-            self.thread_list.append(t)
+    def _params(self):
+        """
+        切分参数，和构造函数的参数同名，子进程用它构造相同配置的 Splitter
+        """
+        return {
+            'volume_threshold': self.volume_threshold,
+            'hop_size': self.hop_size,
+            'min_split_interval': self.min_split_interval,
+            'max_sil_kept': self.max_sil_kept,
+            'min_length': self.min_length,
+            'max_amplitude': self._max,
+            'alpha_mix': self.alpha_mix,
+        }
 
-        for t in self.thread_list:
-            t.join()
-        return None
+    @classmethod
+    def default_params(cls):
+        """
+        构造函数中切分参数的默认值，格式和 _params 相同，不需要创建实例
+        """
+        parameters = inspect.signature(cls.__init__).parameters
+        return {name: parameters[name].default for name in SPLIT_PARAMS}
 
-    def close_slice(self):
-        self.exit_event.set()
-        for t in self.thread_list:
-            if t.is_alive():
-                t.join()
+    def iter_chunks(self):
+        """
+        逐段产出 (片段路径, int16 音频, 采样率)，片段不落盘时路径只作为标识
+        """
+        if not os.path.exists(self.input_path):
+            raise RuntimeError("输入路径不存在")
+
+        if self.write_clips:
+            os.makedirs(self.output_path, exist_ok=True)
+
+        input_files = self._input_files()
+
+        self.progress = 0.0
+        for index, one_file in enumerate(input_files):
+            if self.exit_event.is_set():
+                return
+            for clip_path, chunk, fraction in self._iter_file_chunks(one_file):
+                self.progress = (index + fraction) / len(input_files)
+                yield clip_path, chunk, self.sample_rate
+        self.progress = 1.0
 
     def _split_wav_file(self, file):
+        for _ in self._iter_file_chunks(file):
+            pass
+
+    def _iter_file_chunks(self, file):
         slicer = Slicer(
-            sr=32000,  # 长音频采样率
+            sr=self.sample_rate,  # 长音频采样率
             threshold=int(self.volume_threshold),  # 音量小于这个值视作静音的备选切割点
             min_length=int(self.min_length),  # 每段最小多长，如果第一段太短一直和后面段连起来直到超过这个值
             min_interval=int(self.min_split_interval),  # 最短切割间隔
@@ -76,20 +169,33 @@ class Splitter:
 
         try:
             name = os.path.basename(file)
-            audio = file_util.load_audio(file, 32000)
-
-            for chunk, start, end in slicer.slice(audio):  # start和end是帧数
-                tmp_max = np.abs(chunk).max()
-                if tmp_max > 1:
-                    chunk /= tmp_max
-                chunk = (chunk / tmp_max * (self._max * self.alpha_mix)) + (1 - self.alpha_mix) * chunk
-                wavfile.write(
-                    "%s/%s_%010d_%010d.wav" % (self.output_path, name, start, end),
-                    32000,
-                    # chunk.astype(np.float32),
-                    (chunk * 32767).astype(np.int16),
-                )
+            duration = file_util.wav_duration(file)
+            total_samples = duration * self.sample_rate if duration else 0
+            # 流式解码+切分，内存占用和输入长度无关
+            blocks = file_util.iter_audio_blocks(file, self.sample_rate)
+
+            for chunk, start, end in slicer.iter_slice_stream(blocks):  # start和end是采样点位置
+                tmp_max = np.abs(chunk).max() if chunk.size else 0
+                # 全零（或空）的片段不做归一化，否则 0 / 0 得到 NaN
+                if tmp_max > 0:
+                    if tmp_max > 1:
+                        chunk /= tmp_max
+                    chunk = (chunk / tmp_max * (self._max * self.alpha_mix)) + (1 - self.alpha_mix) * chunk
+                chunk = (chunk * 32767).astype(np.int16)
+                clip_path = "%s/%s_%010d_%010d.wav" % (self.output_path, name, start, end)
+                if self.write_clips:
+                    wavfile.write(clip_path, self.sample_rate, chunk)
+                yield clip_path, chunk, min(end / total_samples, 1.0) if total_samples else 0.0
             # print(file, " Done")
         except Exception as e:
-            print(file, "->fail->", traceback.format_exc())
-            raise RuntimeError(f"Failed to split audio: {e}")
+            # 不在这里打印：错误（包括子进程里的）由 begin_slice 汇总成返回的错误信息，原始异常作为 __cause__ 保留
+            raise RuntimeError(f"Failed to split audio {os.path.basename(file)}: {e}") from e
+
+
+def _split_file_worker(file, output_path, params):
+    # 在子进程中执行，返回切出的片段数
+    splitter = Splitter(file, output_path, max_workers=1, **params)
+    count = 0
+    for _ in splitter._iter_file_chunks(file):
+        count += 1
+    return count
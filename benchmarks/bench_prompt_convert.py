@@ -0,0 +1,97 @@
+# 对比 merge_messages 原来的字符串拼接 + 随机令牌实现和单次遍历实现，并检查两者输出一致；
+# 再对比会话中每次请求整段处理和用会话提示词缓存增量处理的耗时
+# 用法: python -m benchmarks.bench_prompt_convert [--turns 50 500 2000] [--cases 300]
+import copy
+import random
+import time
+from argparse import ArgumentParser
+
+from chat_function.prompt_cache import SessionPromptCache
+from tests.reference import MODES, legacy_merge_messages, random_history
+from utils.prompt_convert import MessageMerger, PromptNames, merge_messages
+
+
+def check_equivalence(rng, cases, names):
+    """
+    随机对话历史在各模式下两种实现的输出必须完全一致，新实现不能修改传入的消息
+    """
+    for case in range(cases):
+        messages = random_history(rng, rng.randint(0, 40))
+        for mode, (strict, placeholders) in MODES.items():
+            snapshot = copy.deepcopy(messages)
+            expected = legacy_merge_messages(copy.deepcopy(messages), names, strict, placeholders)
+            actual = merge_messages(messages, names, strict, placeholders)
+            if expected != actual:
+                raise AssertionError(f"case {case} mode {mode}: outputs differ\n{messages}\n{expected}\n{actual}")
+            if messages != snapshot:
+                raise AssertionError(f"case {case} mode {mode}: input messages were modified")
+
+            # 分两次追加的结果和整段处理一致，并且不影响第一次的结果
+            split = rng.randint(0, len(messages))
+            prefix = MessageMerger(names, strict, placeholders).extend(messages[:split])
+            prefix_result = prefix.result()
+            if prefix.extend(messages[split:]).result() != actual:
+                raise AssertionError(f"case {case} mode {mode}: incremental output differs at {split}")
+            if prefix.result() != prefix_result:
+                raise AssertionError(f"case {case} mode {mode}: extend modified the cached prefix")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--turns", type=int, nargs="+", default=[50, 500, 2000])
+    parser.add_argument("--cases", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = PromptNames(char_name='Alice', user_name='Bob', group_names=['Alice', 'Carol'])
+
+    check_equivalence(rng, args.cases, names)
+    print(f"equivalence: {args.cases} random histories x {len(MODES)} modes identical")
+
+    print(f"{'turns':>6} {'mode':>7} {'legacy (ms)':>12} {'single pass (ms)':>17} {'speedup':>8}")
+    for turns in args.turns:
+        messages = random_history(rng, turns)
+        for mode, (strict, placeholders) in MODES.items():
+            copies = [copy.deepcopy(messages) for _ in range(args.repeat)]
+            begin = time.perf_counter()
+            for history in copies:
+                legacy_merge_messages(history, names, strict, placeholders)
+            legacy_ms = (time.perf_counter() - begin) * 1000 / args.repeat
+
+            begin = time.perf_counter()
+            for _ in range(args.repeat):
+                merge_messages(messages, names, strict, placeholders)
+            single_ms = (time.perf_counter() - begin) * 1000 / args.repeat
+
+            print(f"{turns:>6d} {mode:>7} {legacy_ms:>12.3f} {single_ms:>17.3f} "
+                  f"{legacy_ms / max(single_ms, 1e-9):>7.1f}x")
+
+    print()
+    print(f"{'turns':>6} {'mode':>7} {'full (ms/req)':>14} {'session cache (ms/req)':>23} {'speedup':>8}")
+    for turns in args.turns:
+        history = random_history(rng, turns)
+        # 每次请求比上一次多一轮对话（两条消息），只统计最后 20 次请求
+        requests = [history[:end] for end in range(max(turns - 40, 0), turns + 1, 2)]
+        for mode, (strict, placeholders) in MODES.items():
+            begin = time.perf_counter()
+            for messages in requests:
+                merge_messages(messages, names, strict, placeholders)
+            full_ms = (time.perf_counter() - begin) * 1000 / len(requests)
+
+            cache = SessionPromptCache(max_sessions=10, ttl=3600)
+            cache.process('session', requests[0], mode, lambda: MessageMerger(names, strict, placeholders))
+            begin = time.perf_counter()
+            for messages in requests[1:]:
+                result = cache.process('session', messages, mode, lambda: MessageMerger(names, strict, placeholders))
+            cached_ms = (time.perf_counter() - begin) * 1000 / max(len(requests) - 1, 1)
+            if result != merge_messages(requests[-1], names, strict, placeholders):
+                raise AssertionError(f"{turns} turns mode {mode}: session cache output differs")
+
+            print(f"{turns:>6d} {mode:>7} {full_ms:>14.3f} {cached_ms:>23.3f} "
+                  f"{full_ms / max(cached_ms, 1e-9):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
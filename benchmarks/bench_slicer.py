@@ -0,0 +1,41 @@
+# 对比 Slicer 静音检测的逐帧循环实现和向量化实现
+# 用法: python -m benchmarks.bench_slicer [--minutes 1 10 60]
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from ai_components.AudioSpliter.slicer import Slicer
+from tests.reference import legacy_sil_tags, synthetic_rms
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10, 60])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # 和 Splitter 相同的参数，hop 为 10ms
+    slicer = Slicer(sr=32000, threshold=-34, min_length=4000, min_interval=300, hop_size=10, max_sil_kept=500)
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'minutes':>8} {'frames':>10} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8} {'same':>6}")
+    for minutes in args.minutes:
+        frames = int(minutes * 60 * 100)
+        rms_list = synthetic_rms(frames, rng)
+
+        begin = time.perf_counter()
+        expected = legacy_sil_tags(slicer, rms_list)
+        loop_seconds = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        actual = slicer._get_sil_tags(rms_list)
+        vector_seconds = time.perf_counter() - begin
+
+        same = [tuple(map(int, t)) for t in expected] == [tuple(map(int, t)) for t in actual]
+        print(f"{minutes:>8g} {frames:>10d} {loop_seconds:>10.4f} {vector_seconds:>15.4f} "
+              f"{loop_seconds / max(vector_seconds, 1e-9):>7.1f}x {str(same):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# 并发负载下对比在事件循环中直接调用同步的 mysql_helper 和通过 async_db 在线程池中调用：
+# 吞吐量和事件循环的最大延迟（流式转发对延迟敏感），另一个连接周期性持有写锁时再测一次；
+# 最后检查按批读取和超时中止
+# 用法: python -m benchmarks.bench_sqlite [--clients 50] [--ops 200] [--rows 200000] [--hold-ms 50]
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+
+from database import async_db, mysql_helper
+
+
+async def heartbeat(interval, lags, stop):
+    """
+    每 interval 秒醒来一次，记录实际醒来比预期晚了多久
+    """
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+
+async def sync_client(client, ops):
+    for i in range(ops):
+        mysql_helper.write_db_para('INSERT OR REPLACE INTO bench (id, value) VALUES (?, ?)',
+                                   (client * ops + i, f'value {i}'))
+        mysql_helper.read_db_para('SELECT value FROM bench WHERE id = ?', (client * ops + i,))
+        # 让出事件循环，和真实的请求处理一样
+        await asyncio.sleep(0)
+
+
+async def async_client(client, ops):
+    for i in range(ops):
+        await async_db.execute('INSERT OR REPLACE INTO bench (id, value) VALUES (?, ?)',
+                               (client * ops + i, f'value {i}'))
+        await async_db.query('SELECT value FROM bench WHERE id = ?', (client * ops + i,))
+
+
+def hold_write_lock(hold, stop):
+    """
+    模拟其他进程的写事务：持有写锁 hold 秒，释放 hold 秒，循环
+    """
+    conn = mysql_helper.connect()
+    try:
+        while not stop.is_set():
+            conn.execute('BEGIN IMMEDIATE')
+            time.sleep(hold)
+            conn.commit()
+            time.sleep(hold)
+    finally:
+        mysql_helper.disconnect(conn)
+
+
+async def run_load(name, client_fn, clients, ops):
+    mysql_helper.execute('DELETE FROM bench')
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(heartbeat(0.005, lags, stop))
+    begin = time.perf_counter()
+    await asyncio.gather(*(client_fn(client, ops) for client in range(clients)))
+    seconds = time.perf_counter() - begin
+    stop.set()
+    await monitor
+    count = (await async_db.query('SELECT count(*) FROM bench'))[0][0]
+    assert count == clients * ops, f"{name}: expected {clients * ops} rows, got {count}"
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] if lags else 0.0
+    print(f"{name:>16} {clients * ops * 2 / seconds:>10.0f} {max(lags, default=0) * 1000:>14.1f} {p99 * 1000:>14.1f}")
+
+
+async def check_iterate(rows):
+    await async_db.execute('DELETE FROM bench')
+    await async_db.execute_many('INSERT INTO bench (id, value) VALUES (?, ?)',
+                                ((i, 'x' * 100) for i in range(rows)))
+    begin = time.perf_counter()
+    count = 0
+    async for _ in async_db.iterate('SELECT id, value FROM bench', batch_size=1000):
+        count += 1
+    assert count == rows, f"iterate: expected {rows} rows, got {count}"
+    print(f"iterate: {rows} rows in {time.perf_counter() - begin:.2f}s, 1000 rows per batch")
+
+    # 提前退出时连接被关闭
+    async for _ in async_db.iterate('SELECT id FROM bench'):
+        break
+
+
+async def check_timeout():
+    slow = ('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000000) '
+            'SELECT count(*) FROM n')
+    begin = time.perf_counter()
+    try:
+        await async_db.query(slow, timeout=0.2)
+        raise AssertionError('slow query was not interrupted')
+    except asyncio.TimeoutError:
+        pass
+    # 中止后线程池可以继续使用
+    await async_db.query('SELECT 1', timeout=1)
+    print(f"timeout: slow query interrupted after {time.perf_counter() - begin:.2f}s")
+
+
+async def main_async(args):
+    print(f"{'mode':>16} {'ops/s':>10} {'max lag (ms)':>14} {'p99 lag (ms)':>14}")
+    await run_load('sync', sync_client, args.clients, args.ops)
+    await run_load('async', async_client, args.clients, args.ops)
+
+    stop = threading.Event()
+    locker = threading.Thread(target=hold_write_lock, args=(args.hold_ms / 1000, stop), daemon=True)
+    locker.start()
+    try:
+        await run_load('sync, contended', sync_client, args.clients, args.ops // 10)
+        await run_load('async, contended', async_client, args.clients, args.ops // 10)
+    finally:
+        stop.set()
+        locker.join()
+    await check_iterate(args.rows)
+    await check_timeout()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--hold-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mysql_helper.SQLITE_PATH = os.path.join(tmp, 'bench.db')
+        mysql_helper.execute('CREATE TABLE bench (id INTEGER PRIMARY KEY, value TEXT)')
+        try:
+            asyncio.run(main_async(args))
+        finally:
+            async_db.shutdown()
+            mysql_helper.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# /generate 的取消登记：每个请求一个不重复的 ID 和 asyncio.Event，
+# 通过 DELETE /generate/{id} 或客户端断开设置事件，下游的排队、重试和流式转发都会随之中止
+import asyncio
+import uuid
+from typing import Dict, Optional, Tuple
+
+from utils import metrics
+
+active_requests = metrics.Gauge('generate_active_requests', 'In-progress /generate requests')
+cancelled_requests = metrics.Counter('generate_cancelled_total', 'Cancelled /generate requests', ['reason'])
+
+
+class CancellationRegistry:
+    def __init__(self):
+        self._events: Dict[str, asyncio.Event] = {}
+
+    def register(self) -> Tuple[str, asyncio.Event]:
+        request_id = uuid.uuid4().hex
+        event = self._events[request_id] = asyncio.Event()
+        active_requests.set(len(self._events))
+        return request_id, event
+
+    def get(self, request_id: str) -> Optional[asyncio.Event]:
+        return self._events.get(request_id)
+
+    def cancel(self, request_id: str, reason: str = 'api') -> bool:
+        event = self._events.get(request_id)
+        if event is None:
+            return False
+        if not event.is_set():
+            event.set()
+            cancelled_requests.inc(reason=reason)
+        return True
+
+    def unregister(self, request_id: str):
+        if self._events.pop(request_id, None) is not None:
+            active_requests.set(len(self._events))
+
+    def __len__(self):
+        return len(self._events)
+
+
+registry = CancellationRegistry()
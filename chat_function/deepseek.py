@@ -1,15 +1,33 @@
 import json
 import asyncio
 import logging
-from typing import Dict, List, Any, Union
+import time
+from typing import Callable, Dict, List, Any, Optional, Union
 from fastapi.responses import StreamingResponse, JSONResponse
 import httpx
-from env_helper import EnvHelper
+from utils import metrics
 from .config import *
+from .http_client import get_client
+from .sse import UsageChunkFilter
+from .usage import UPSTREAM_INCLUDE_USAGE, UsageTracker
+from .token_budget import apply_budget, count_prompt_tokens
+from .request_params import InvalidParameter
+from .prompt_cache import process_prompt
+from .upstreams import UpstreamPool, default_pool, reverse_proxy_pool
+from .retry import RETRYABLE_ERRORS, RetryPolicy, default_policy as default_retry_policy, parse_retry_after, wait_or_cancel
+from .single_flight import single_flight
+from .rate_limit import Admission, RateLimitExceeded, estimate_request_tokens, queue_params, rate_limit_enabled, release_when_done
+from .response_cache import response_cache, is_cacheable, make_key as make_cache_key, cached_response, store_response
 
-API_DEEPSEEK = 'https://api.deepseek.com/'
 logger = logging.getLogger(__name__)
 
+# 转发流式响应时不透传的头：aiter_bytes 已经解压，长度和编码由 Starlette 重新决定
+HOP_BY_HOP_HEADERS = {
+    'content-length', 'content-encoding', 'transfer-encoding', 'connection', 'keep-alive',
+}
+
+upstream_ttfb = metrics.Histogram('upstream_ttfb_seconds', 'Time to first upstream byte', ['stream'])
+
 # 文本完成模型列表
 TEXT_COMPLETION_MODELS = [
     # 在这里添加文本完成模型的列表
@@ -41,16 +59,19 @@ TEXT_COMPLETION_MODELS = [
 ]
 
 
-async def send_deepseek_request(request_data: Dict[str, Any], cancel_event: asyncio.Event):
+async def send_deepseek_request(request_data: Dict[str, Any], cancel_event: asyncio.Event,
+                                uid: Optional[str] = None, session_id: Optional[str] = None):
     """
-    发送请求到Deepseek API
+    发送请求到Deepseek API，uid 用于按用户汇总用量，session_id 用于增量处理同一会话的提示词
     """
-    api_url = API_DEEPSEEK
-    api_key = EnvHelper.get_env_value('API_KEY')
-
-    if not api_key and not request_data.get('reverse_proxy'):
-        logger.error('Deepseek API key is missing.')
-        return JSONResponse(status_code=400, content={"error": True})
+    # 请求里指定了反向代理时直接发给它，否则在 .env 配置的上游之间负载均衡
+    if request_data.get('reverse_proxy'):
+        upstreams = reverse_proxy_pool(request_data['reverse_proxy'], request_data.get('proxy_password'))
+    else:
+        upstreams = default_pool()
+        if not any(upstream.api_key for upstream in upstreams.upstreams):
+            logger.error('Deepseek API key is missing.')
+            return JSONResponse(status_code=400, content={"error": True})
 
     # 初始化请求参数
     headers = {}
@@ -62,7 +83,7 @@ async def send_deepseek_request(request_data: Dict[str, Any], cancel_event: asyn
         request_data.get('messages'), str)
 
     # 根据is_text_completion的值决定是否转换文本补全提示
-    text_prompt = convert_text_completion_prompt(request_data['messages']) if is_text_completion else ''
+    text_prompt = await convert_text_completion_prompt(request_data['messages']) if is_text_completion else ''
     # 如果不是文本补全请求，并且请求中包含工具数组且不为空
     if not is_text_completion and isinstance(request_data.get('tools'), list) and len(
             request_data.get('tools', [])) > 0:
@@ -74,18 +95,39 @@ async def send_deepseek_request(request_data: Dict[str, Any], cancel_event: asyn
         body_params['top_logprobs'] = request_data['logprobs']
         body_params['logprobs'] = True
 
-    # 处理消息
-    messages = post_process_prompt(
-        request_data['messages'],
-        'deepseek',
-        get_prompt_names(request_data)
-    )
+    # 处理消息，同一会话只处理上次请求之后新增的消息
+    names = get_prompt_names(request_data)
+    if session_id and isinstance(request_data['messages'], list):
+        messages = process_prompt(
+            (uid or '', session_id),
+            request_data['messages'],
+            ('deepseek', tuple(sorted(names.items()))),
+            lambda: ProcessedMessages('deepseek', names)
+        )
+    else:
+        messages = post_process_prompt(request_data['messages'], 'deepseek', names)
+
+    # 按上下文预算裁剪最早的对话轮次
+    try:
+        messages, budget_headers = apply_budget(request_data, messages) if not is_text_completion else (messages, {})
+        # 限流排队的优先级和最长等待时间
+        priority, queue_timeout = queue_params(request_data)
+    except InvalidParameter as e:
+        return _invalid_parameter(e)
 
     # 添加自定义停止序列
     if isinstance(request_data.get('stop'), list) and len(request_data['stop']) > 0:
         body_params['stop'] = request_data['stop']
 
     # 构建请求体
+    # 客户端的 stream_options 原样透传；只有配置的上游在开启 UPSTREAM_INCLUDE_USAGE 时才额外请求 usage
+    stream = request_data.get('stream', False)
+    stream_options = request_data.get('stream_options') if stream else None
+    client_usage = isinstance(stream_options, dict) and bool(stream_options.get('include_usage'))
+    inject_usage = bool(stream) and UPSTREAM_INCLUDE_USAGE and not client_usage and not request_data.get('reverse_proxy')
+    if inject_usage:
+        stream_options = {**(stream_options if isinstance(stream_options, dict) else {}), 'include_usage': True}
+
     request_body = {
         'messages': messages if not is_text_completion else None,
         # 如果是文本补全请求，则包含prompt字段
@@ -95,6 +137,7 @@ async def send_deepseek_request(request_data: Dict[str, Any], cancel_event: asyn
         'max_tokens': request_data.get('max_tokens', DEFAULT_MAX_TOKENS),
         'max_completion_tokens': request_data.get('max_completion_tokens'),
         'stream': request_data.get('stream', False),
+        'stream_options': stream_options,
         'presence_penalty': request_data.get('presence_penalty', DEFAULT_PRESENCE_PENALTY),
         'frequency_penalty': request_data.get('frequency_penalty', DEFAULT_FREQUENCY_PENALTY),
         'top_p': request_data.get('top_p', 1),
@@ -108,15 +151,66 @@ async def send_deepseek_request(request_data: Dict[str, Any], cancel_event: asyn
 
     logger.info(f"Deepseek request: {request_body}")
 
-    # 发送请求
-    return await make_request(
-        api_url=api_url,
-        api_key=api_key,
-        request_body=request_body,
-        cancel_event=cancel_event,
-        stream=request_data.get('stream', False),
-        headers=headers
-    )
+    # 确定性的请求先查响应缓存，请求里传 cache=false 可以跳过
+    cache_key = None
+    if request_data.get('cache', True) and is_cacheable(request_body):
+        # 反向代理的地址可能被不同账号共用，缓存键带上凭据（proxy_password 或配置的密钥）的摘要
+        credential = '\0'.join(sorted(upstream.api_key or '' for upstream in upstreams.upstreams))
+        cache_key = make_cache_key(upstreams.name, request_body, credential)
+        cached = await response_cache.get(cache_key) if response_cache is not None else None
+        if cached is not None:
+            logger.info(f"Deepseek response served from cache: {cache_key}")
+            return _with_headers(cached_response(cached, stream, client_usage), budget_headers)
+
+    async def fetch(upstream_cancel: asyncio.Event):
+        # 按所选上游的账号和模型的 RPM/TPM/并发限制排队，在 make_request 选定上游后进行
+        admission = Admission(
+            request_body['model'],
+            estimate_request_tokens(request_body),
+            priority=priority,
+            queue_timeout=queue_timeout,
+            cancel_event=upstream_cancel) if rate_limit_enabled() else None
+
+        # 发送请求
+        try:
+            response = await make_request(
+                upstreams=upstreams,
+                request_body=request_body,
+                cancel_event=upstream_cancel,
+                stream=stream,
+                headers=headers,
+                usage_tracker=UsageTracker(request_body['model'], uid,
+                                           count_prompt=lambda: count_prompt_tokens(request_body)),
+                admission=admission,
+                drop_usage_chunk=inject_usage
+            )
+        except BaseException:
+            if admission is not None:
+                admission.release()
+            raise
+        if admission is not None:
+            response = release_when_done(response, admission)
+        if cache_key is not None:
+            response = store_response(cache_key, response, stream)
+        return response
+
+    # 相同的确定性请求并发到达时合并成一个上游请求
+    if cache_key is not None and single_flight is not None:
+        response = await single_flight.do(f"{cache_key}:{int(bool(stream))}", fetch, cancel_event)
+    else:
+        response = await fetch(cancel_event)
+    return _with_headers(response, budget_headers)
+
+
+def _invalid_parameter(error: InvalidParameter) -> JSONResponse:
+    logger.warning(f"Invalid request parameter: {error}")
+    return JSONResponse(status_code=400, content={"error": {"message": str(error)}})
+
+
+def _with_headers(response, headers: Dict[str, str]):
+    for key, value in headers.items():
+        response.headers[key] = value
+    return response
 
 
 async def convert_text_completion_prompt(messages: Union[List[Dict[str, Any]], str]) -> str:
@@ -153,102 +247,178 @@ async def convert_text_completion_prompt(messages: Union[List[Dict[str, Any]], s
 
 
 async def make_request(
-        api_url: str,
-        api_key: str,
+        upstreams: UpstreamPool,
         headers,
         request_body: Dict[str, Any],
         cancel_event: asyncio.Event,
         stream: bool = False,
-        retries: int = 5,
-        timeout: int = 5000
+        retry_policy: Optional[RetryPolicy] = None,
+        client: Optional[httpx.AsyncClient] = None,
+        usage_tracker: Optional[UsageTracker] = None,
+        admission: Optional[Admission] = None,
+        drop_usage_chunk: bool = False
 
 ) -> Union[JSONResponse, StreamingResponse]:
     """
-    向API端点发送请求
+    向API端点发送请求，429/5xx 和连接错误按 retry_policy 重试，有其他可用上游时立即切换过去重试
+    client 默认使用共享连接池，测试时可以传入指向模拟上游的客户端
+    usage_tracker 不为空时，成功的响应会统计 token 用量
+    admission 不为空时，每次发送前按所选上游的 API key 排队，返回后名额由调用方归还
+    drop_usage_chunk 为 True 时，流式响应中只有 usage 的 chunk 只用于统计，不转发给客户端
     """
+    retry_policy = retry_policy or default_retry_policy
+    # 使用共享连接池发送异步请求
+    client = client or get_client()
+    upstream = upstreams.select()
+    if upstream is None:
+        logger.error('No Deepseek upstream configured.')
+        return JSONResponse(status_code=502, content={"error": {"message": "No upstream configured"}})
+    # 本次请求中失败过的上游，重试时优先换一个
+    tried = []
+    attempt = 0
     try:
-        # 检查是否已取消
-        if cancel_event.is_set():
-            logger.info('Request cancelled by client')
-            return JSONResponse(status_code=499, content={"error": {"message": "Request cancelled by client"}})
-
-        # 使用httpx发送异步请求
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.post(
-                f"{api_url}/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {api_key}",
-                    **headers
-                },
-                json=request_body
-            )
-
+        while True:
             # 检查是否已取消
+            if cancel_event.is_set():
+                logger.info('Request cancelled by client')
+                return _cancelled_response()
+
+            if admission is not None:
+                try:
+                    admitted = await admission.acquire(upstream.api_key or upstream.base_url)
+                except RateLimitExceeded as e:
+                    logger.warning(f"Deepseek request rejected by rate limiter: {e}")
+                    return JSONResponse(status_code=429, content={"error": {"message": str(e)}},
+                                        headers={'Retry-After': str(int(e.retry_after + 0.999))})
+                if not admitted:
+                    logger.info('Request cancelled by client while queued')
+                    return _cancelled_response()
+
+            attempt += 1
+            request_headers = {"Content-Type": "application/json", **headers}
+            if upstream.api_key:
+                request_headers["Authorization"] = f"Bearer {upstream.api_key}"
+            current = upstream
+            upstreams.start(current)
+            streaming = False
+            try:
+                try:
+                    # 只等到响应头返回，响应体按需读取
+                    started = time.monotonic()
+                    response = await _send_cancellable(
+                        client,
+                        client.build_request("POST", f"{upstream.base_url}/chat/completions",
+                                             headers=request_headers, json=request_body),
+                        cancel_event)
+                except RETRYABLE_ERRORS as error:
+                    upstreams.record_failure(upstream)
+                    tried.append(upstream)
+                    if not retry_policy.should_retry(attempt, error=error):
+                        raise
+                    next_upstream = upstreams.select(exclude=tried)
+                    delay = retry_policy.backoff(attempt) if next_upstream is upstream else 0.0
+                    logger.warning(f"Upstream {upstream.name} connection failed ({error!r}), "
+                                   f"retrying on {next_upstream.name} in {delay:.1f}s")
+                    if await wait_or_cancel(delay, cancel_event):
+                        logger.info('Request cancelled by client during retry')
+                        return _cancelled_response()
+                    upstream = next_upstream
+                    continue
+
+                # 检查是否已取消
+                if response is None:
+                    logger.info('Request cancelled by client before response received')
+                    return _cancelled_response()
+
+                # 处理流式响应：收到的字节直接转发给客户端
+                if stream and response.status_code == 200:
+                    header_seconds = time.monotonic() - started
+                    upstreams.record_success(upstream, header_seconds)
+                    logger.info(f'Streaming request in progress on {upstream.name}, '
+                                f'upstream headers in {header_seconds * 1000:.0f}ms')
+                    response_headers = {
+                        key: value for key, value in response.headers.items()
+                        if key.lower() not in HOP_BY_HOP_HEADERS
+                    }
+                    # 避免 nginx 等反向代理缓冲 SSE
+                    response_headers['X-Accel-Buffering'] = 'no'
+                    response_headers['X-Upstream-TTFB-ms'] = str(round(header_seconds * 1000))
+                    # 进行中的请求数在流结束时才减少
+                    streaming = True
+                    if usage_tracker is not None:
+                        usage_tracker.started = started
+                    return StreamingResponse(
+                        _stream_upstream(response, cancel_event, started,
+                                         on_close=lambda: upstreams.finish(current),
+                                         usage_tracker=usage_tracker,
+                                         usage_filter=UsageChunkFilter() if drop_usage_chunk else None),
+                        status_code=response.status_code,
+                        headers=response_headers
+                    )
+
+                # 非流式响应以及流式请求的错误响应，读完响应体后释放连接
+                try:
+                    await response.aread()
+                finally:
+                    await response.aclose()
+            finally:
+                if not streaming:
+                    upstreams.finish(current)
+
+            upstream_ttfb.observe(time.monotonic() - started, stream='false')
+            # 5xx 计入上游的健康检查，4xx 是请求本身的问题
+            if response.status_code >= 500:
+                upstreams.record_failure(upstream)
+            else:
+                upstreams.record_success(upstream, time.monotonic() - started)
+
             if cancel_event.is_set():
                 logger.info('Request cancelled by client after response received')
-                return JSONResponse(status_code=499, content={"error": {"message": "Request cancelled by client"}})
-
-            # 处理流式响应
-            if stream:
-                logger.info('Streaming request in progress')
-
-                # 创建异步生成器
-                async def stream_response():
-                    async for chunk in response.aiter_bytes():
-                        # 检查是否已取消
-                        if cancel_event.is_set():
-                            logger.info('Request cancelled during streaming')
-                            break
-                        yield chunk
-
-                # 返回StreamingResponse
-                return StreamingResponse(
-                    stream_response(),
-                    status_code=response.status_code,
-                    headers=dict(response.headers)
-                )
-
-            # 处理非流式响应
+                return _cancelled_response()
+
             if response.status_code == 200:
                 json_data = response.json()
                 logger.info(f"Deepseek response: {json_data}")
+                if usage_tracker is not None:
+                    usage_tracker.started = started
+                    usage_tracker.record_completion(json_data)
+                    usage_tracker.finish()
                 return JSONResponse(content=json_data)
-            elif response.status_code == 429 and retries > 0:
-                logger.info(f"Out of quota, retrying in {round(timeout / 1000)}s")
 
-                # 等待重试，但检查取消事件
-                for _ in range(int(timeout / 100)):
-                    if cancel_event.is_set():
-                        logger.info('Request cancelled by client during retry')
-                        return JSONResponse(status_code=499,
-                                            content={"error": {"message": "Request cancelled by client"}})
-                    await asyncio.sleep(0.1)
-
-                # 递归重试
-                return await make_request(
-                    api_url=api_url,
-                    api_key=api_key,
-                    request_body=request_body,
-                    cancel_event=cancel_event,
-                    stream=stream,
-                    retries=retries - 1,
-                    timeout=timeout * 2, headers=headers)
-            else:
-                # 处理错误响应
-                error_text = response.text
+            error_text = response.text
+            try:
                 error_data = json.loads(error_text) if error_text else {}
-
-                message = response.reason_phrase or 'Unknown error occurred'
-                quota_error = response.status_code == 429 and error_data.get('error', {}).get(
-                    'type') == 'insufficient_quota'
-
-                logger.error(f'Chat completion request error: {message} {error_text}')
-
-                return JSONResponse(
-                    status_code=response.status_code,
-                    content={"error": {"message": message}, "quota_error": quota_error}
-                )
+            except ValueError:
+                error_data = {}
+            error_info = error_data.get('error') if isinstance(error_data, dict) else None
+            quota_error = response.status_code == 429 and isinstance(error_info, dict) and error_info.get(
+                'type') == 'insufficient_quota'
+
+            # 余额不足只在有其他上游（其他账号）时才值得重试
+            tried.append(upstream)
+            retryable = not quota_error or upstreams.has_alternative(tried)
+            if retryable and retry_policy.should_retry(attempt, status_code=response.status_code):
+                next_upstream = upstreams.select(exclude=tried)
+                if next_upstream is upstream:
+                    delay = retry_policy.backoff(attempt, parse_retry_after(response.headers.get('retry-after')))
+                else:
+                    delay = 0.0
+                logger.info(f"Upstream {upstream.name} returned {response.status_code}, "
+                            f"retrying on {next_upstream.name} in {delay:.1f}s")
+                if await wait_or_cancel(delay, cancel_event):
+                    logger.info('Request cancelled by client during retry')
+                    return _cancelled_response()
+                upstream = next_upstream
+                continue
+
+            # 处理错误响应
+            message = response.reason_phrase or 'Unknown error occurred'
+            logger.error(f'Chat completion request error: {message} {error_text}')
+
+            return JSONResponse(
+                status_code=response.status_code,
+                content={"error": {"message": message}, "quota_error": quota_error}
+            )
 
     except httpx.ConnectError as error:
         # 处理连接错误
@@ -264,6 +434,103 @@ async def make_request(
         return JSONResponse(status_code=502, content={"error": {"message": message}})
 
 
+def _cancelled_response() -> JSONResponse:
+    return JSONResponse(status_code=499, content={"error": {"message": "Request cancelled by client"}})
+
+
+async def _send_cancellable(client: httpx.AsyncClient, request: httpx.Request,
+                            cancel_event: asyncio.Event) -> Optional[httpx.Response]:
+    """
+    发送请求并等待响应头；等待期间 cancel_event 被设置时中止上游请求并返回 None
+    """
+    send_task = asyncio.ensure_future(client.send(request, stream=True))
+    cancel_task = asyncio.ensure_future(cancel_event.wait())
+    try:
+        await asyncio.wait({send_task, cancel_task}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        # 外层被取消时也要中止上游请求
+        send_task.cancel()
+        raise
+    finally:
+        cancel_task.cancel()
+
+    if not send_task.done():
+        send_task.cancel()
+        try:
+            await send_task
+        except asyncio.CancelledError:
+            pass
+        if not send_task.cancelled():
+            # 取消前响应头刚好返回，释放连接
+            await send_task.result().aclose()
+        return None
+
+    response = send_task.result()
+    if cancel_event.is_set():
+        await response.aclose()
+        return None
+    return response
+
+
+async def _stream_upstream(response: httpx.Response, cancel_event: asyncio.Event, started: float,
+                           on_close: Optional[Callable[[], None]] = None,
+                           usage_tracker: Optional[UsageTracker] = None,
+                           usage_filter: Optional[UsageChunkFilter] = None):
+    """
+    把上游的响应体逐块转发给客户端，usage_filter 不为空时去掉只有 usage 的 chunk（统计仍然包含它）。
+    客户端断开时 Starlette 会取消这个生成器；cancel_event 被设置时即使上游暂时没有数据也立即结束。
+    两种情况都在 finally 里关闭上游响应，上游连接随之中止
+    """
+    first_chunk = True
+    chunks = response.aiter_bytes()
+    cancel_task = asyncio.ensure_future(cancel_event.wait())
+    next_chunk = None
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait({next_chunk, cancel_task}, return_when=asyncio.FIRST_COMPLETED)
+            # 检查是否已取消
+            if cancel_event.is_set():
+                logger.info('Request cancelled during streaming')
+                break
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                if usage_filter is not None:
+                    rest = usage_filter.flush()
+                    if rest:
+                        yield rest
+                break
+            if first_chunk:
+                first_chunk = False
+                ttfb = time.monotonic() - started
+                upstream_ttfb.observe(ttfb, stream='true')
+                logger.info(f'Upstream first byte in {ttfb * 1000:.0f}ms')
+            if usage_tracker is not None:
+                usage_tracker.feed(chunk)
+            if usage_filter is not None:
+                chunk = usage_filter.feed(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    except httpx.HTTPError as error:
+        # 响应头已经发出，只能记录错误并结束流
+        logger.error(f'Upstream stream interrupted: {error}')
+    finally:
+        cancel_task.cancel()
+        if next_chunk is not None:
+            if not next_chunk.done():
+                next_chunk.cancel()
+            elif not next_chunk.cancelled():
+                # 取消时已经读到的结果不再需要，取出异常避免 asyncio 报警
+                next_chunk.exception()
+        await response.aclose()
+        if on_close is not None:
+            on_close()
+        if usage_tracker is not None:
+            usage_tracker.finish()
+
+
 # 辅助函数
 def post_process_prompt(messages: List[Dict[str, Any]], in_type: str, names: Dict[str, str]) -> List[Dict[str, Any]]:
     """
@@ -281,6 +548,31 @@ def post_process_prompt(messages: List[Dict[str, Any]], in_type: str, names: Dic
         return messages
 
 
+class ProcessedMessages:
+    """
+    post_process_prompt 的增量形式：消息逐条处理，前缀的结果可以直接复用，供会话提示词缓存使用。
+    多个处理器共用一个列表，各自只看前 length 条；extend 在列表末尾就是自己的结尾时原地追加，
+    否则（同一前缀已经被追加过其他消息）先复制前 length 条
+    """
+
+    def __init__(self, in_type: str, names: Dict[str, str], messages: Optional[List[Dict[str, Any]]] = None,
+                 length: Optional[int] = None):
+        self.in_type = in_type
+        self.names = names
+        self._messages = messages if messages is not None else []
+        self._length = len(self._messages) if length is None else length
+
+    def extend(self, messages: List[Dict[str, Any]]) -> 'ProcessedMessages':
+        shared = self._messages
+        if len(shared) != self._length:
+            shared = shared[:self._length]
+        shared.extend(post_process_prompt(messages, self.in_type, self.names))
+        return ProcessedMessages(self.in_type, self.names, shared, len(shared))
+
+    def result(self) -> List[Dict[str, Any]]:
+        return self._messages[:self._length]
+
+
 def merge_messages(messages: List[Dict[str, Any]], names: Dict[str, str],
                    strict: bool = False, strict_system: bool = False) -> List[Dict[str, Any]]:
     """
@@ -0,0 +1,69 @@
+# 应用级共享的 httpx.AsyncClient：复用到上游的连接，避免每个请求重新握手
+import logging
+from typing import Optional
+
+import httpx
+from env_helper import EnvHelper
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_enabled() -> bool:
+    if not EnvHelper.get_bool('UPSTREAM_HTTP2', True):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning('UPSTREAM_HTTP2 is enabled but the h2 package is not installed, falling back to HTTP/1.1')
+        return False
+    return True
+
+
+def create_client() -> httpx.AsyncClient:
+    """
+    按 .env 配置创建连接池
+    """
+    limits = httpx.Limits(
+        max_connections=EnvHelper.get_int('UPSTREAM_MAX_CONNECTIONS', 100),
+        max_keepalive_connections=EnvHelper.get_int('UPSTREAM_MAX_KEEPALIVE', 20),
+        keepalive_expiry=EnvHelper.get_float('UPSTREAM_KEEPALIVE_EXPIRY', 30),
+    )
+    # 流式响应两个 chunk 之间可能间隔较久，read 超时要足够长
+    timeout = httpx.Timeout(
+        connect=EnvHelper.get_float('UPSTREAM_CONNECT_TIMEOUT', 10),
+        read=EnvHelper.get_float('UPSTREAM_READ_TIMEOUT', 300),
+        write=EnvHelper.get_float('UPSTREAM_WRITE_TIMEOUT', 30),
+        pool=EnvHelper.get_float('UPSTREAM_POOL_TIMEOUT', 10),
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=_http2_enabled())
+
+
+async def startup():
+    """
+    在 FastAPI lifespan 启动阶段调用
+    """
+    global _client
+    if _client is None:
+        _client = create_client()
+
+
+async def shutdown():
+    """
+    在 FastAPI lifespan 结束阶段调用，关闭所有连接
+    """
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    获取共享的客户端；没有经过 lifespan 启动时（例如脚本里直接调用）按需创建
+    """
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
@@ -0,0 +1,99 @@
+# 按会话缓存处理过的提示词：聊天客户端每次 /generate 都会重发完整的对话历史，
+# 新请求的消息以同一会话上一次请求的消息为前缀时，复用缓存的处理结果，只处理新增的消息
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from env_helper import EnvHelper
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_ENABLED = EnvHelper.get_bool('PROMPT_CACHE_ENABLED', True)
+PROMPT_CACHE_MAX_SESSIONS = EnvHelper.get_int('PROMPT_CACHE_MAX_SESSIONS', 1000)
+# 会话多久没有请求后丢弃（秒）
+PROMPT_CACHE_TTL = EnvHelper.get_float('PROMPT_CACHE_TTL', 1800)
+
+prompt_cache_requests = metrics.Counter('prompt_cache_requests_total', 'Session prompt cache lookups', ['result'])
+prompt_cache_sessions = metrics.Gauge('prompt_cache_sessions', 'Sessions in the prompt cache')
+
+
+class _Session:
+    __slots__ = ('signature', 'messages', 'processor', 'updated')
+
+    def __init__(self, signature: Hashable, messages: List[Dict[str, Any]], processor, updated: float):
+        self.signature = signature
+        self.messages = messages
+        self.processor = processor
+        self.updated = updated
+
+
+class SessionPromptCache:
+    """
+    processor 是增量处理器：extend(messages) 返回追加处理了这些消息的新处理器（原处理器不变），result() 返回处理结果。
+    前缀逐条和上次请求的原始消息比较，任何一条被编辑都整段重新处理
+
+    :param max_sessions: 最多缓存多少个会话，超出时淘汰最久没有请求的
+    :param ttl: 会话多久没有请求后失效（秒）
+    """
+
+    def __init__(self, max_sessions: int, ttl: float):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: 'OrderedDict[Hashable, _Session]' = OrderedDict()
+
+    def process(self, session_key: Hashable, messages: List[Dict[str, Any]], signature: Hashable,
+                create: Callable[[], Any]) -> List[Dict[str, Any]]:
+        """
+        :param session_key: 会话标识，例如 (uid, session_id)
+        :param signature: 影响处理结果的参数（处理方式、名称等），变化时不复用缓存
+        :param create: 创建空的处理器
+        """
+        now = time.monotonic()
+        processor = None
+        start = 0
+        session = self._sessions.get(session_key)
+        if session is not None and now - session.updated <= self.ttl and session.signature == signature:
+            known = len(session.messages)
+            # 列表比较在遇到第一条不同的消息时就会停止
+            if known <= len(messages) and messages[:known] == session.messages:
+                processor = session.processor
+                start = known
+
+        if processor is None:
+            prompt_cache_requests.inc(result='miss')
+            processor = create()
+        else:
+            prompt_cache_requests.inc(result='hit')
+        processor = processor.extend(messages[start:])
+
+        self._sessions[session_key] = _Session(signature, list(messages), processor, now)
+        self._sessions.move_to_end(session_key)
+        self._evict(now)
+        return processor.result()
+
+    def discard(self, session_key: Hashable):
+        self._sessions.pop(session_key, None)
+        prompt_cache_sessions.set(len(self._sessions))
+
+    def _evict(self, now: float):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) <= self.max_sessions and now - oldest.updated <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+        prompt_cache_sessions.set(len(self._sessions))
+
+
+session_prompts = SessionPromptCache(PROMPT_CACHE_MAX_SESSIONS, PROMPT_CACHE_TTL)
+
+
+def process_prompt(session_key: Optional[Hashable], messages: List[Dict[str, Any]], signature: Hashable,
+                   create: Callable[[], Any]) -> List[Dict[str, Any]]:
+    """
+    有会话标识且开启了缓存时增量处理，否则整段处理
+    """
+    if not PROMPT_CACHE_ENABLED or session_key is None:
+        return create().extend(messages).result()
+    return session_prompts.process(session_key, messages, signature, create)
@@ -0,0 +1,324 @@
+# 上游 LLM 调用的客户端限流：按账号 + 模型分别维护 RPM/TPM 令牌桶和并发上限，
+# 超出时按优先级排队，等待超过截止时间的请求直接返回 429，不再打到上游
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+
+from env_helper import EnvHelper
+from utils import metrics
+from .request_params import float_param, int_param
+from .token_budget import MODEL_CONTEXT_WINDOWS, count_prompt_tokens
+
+
+# 0 表示不限制
+RATE_LIMIT_RPM = EnvHelper.get_float('RATE_LIMIT_RPM', 0)
+RATE_LIMIT_TPM = EnvHelper.get_float('RATE_LIMIT_TPM', 0)
+RATE_LIMIT_CONCURRENCY = EnvHelper.get_int('RATE_LIMIT_CONCURRENCY', 0)
+RATE_LIMIT_MAX_QUEUE = EnvHelper.get_int('RATE_LIMIT_MAX_QUEUE', 1000)
+# 请求最多排队多少秒；请求体中的 queue_timeout 不能超过 RATE_LIMIT_MAX_QUEUE_TIMEOUT
+RATE_LIMIT_QUEUE_TIMEOUT = EnvHelper.get_float('RATE_LIMIT_QUEUE_TIMEOUT', 30)
+RATE_LIMIT_MAX_QUEUE_TIMEOUT = EnvHelper.get_float('RATE_LIMIT_MAX_QUEUE_TIMEOUT', 120)
+# 请求体中 priority 的取值范围是 [-RATE_LIMIT_MAX_PRIORITY, RATE_LIMIT_MAX_PRIORITY]
+RATE_LIMIT_MAX_PRIORITY = EnvHelper.get_int('RATE_LIMIT_MAX_PRIORITY', 100)
+# 单独计算配额的模型（逗号分隔），默认是已知上下文长度的模型；其他模型名共用一份配额，
+# 客户端传来的任意模型名不会各自创建限流器和指标
+RATE_LIMIT_MODELS = frozenset(
+    model.strip() for model in (EnvHelper.get_env_value('RATE_LIMIT_MODELS') or ','.join(MODEL_CONTEXT_WINDOWS))
+    .split(',') if model.strip())
+OTHER_MODEL = 'other'
+# 最多保留多少个 账号 + 模型 的限流器，超出时丢弃最久没有使用的空闲限流器（反向代理的密码也是账号）
+RATE_LIMIT_MAX_LIMITERS = EnvHelper.get_int('RATE_LIMIT_MAX_LIMITERS', 1000)
+
+queue_depth = metrics.Gauge('rate_limit_queue_depth', 'Requests waiting for the upstream rate limiter', ['model'])
+in_flight = metrics.Gauge('rate_limit_in_flight', 'Upstream requests admitted by the rate limiter', ['model'])
+wait_seconds = metrics.Histogram('rate_limit_wait_seconds', 'Time spent waiting for the upstream rate limiter',
+                                 ['model'])
+rejected = metrics.Counter('rate_limit_rejected_total', 'Requests rejected by the upstream rate limiter',
+                           ['model', 'reason'])
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    每分钟补充 per_minute 个令牌，最多存 per_minute 个
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        还要等多少秒才有 amount 个令牌；超过桶容量的请求按容量计算，否则永远无法放行
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ('tokens', 'future')
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class RateLimiter:
+    """
+    :param rpm: 每分钟请求数，0 表示不限制
+    :param tpm: 每分钟 token 数，0 表示不限制
+    :param concurrency: 同时进行的请求数，0 表示不限制
+    :param max_queue: 最多排队的请求数
+    """
+
+    def __init__(self, model: str, rpm: float = 0, tpm: float = 0, concurrency: int = 0, max_queue: int = 1000):
+        self.model = model
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiting = 0
+        # (-priority, 序号, waiter)，优先级高的先放行，同优先级先到先放行
+        self._queue = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, tokens: float, priority: int = 0, timeout: Optional[float] = None,
+                      cancel_event: Optional[asyncio.Event] = None) -> bool:
+        """
+        等待放行，成功返回 True，cancel_event 被设置时返回 False；
+        排队已满或等待超过 timeout 秒时抛出 RateLimitExceeded。放行后必须调用 release
+        """
+        if self._waiting >= self.max_queue:
+            rejected.inc(model=self.model, reason='queue_full')
+            raise RateLimitExceeded('Rate limit queue is full', self._retry_after(tokens))
+
+        waiter = _Waiter(tokens)
+        heapq.heappush(self._queue, (-priority, next(self._seq), waiter))
+        self._set_waiting(1)
+        started = time.monotonic()
+        self._dispatch()
+
+        waits = {waiter.future}
+        cancel_task = None
+        if cancel_event is not None:
+            cancel_task = asyncio.ensure_future(cancel_event.wait())
+            waits.add(cancel_task)
+        try:
+            await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        finally:
+            if cancel_task is not None:
+                cancel_task.cancel()
+
+        if waiter.future.done() and not waiter.future.cancelled():
+            wait_seconds.observe(time.monotonic() - started, model=self.model)
+            return True
+        self._abandon(waiter)
+        if cancel_event is not None and cancel_event.is_set():
+            return False
+        rejected.inc(model=self.model, reason='timeout')
+        raise RateLimitExceeded('Rate limit queue timeout', self._retry_after(tokens))
+
+    def release(self):
+        self._active -= 1
+        in_flight.set(self._active, model=self.model)
+        self._dispatch()
+
+    @property
+    def idle(self) -> bool:
+        """
+        没有放行中和排队中的请求，丢弃后只损失令牌桶的状态
+        """
+        return self._active == 0 and self._waiting == 0
+
+    def _abandon(self, waiter: _Waiter):
+        if waiter.future.done() and not waiter.future.cancelled():
+            # 放行和取消同时发生，归还并发名额
+            self.release()
+            return
+        waiter.future.cancel()
+        self._set_waiting(-1)
+        # 队头被取消后，后面的请求可能可以放行了
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._queue:
+            waiter = self._queue[0][2]
+            if waiter.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if self.concurrency and self._active >= self.concurrency:
+                # release 时会再次调度
+                return
+            wait = self._wait_time(waiter.tokens, now)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            heapq.heappop(self._queue)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(waiter.tokens)
+            self._active += 1
+            self._set_waiting(-1)
+            in_flight.set(self._active, model=self.model)
+            waiter.future.set_result(None)
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def _retry_after(self, tokens: float) -> float:
+        return max(1.0, self._wait_time(tokens, time.monotonic()))
+
+    def _set_waiting(self, delta: int):
+        self._waiting += delta
+        queue_depth.set(self._waiting, model=self.model)
+
+
+_limiters: 'OrderedDict[Tuple[str, str], RateLimiter]' = OrderedDict()
+
+
+def rate_limit_enabled() -> bool:
+    return bool(RATE_LIMIT_RPM or RATE_LIMIT_TPM or RATE_LIMIT_CONCURRENCY)
+
+
+def limiter_for(account: Optional[str], model: str) -> RateLimiter:
+    """
+    每个账号（API key）+ 模型一个限流器，配额是按账号和模型分别计算的；
+    不在 RATE_LIMIT_MODELS 中的模型共用 OTHER_MODEL 的限流器
+    """
+    if model not in RATE_LIMIT_MODELS:
+        model = OTHER_MODEL
+    key = (hashlib.sha256((account or '').encode('utf-8')).hexdigest(), model)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = _limiters[key] = RateLimiter(model, RATE_LIMIT_RPM, RATE_LIMIT_TPM,
+                                               RATE_LIMIT_CONCURRENCY, RATE_LIMIT_MAX_QUEUE)
+        _evict_limiters(key)
+    else:
+        _limiters.move_to_end(key)
+    return limiter
+
+
+def _evict_limiters(keep: Tuple[str, str]):
+    # 从最久没有使用的开始丢弃空闲的限流器；都在使用中时暂时超出上限
+    excess = len(_limiters) - RATE_LIMIT_MAX_LIMITERS
+    if excess <= 0:
+        return
+    idle = [key for key, limiter in _limiters.items() if key != keep and limiter.idle]
+    for key in idle[:excess]:
+        del _limiters[key]
+
+
+class Admission:
+    """
+    一次请求的限流：选定上游后按它的 API key + 模型排队；切换到其他账号的上游时先归还原来的名额再重新排队。
+    queue_timeout 是整个请求最多排队的时间
+    """
+
+    def __init__(self, model: str, tokens: float, priority: int = 0, queue_timeout: Optional[float] = None,
+                 cancel_event: Optional[asyncio.Event] = None):
+        self.model = model
+        self.tokens = tokens
+        self.priority = priority
+        self.deadline = time.monotonic() + queue_timeout if queue_timeout is not None else None
+        self.cancel_event = cancel_event
+        self.account: Optional[str] = None
+        self.limiter: Optional[RateLimiter] = None
+
+    async def acquire(self, account: Optional[str]) -> bool:
+        """
+        已经持有同一账号的名额时直接返回 True；cancel_event 被设置时返回 False，排队超时抛出 RateLimitExceeded
+        """
+        if self.limiter is not None:
+            if account == self.account:
+                return True
+            self.release()
+        limiter = limiter_for(account, self.model)
+        timeout = max(self.deadline - time.monotonic(), 0.0) if self.deadline is not None else None
+        if not await limiter.acquire(self.tokens, priority=self.priority, timeout=timeout,
+                                     cancel_event=self.cancel_event):
+            return False
+        self.account = account
+        self.limiter = limiter
+        return True
+
+    def release(self):
+        if self.limiter is not None:
+            self.limiter.release()
+            self.limiter = None
+            self.account = None
+
+
+def queue_params(request_data: Dict[str, Any]) -> Tuple[int, float]:
+    """
+    读取请求体中的 priority 和 queue_timeout，类型不对或超出范围时抛出 InvalidParameter；
+    queue_timeout 超过 RATE_LIMIT_MAX_QUEUE_TIMEOUT 时按最大值处理
+    """
+    priority = int_param(request_data, 'priority', 0,
+                         minimum=-RATE_LIMIT_MAX_PRIORITY, maximum=RATE_LIMIT_MAX_PRIORITY)
+    queue_timeout = float_param(request_data, 'queue_timeout', RATE_LIMIT_QUEUE_TIMEOUT, minimum=0)
+    return priority, min(queue_timeout, RATE_LIMIT_MAX_QUEUE_TIMEOUT)
+
+
+def estimate_request_tokens(request_body: Dict[str, Any]) -> float:
+    """
+    估算一次请求消耗的 token：提示词长度 + max_tokens
+    """
+    max_tokens = request_body.get('max_completion_tokens') or request_body.get('max_tokens') or 0
+    return count_prompt_tokens(request_body) + max_tokens
+
+
+def release_when_done(response, limiter):
+    """
+    非流式响应直接归还名额，流式响应在转发结束（或客户端断开）时归还。limiter 是 RateLimiter 或 Admission
+    """
+    if isinstance(response, StreamingResponse):
+        response.body_iterator = _release_after_stream(response.body_iterator, limiter)
+    else:
+        limiter.release()
+    return response
+
+
+async def _release_after_stream(body_iterator, limiter):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        limiter.release()
+        # 客户端断开时要把关闭传递给里层，及时中止上游连接
+        await body_iterator.aclose()
@@ -0,0 +1,56 @@
+# 请求体中数值参数的校验：类型不对或超出范围时抛出 InvalidParameter，由 send_deepseek_request 转成 400
+from typing import Any, Dict, Optional
+
+
+class InvalidParameter(ValueError):
+    pass
+
+
+def int_param(request_data: Dict[str, Any], key: str, default: Optional[int] = None,
+              minimum: Optional[int] = None, maximum: Optional[int] = None) -> Optional[int]:
+    """
+    读取整数参数，缺省或为 null 时返回 default。接受整数或整数字符串，不接受 bool 和小数
+    """
+    value = request_data.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise InvalidParameter(f"{key} must be an integer")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, str):
+        try:
+            value = int(value.strip())
+        except ValueError:
+            raise InvalidParameter(f"{key} must be an integer") from None
+    if not isinstance(value, int):
+        raise InvalidParameter(f"{key} must be an integer")
+    _check_range(key, value, minimum, maximum)
+    return value
+
+
+def float_param(request_data: Dict[str, Any], key: str, default: Optional[float] = None,
+                minimum: Optional[float] = None, maximum: Optional[float] = None) -> Optional[float]:
+    """
+    读取数字参数，缺省或为 null 时返回 default。接受数字或数字字符串，不接受 bool、nan 和 inf
+    """
+    value = request_data.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise InvalidParameter(f"{key} must be a number")
+    try:
+        value = float(value)
+    except ValueError:
+        raise InvalidParameter(f"{key} must be a number") from None
+    if value != value or value in (float('inf'), float('-inf')):
+        raise InvalidParameter(f"{key} must be a finite number")
+    _check_range(key, value, minimum, maximum)
+    return value
+
+
+def _check_range(key: str, value, minimum, maximum):
+    if minimum is not None and value < minimum:
+        raise InvalidParameter(f"{key} must be at least {minimum}")
+    if maximum is not None and value > maximum:
+        raise InvalidParameter(f"{key} must be at most {maximum}")
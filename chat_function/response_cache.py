@@ -0,0 +1,233 @@
+# /generate 的响应缓存：只缓存确定性的请求（temperature 为 0 或指定了 seed），
+# 内存 LRU 一层，可选的 SQLite 一层。流式请求命中时把缓存结果回放成 SSE
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from database import async_db, mysql_helper
+from env_helper import EnvHelper
+from utils import metrics
+from .sse import CompletionAssembler, SSEParser, replay_completion
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = EnvHelper.get_bool('RESPONSE_CACHE_ENABLED', True)
+RESPONSE_CACHE_MAX_ENTRIES = EnvHelper.get_int('RESPONSE_CACHE_MAX_ENTRIES', 1000)
+RESPONSE_CACHE_MAX_MB = EnvHelper.get_float('RESPONSE_CACHE_MAX_MB', 64)
+RESPONSE_CACHE_TTL = EnvHelper.get_float('RESPONSE_CACHE_TTL', 3600)
+RESPONSE_CACHE_DISK = EnvHelper.get_bool('RESPONSE_CACHE_DISK', False)
+RESPONSE_CACHE_DISK_MAX_ENTRIES = EnvHelper.get_int('RESPONSE_CACHE_DISK_MAX_ENTRIES', 10000)
+
+# 不影响生成结果的字段，不参与缓存键
+_KEY_EXCLUDED_FIELDS = ('stream', 'stream_options')
+
+cache_requests = metrics.Counter('response_cache_requests_total', 'Generate response cache lookups', ['result'])
+cache_entries = metrics.Gauge('response_cache_entries', 'Generate response cache entries in memory')
+cache_bytes = metrics.Gauge('response_cache_bytes', 'Generate response cache size in memory')
+
+
+def is_cacheable(request_body: Dict[str, Any]) -> bool:
+    """
+    只有结果可复现的请求才缓存：temperature 为 0，或者指定了 seed。
+    n 大于 1 时要求 temperature 为 0：采样多个回复就是为了得到不同的结果，只靠 seed 不缓存。
+    tools 不影响是否缓存，工具定义在请求体里，会进入缓存键
+    """
+    temperature = request_body.get('temperature')
+    n = request_body.get('n')
+    if isinstance(n, int) and n > 1:
+        return temperature == 0
+    return temperature == 0 or request_body.get('seed') is not None
+
+
+def make_key(api_url: str, request_body: Dict[str, Any], credential: Optional[str] = None) -> str:
+    """
+    缓存键：上游地址 + 凭据 + 处理后请求体的规范化 JSON。n、logprobs、tools 等字段都在请求体里，会自然区分。
+    凭据（密钥、反向代理密码）只以摘要的形式参与，不同账号的请求不会共用缓存
+    """
+    canonical = {
+        key: value for key, value in request_body.items()
+        if key not in _KEY_EXCLUDED_FIELDS and value is not None
+    }
+    digest = hashlib.sha256()
+    digest.update(api_url.rstrip('/').encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(hashlib.sha256((credential or '').encode('utf-8')).digest())
+    digest.update(b'\0')
+    digest.update(json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    :param max_entries: 内存层最多条目数
+    :param max_bytes: 内存层最多字节数
+    :param ttl: 条目有效期（秒），两层共用
+    :param disk: 是否启用 SQLite 层
+    :param disk_max_entries: SQLite 层最多条目数，超出时淘汰最久未访问的
+    """
+
+    # 每写入多少次清理一次磁盘层
+    _PRUNE_INTERVAL = 100
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float,
+                 disk: bool = False, disk_max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self.disk_max_entries = disk_max_entries
+        # key -> (写入时间, 序列化后的结果)
+        self._memory: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._bytes = 0
+        self._puts = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        item = self._memory.get(key)
+        if item is not None:
+            if now - item[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                cache_requests.inc(result='hit_memory')
+                return json.loads(item[1])
+            self._pop(key)
+
+        if self.disk:
+            body = await self._disk_get(key, now)
+            if body is not None:
+                self._store(key, body, now)
+                cache_requests.inc(result='hit_disk')
+                return json.loads(body)
+
+        cache_requests.inc(result='miss')
+        return None
+
+    def put(self, key: str, completion: Dict[str, Any]):
+        body = json.dumps(completion, ensure_ascii=False)
+        now = time.time()
+        self._store(key, body, now)
+        if self.disk:
+            self._disk_put(key, body, now)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._memory),
+            'bytes': self._bytes,
+            'hits': cache_requests.value(result='hit_memory') + cache_requests.value(result='hit_disk'),
+            'misses': cache_requests.value(result='miss'),
+        }
+
+    def _store(self, key: str, body: str, created: float):
+        self._pop(key)
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        self._memory[key] = (created, body)
+        self._bytes += size
+        while len(self._memory) > self.max_entries or self._bytes > self.max_bytes:
+            self._pop(next(iter(self._memory)))
+        cache_entries.set(len(self._memory))
+        cache_bytes.set(self._bytes)
+
+    def _pop(self, key: str):
+        item = self._memory.pop(key, None)
+        if item is not None:
+            self._bytes -= len(item[1])
+
+    async def _disk_get(self, key: str, now: float) -> Optional[str]:
+        try:
+            row = await async_db.query_one(
+                'SELECT body, create_time FROM response_cache WHERE cache_key = ?', (key,))
+            if row is None:
+                return None
+            body, created = row
+            if now - created > self.ttl:
+                mysql_helper.write_behind('DELETE FROM response_cache WHERE cache_key = ?', (key,))
+                return None
+            mysql_helper.write_behind('UPDATE response_cache SET access_time = ? WHERE cache_key = ?', (now, key))
+            return body
+        except Exception as e:
+            logger.warning(f"Response cache disk read failed: {e}")
+            return None
+
+    def _disk_put(self, key: str, body: str, now: float):
+        try:
+            mysql_helper.write_behind(
+                'INSERT OR REPLACE INTO response_cache (cache_key, body, create_time, access_time) VALUES (?, ?, ?, ?)',
+                (key, body, now, now))
+            self._puts += 1
+            if self._puts % self._PRUNE_INTERVAL == 0:
+                mysql_helper.write_behind('DELETE FROM response_cache WHERE create_time < ?', (now - self.ttl,))
+                mysql_helper.write_behind(
+                    'DELETE FROM response_cache WHERE cache_key NOT IN '
+                    '(SELECT cache_key FROM response_cache ORDER BY access_time DESC LIMIT ?)',
+                    (self.disk_max_entries,))
+        except Exception as e:
+            logger.warning(f"Response cache disk write failed: {e}")
+
+
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+    ttl=RESPONSE_CACHE_TTL,
+    disk=RESPONSE_CACHE_DISK,
+    disk_max_entries=RESPONSE_CACHE_DISK_MAX_ENTRIES,
+) if RESPONSE_CACHE_ENABLED else None
+
+
+def cached_response(completion: Dict[str, Any], stream: bool, include_usage: bool = True):
+    """
+    用缓存结果构造响应，流式请求回放成 SSE，include_usage 为 False 时不回放 usage chunk
+    """
+    headers = {'X-Cache': 'HIT'}
+    if stream:
+        return StreamingResponse(_iterate(replay_completion(completion, include_usage)),
+                                 media_type='text/event-stream', headers=headers)
+    return JSONResponse(content=completion, headers=headers)
+
+
+async def _iterate(events):
+    for event in events:
+        yield event
+
+
+def store_response(key: str, response, stream: bool):
+    """
+    上游成功返回后写入缓存。流式响应在转发的同时拼出完整结果，收到 [DONE] 才写入，中途断开的不缓存
+    """
+    if response_cache is None or response.status_code != 200:
+        return response
+    response.headers['X-Cache'] = 'MISS'
+    if isinstance(response, StreamingResponse):
+        response.body_iterator = _record_stream(key, response.body_iterator)
+    elif not stream:
+        try:
+            response_cache.put(key, json.loads(response.body))
+        except ValueError as e:
+            logger.warning(f"Response is not cacheable: {e}")
+    return response
+
+
+async def _record_stream(key: str, body_iterator: AsyncIterator[bytes]):
+    parser = SSEParser()
+    assembler = CompletionAssembler()
+    failed = False
+    try:
+        async for chunk in body_iterator:
+            if not failed:
+                try:
+                    for data in parser.feed(chunk):
+                        assembler.add(data)
+                except ValueError as e:
+                    logger.warning(f"Stream is not cacheable: {e}")
+                    failed = True
+            yield chunk
+    finally:
+        # 客户端断开时要把关闭传递给里层，及时中止上游连接
+        await body_iterator.aclose()
+    if assembler.finished and not failed:
+        response_cache.put(key, assembler.result())
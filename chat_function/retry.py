@@ -0,0 +1,131 @@
+# 上游请求的重试策略：指数退避 + full jitter，优先使用 Retry-After，并用时间窗口内的重试预算防止重试风暴
+import asyncio
+import collections
+import email.utils
+import random
+import time
+from typing import Iterable, Optional
+
+import httpx
+
+from env_helper import EnvHelper
+from utils import metrics
+
+# 可以安全重试的错误：连接没有建立，请求一定没有发出。
+# RemoteProtocolError 可能发生在请求已经发出、上游已经开始生成之后，重试会重复计费，不在其中
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+retries_total = metrics.Counter('upstream_retries_total', 'Upstream request retries', ['reason'])
+retry_budget_exhausted = metrics.Counter('upstream_retry_budget_exhausted_total',
+                                         'Retries skipped because the retry budget was used up')
+
+
+class RetryBudget:
+    """
+    每 window 秒最多 max_retries 次重试，所有请求共用
+    """
+
+    def __init__(self, max_retries: int, window: float):
+        self.max_retries = max_retries
+        self.window = window
+        self._retries = collections.deque()
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        while self._retries and now - self._retries[0] > self.window:
+            self._retries.popleft()
+        if len(self._retries) >= self.max_retries:
+            retry_budget_exhausted.inc()
+            return False
+        self._retries.append(now)
+        return True
+
+
+class RetryPolicy:
+    """
+    :param max_attempts: 最多尝试次数（包括第一次）
+    :param base_delay: 第一次重试的退避上限（秒），之后每次翻倍
+    :param max_delay: 退避上限（秒），Retry-After 也不会超过它
+    :param retry_statuses: 需要重试的 HTTP 状态码
+    :param budget: 重试预算，为 None 时不限制
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                 retry_statuses: Iterable[int] = (429, 500, 502, 503, 504),
+                 budget: Optional[RetryBudget] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+        self.budget = budget
+
+    def should_retry(self, attempt: int, status_code: Optional[int] = None,
+                     error: Optional[Exception] = None) -> bool:
+        """
+        attempt 是已经完成的尝试次数
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if error is not None:
+            retryable = isinstance(error, RETRYABLE_ERRORS)
+        else:
+            retryable = status_code in self.retry_statuses
+        if not retryable:
+            return False
+        if self.budget is not None and not self.budget.acquire():
+            return False
+        retries_total.inc(reason=type(error).__name__ if error is not None else str(status_code))
+        return True
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        第 attempt 次尝试失败后的等待时间
+        """
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After 可以是秒数，也可以是 HTTP 日期
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return retry_at.timestamp() - time.time()
+
+
+async def wait_or_cancel(delay: float, cancel_event: asyncio.Event) -> bool:
+    """
+    等待 delay 秒，期间 cancel_event 被设置时立即返回 True
+    """
+    if cancel_event.is_set():
+        return True
+    waiter = asyncio.ensure_future(cancel_event.wait())
+    try:
+        done, _ = await asyncio.wait({waiter}, timeout=delay)
+    finally:
+        waiter.cancel()
+    return waiter in done
+
+
+default_policy = RetryPolicy(
+    max_attempts=EnvHelper.get_int('UPSTREAM_RETRY_MAX_ATTEMPTS', 5),
+    base_delay=EnvHelper.get_float('UPSTREAM_RETRY_BASE_DELAY', 1.0),
+    max_delay=EnvHelper.get_float('UPSTREAM_RETRY_MAX_DELAY', 30.0),
+    budget=RetryBudget(
+        max_retries=EnvHelper.get_int('UPSTREAM_RETRY_BUDGET', 20),
+        window=EnvHelper.get_float('UPSTREAM_RETRY_BUDGET_WINDOW', 60.0),
+    ),
+)
@@ -0,0 +1,167 @@
+# 相同的确定性请求并发到达时只向上游发送一次（single-flight），其他请求订阅同一个结果。
+# 流式响应由后台任务读取上游，每个订阅者从头读取同一份 chunk 列表
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from env_helper import EnvHelper
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_ENABLED = EnvHelper.get_bool('SINGLE_FLIGHT_ENABLED', True)
+
+flight_requests = metrics.Counter('single_flight_requests_total', 'Coalesced generate requests', ['role'])
+flights_in_progress = metrics.Gauge('single_flight_in_progress', 'Upstream requests shared by subscribers')
+
+# fn(cancel_event) 发送上游请求，cancel_event 在所有订阅者都取消后才会被设置
+FetchFn = Callable[[asyncio.Event], Awaitable[Response]]
+
+
+def _cancelled_response() -> JSONResponse:
+    return JSONResponse(status_code=499, content={"error": {"message": "Request cancelled by client"}})
+
+
+class _Flight:
+    def __init__(self, key: str, fn: FetchFn, registry: Dict[str, '_Flight']):
+        self.key = key
+        self._registry = registry
+        self._subscribers = 0
+        self._upstream_cancel = asyncio.Event()
+        self._task = asyncio.ensure_future(fn(self._upstream_cancel))
+        self._task.add_done_callback(self._on_response)
+        self._pump_task: Optional[asyncio.Task] = None
+        # 流式响应的共享缓冲
+        self._chunks: List[bytes] = []
+        self._finished = False
+        self._changed = asyncio.Event()
+        flights_in_progress.inc()
+
+    async def subscribe(self, cancel_event: asyncio.Event) -> Response:
+        self._subscribers += 1
+        wait_cancel = asyncio.ensure_future(cancel_event.wait())
+        try:
+            await asyncio.wait({self._task, wait_cancel}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            self._release()
+            raise
+        finally:
+            wait_cancel.cancel()
+
+        if not self._task.done():
+            self._release()
+            return _cancelled_response()
+
+        try:
+            response = self._task.result()
+        except Exception as e:
+            self._release()
+            logger.error(f"Coalesced request failed: {e}", exc_info=True)
+            return JSONResponse(status_code=502, content={"error": {"message": str(e) or 'Unknown error occurred'}})
+
+        if isinstance(response, StreamingResponse):
+            # 订阅者的引用在 tee 结束时释放
+            headers = {key: value for key, value in response.headers.items() if key.lower() != 'content-length'}
+            return StreamingResponse(self._tee(cancel_event), status_code=response.status_code,
+                                     headers=headers, media_type=response.media_type)
+
+        self._release()
+        return Response(content=response.body, status_code=response.status_code,
+                        headers=dict(response.headers), media_type=response.media_type)
+
+    @property
+    def joinable(self) -> bool:
+        return not self._finished and not self._upstream_cancel.is_set()
+
+    def _on_response(self, task: asyncio.Task):
+        response = None if task.cancelled() or task.exception() else task.result()
+        if isinstance(response, StreamingResponse):
+            if self._subscribers > 0:
+                self._pump_task = asyncio.ensure_future(self._pump(response.body_iterator))
+                return
+            # 响应头到达前所有订阅者都已取消
+            asyncio.ensure_future(response.body_iterator.aclose())
+        self._finish()
+
+    async def _pump(self, body_iterator):
+        try:
+            async for chunk in body_iterator:
+                self._chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            logger.info(f"Coalesced stream {self.key} abandoned by all subscribers")
+        except Exception as e:
+            logger.error(f"Coalesced stream {self.key} failed: {e}")
+        finally:
+            aclose = getattr(body_iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+            self._finish()
+            self._notify()
+
+    async def _tee(self, cancel_event: asyncio.Event):
+        index = 0
+        cancel_task = asyncio.ensure_future(cancel_event.wait())
+        try:
+            while True:
+                while index < len(self._chunks):
+                    if cancel_event.is_set():
+                        return
+                    yield self._chunks[index]
+                    index += 1
+                if self._finished or cancel_event.is_set():
+                    return
+                changed = asyncio.ensure_future(self._changed.wait())
+                try:
+                    await asyncio.wait({changed, cancel_task}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+        finally:
+            cancel_task.cancel()
+            self._release()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _release(self):
+        self._subscribers -= 1
+        if self._subscribers > 0:
+            return
+        # 没有订阅者了，中止上游请求
+        self._upstream_cancel.set()
+        if self._pump_task is not None and not self._pump_task.done():
+            self._pump_task.cancel()
+
+    def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        flights_in_progress.dec()
+        if self._registry.get(self.key) is self:
+            del self._registry[self.key]
+
+
+class SingleFlight:
+    """
+    同一个 key 同时只有一个上游请求，后到的请求订阅正在进行的请求。
+    流式请求在上游结束前到达的订阅者也会从第一个 chunk 开始收到完整的流
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+
+    async def do(self, key: str, fn: FetchFn, cancel_event: asyncio.Event) -> Response:
+        flight = self._flights.get(key)
+        if flight is None or not flight.joinable:
+            flight = self._flights[key] = _Flight(key, fn, self._flights)
+            flight_requests.inc(role='leader')
+        else:
+            logger.info(f"Coalescing request into in-flight upstream call {key}")
+            flight_requests.inc(role='follower')
+        return await flight.subscribe(cancel_event)
+
+
+single_flight = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
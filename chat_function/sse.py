@@ -0,0 +1,231 @@
+# OpenAI 兼容接口的 SSE 工具：增量解析 data 帧、把流式 chunk 拼回完整结果、把完整结果回放成 SSE
+import json
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+DONE = '[DONE]'
+
+
+class SSEParser:
+    """
+    增量解析 SSE 字节流，每次 feed 返回本次完整到达的事件的 data 内容，不缓存整个响应体
+    """
+
+    def __init__(self):
+        self._buffer = b''
+        self._data: List[str] = []
+
+    def feed(self, chunk: bytes) -> List[str]:
+        self._buffer += chunk
+        end = self._buffer.rfind(b'\n')
+        if end < 0:
+            return []
+        lines = self._buffer[:end].split(b'\n')
+        self._buffer = self._buffer[end + 1:]
+
+        events = []
+        for line in lines:
+            line = line.rstrip(b'\r')
+            if not line:
+                # 空行表示一个事件结束
+                if self._data:
+                    events.append('\n'.join(self._data))
+                    self._data = []
+            elif line.startswith(b'data:'):
+                value = line[5:]
+                if value.startswith(b' '):
+                    value = value[1:]
+                self._data.append(value.decode('utf-8', errors='replace'))
+        return events
+
+
+class UsageChunkFilter:
+    """
+    从 SSE 字节流中去掉只有 usage 的 chunk（choices 为空），其他事件按原来的字节转发。
+    按事件缓冲，一个事件完整到达后才输出
+    """
+
+    def __init__(self):
+        self._buffer = b''
+        self._event: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> bytes:
+        self._buffer += chunk
+        end = self._buffer.rfind(b'\n')
+        if end < 0:
+            return b''
+        lines = self._buffer[:end].split(b'\n')
+        self._buffer = self._buffer[end + 1:]
+
+        output = []
+        for line in lines:
+            self._event.append(line + b'\n')
+            if not line.rstrip(b'\r'):
+                event = b''.join(self._event)
+                self._event = []
+                if not _is_usage_only(event):
+                    output.append(event)
+        return b''.join(output)
+
+    def flush(self) -> bytes:
+        """
+        流结束时没有以空行结尾的剩余字节，原样返回
+        """
+        rest = b''.join(self._event) + self._buffer
+        self._event = []
+        self._buffer = b''
+        return rest
+
+
+def _is_usage_only(event: bytes) -> bool:
+    data = [line[5:].strip() for line in event.split(b'\n') if line.startswith(b'data:')]
+    if not data:
+        return False
+    try:
+        chunk = json.loads(b'\n'.join(data))
+    except ValueError:
+        return False
+    return isinstance(chunk, dict) and chunk.get('choices') == [] and 'usage' in chunk
+
+
+class CompletionAssembler:
+    """
+    把 chat.completion.chunk / text_completion 的流式 chunk 拼回非流式的完整结果
+    """
+
+    def __init__(self):
+        self.done = False
+        self.usage: Optional[Dict[str, Any]] = None
+        self._base: Dict[str, Any] = {}
+        self._choices: Dict[int, Dict[str, Any]] = {}
+        self._is_text = False
+
+    def add(self, data: str):
+        if data.strip() == DONE:
+            self.done = True
+            return
+        chunk = json.loads(data)
+        for key in ('id', 'created', 'model', 'system_fingerprint'):
+            if key in chunk and key not in self._base:
+                self._base[key] = chunk[key]
+        if chunk.get('usage'):
+            self.usage = chunk['usage']
+
+        for choice in chunk.get('choices') or []:
+            state = self._choices.setdefault(choice.get('index', 0), {
+                'role': 'assistant', 'content': [], 'reasoning_content': [],
+                'tool_calls': {}, 'logprobs': [], 'finish_reason': None,
+            })
+            if 'text' in choice:
+                self._is_text = True
+                state['content'].append(choice.get('text') or '')
+            delta = choice.get('delta') or {}
+            if delta.get('role'):
+                state['role'] = delta['role']
+            if delta.get('content'):
+                state['content'].append(delta['content'])
+            if delta.get('reasoning_content'):
+                state['reasoning_content'].append(delta['reasoning_content'])
+            for call in delta.get('tool_calls') or []:
+                _merge_tool_call(state['tool_calls'], call)
+            logprobs = choice.get('logprobs')
+            if logprobs and logprobs.get('content'):
+                state['logprobs'].extend(logprobs['content'])
+            if choice.get('finish_reason'):
+                state['finish_reason'] = choice['finish_reason']
+
+    @property
+    def finished(self) -> bool:
+        """
+        收到了 [DONE]，并且每个 choice 都有 finish_reason
+        """
+        return self.done and bool(self._choices) and all(
+            state['finish_reason'] for state in self._choices.values())
+
+    def result(self) -> Dict[str, Any]:
+        choices = []
+        for index in sorted(self._choices):
+            state = self._choices[index]
+            if self._is_text:
+                choice = {'index': index, 'text': ''.join(state['content'])}
+            else:
+                message = {'role': state['role'], 'content': ''.join(state['content'])}
+                if state['reasoning_content']:
+                    message['reasoning_content'] = ''.join(state['reasoning_content'])
+                if state['tool_calls']:
+                    message['tool_calls'] = [state['tool_calls'][i] for i in sorted(state['tool_calls'])]
+                choice = {'index': index, 'message': message}
+            choice['logprobs'] = {'content': state['logprobs']} if state['logprobs'] else None
+            choice['finish_reason'] = state['finish_reason']
+            choices.append(choice)
+
+        result = {
+            **self._base,
+            'object': 'text_completion' if self._is_text else 'chat.completion',
+            'choices': choices,
+        }
+        if self.usage is not None:
+            result['usage'] = self.usage
+        return result
+
+
+def _merge_tool_call(calls: Dict[int, Dict[str, Any]], delta: Dict[str, Any]):
+    # 工具调用的参数按 index 分多个 chunk 到达，需要拼接
+    call = calls.setdefault(delta.get('index', len(calls)), {
+        'id': None, 'type': 'function', 'function': {'name': '', 'arguments': ''},
+    })
+    if delta.get('id'):
+        call['id'] = delta['id']
+    if delta.get('type'):
+        call['type'] = delta['type']
+    function = delta.get('function') or {}
+    if function.get('name'):
+        call['function']['name'] += function['name']
+    if function.get('arguments'):
+        call['function']['arguments'] += function['arguments']
+
+
+def format_event(data: Any) -> bytes:
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    return f'data: {data}\n\n'.encode('utf-8')
+
+
+def replay_completion(completion: Dict[str, Any], include_usage: bool = True) -> Iterator[bytes]:
+    """
+    把非流式的完整结果回放成流式 chunk：每个 choice 一个内容 chunk、一个结束 chunk，最后是 usage（include_usage 时）和 [DONE]
+    """
+    is_text = completion.get('object') == 'text_completion'
+    base = {
+        'id': completion.get('id'),
+        'object': 'text_completion' if is_text else 'chat.completion.chunk',
+        'created': completion.get('created', int(time.time())),
+        'model': completion.get('model'),
+    }
+    if completion.get('system_fingerprint'):
+        base['system_fingerprint'] = completion['system_fingerprint']
+
+    for choice in completion.get('choices') or []:
+        index = choice.get('index', 0)
+        if is_text:
+            content = {'index': index, 'text': choice.get('text', ''), 'logprobs': None, 'finish_reason': None}
+        else:
+            message = choice.get('message') or {}
+            delta = {'role': message.get('role', 'assistant'), 'content': message.get('content') or ''}
+            if message.get('reasoning_content'):
+                delta['reasoning_content'] = message['reasoning_content']
+            if message.get('tool_calls'):
+                delta['tool_calls'] = [{'index': i, **call} for i, call in enumerate(message['tool_calls'])]
+            content = {'index': index, 'delta': delta, 'logprobs': choice.get('logprobs'), 'finish_reason': None}
+        yield format_event({**base, 'choices': [content]})
+
+        finish = {'index': index, 'logprobs': None, 'finish_reason': choice.get('finish_reason') or 'stop'}
+        if is_text:
+            finish['text'] = ''
+        else:
+            finish['delta'] = {}
+        yield format_event({**base, 'choices': [finish]})
+
+    if include_usage and completion.get('usage'):
+        yield format_event({**base, 'choices': [], 'usage': completion['usage']})
+    yield format_event(DONE)
@@ -0,0 +1,158 @@
+# 提示词 token 预算：按 config.TOKEN_BUDGET_SETTINGS 计算上下文预算，超出时从最早的对话轮次开始裁剪。
+# 配置了 TOKENIZER_FILE（tokenizer.json）且安装了 tokenizers 时用分词器计数，否则用按字符校准的估算
+import functools
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from env_helper import EnvHelper
+from .config import TOKEN_BUDGET_SETTINGS
+from .request_params import InvalidParameter, int_param
+
+logger = logging.getLogger(__name__)
+
+# 默认关闭：客户端通常自己控制上下文长度，打开后超出预算的历史会被删除
+TOKEN_BUDGET_ENABLED = EnvHelper.get_bool('TOKEN_BUDGET_ENABLED', False)
+TOKENIZER_FILE = EnvHelper.get_env_value('TOKENIZER_FILE')
+# 请求里没有 max_context、模型也不在 MODEL_CONTEXT_WINDOWS 中时使用的上下文长度
+TOKEN_BUDGET_MAX_CONTEXT = EnvHelper.get_int('TOKEN_BUDGET_MAX_CONTEXT',
+                                            TOKEN_BUDGET_SETTINGS['DEFAULT_MAX_CONTEXT'])
+
+# 各模型的上下文长度
+MODEL_CONTEXT_WINDOWS = {
+    'deepseek-chat': 65536,
+    'deepseek-reasoner': 65536,
+}
+
+# 每条消息的格式开销（角色标记、分隔符）
+MESSAGE_OVERHEAD = 4
+# 图片按固定 token 数计算
+IMAGE_TOKENS = 85
+
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        if TOKENIZER_FILE:
+            try:
+                from tokenizers import Tokenizer
+                _tokenizer = Tokenizer.from_file(TOKENIZER_FILE)
+            except Exception as e:
+                logger.warning(f"Failed to load tokenizer {TOKENIZER_FILE}, falling back to estimation: {e}")
+    return _tokenizer
+
+
+@functools.lru_cache(maxsize=16384)
+def count_text_tokens(text: str) -> int:
+    """
+    文本的 token 数。历史消息每次请求都会重复出现，结果按文本缓存
+    """
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    # 经验值：ASCII 字符约 0.3 个 token，其他字符（中文等）约 0.6 个 token
+    ascii_chars = len(text.encode('ascii', errors='ignore'))
+    return int(ascii_chars * 0.3 + (len(text) - ascii_chars) * 0.6) + 1
+
+
+def count_message_tokens(message: Dict[str, Any]) -> int:
+    tokens = MESSAGE_OVERHEAD
+    content = message.get('content')
+    if isinstance(content, str):
+        tokens += count_text_tokens(content)
+    elif isinstance(content, list):
+        for part in content:
+            if not isinstance(part, dict):
+                continue
+            if part.get('type') == 'image_url':
+                tokens += IMAGE_TOKENS
+            else:
+                tokens += count_text_tokens(part.get('text') or '')
+    if message.get('name'):
+        tokens += count_text_tokens(message['name'])
+    for call in message.get('tool_calls') or []:
+        function = call.get('function') or {}
+        tokens += count_text_tokens(function.get('name') or '') + count_text_tokens(function.get('arguments') or '')
+    return tokens
+
+
+def count_prompt_tokens(request_body: Dict[str, Any]) -> int:
+    if request_body.get('prompt'):
+        return count_text_tokens(request_body['prompt'])
+    return sum(count_message_tokens(message) for message in request_body.get('messages') or [])
+
+
+def prompt_budget(request_data: Dict[str, Any]) -> Optional[int]:
+    """
+    提示词可用的 token 数：上下文长度减去给回复预留的 token。
+    上下文长度依次取请求中的 max_context、模型的上下文长度、TOKEN_BUDGET_MAX_CONTEXT；
+    默认上下文长度放不下回复时返回 None，不裁剪，由上游决定；请求自己指定的 max_context 放不下时抛出 InvalidParameter
+    """
+    max_context = int_param(request_data, 'max_context', minimum=1)
+    max_response = (int_param(request_data, 'max_completion_tokens', minimum=1)
+                    or int_param(request_data, 'max_tokens', minimum=1)
+                    or TOKEN_BUDGET_SETTINGS['DEFAULT_MAX_RESPONSE'])
+    if max_context is not None:
+        if max_response >= max_context:
+            raise InvalidParameter('max_tokens must be smaller than max_context')
+        return max_context - max_response
+    max_context = MODEL_CONTEXT_WINDOWS.get(request_data.get('model'), TOKEN_BUDGET_MAX_CONTEXT)
+    budget = max_context - max_response
+    return budget if budget > 0 else None
+
+
+def trim_messages(messages: List[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, Any]], int, int]:
+    """
+    从最早的非 system 消息开始删除，直到总 token 数不超过 budget。
+    开头的 system 消息和最后一条消息总是保留；删掉带 tool_calls 的助手消息时，紧跟的 tool 消息一起删除。
+    返回 (裁剪后的消息, 裁剪前 token 数, 裁剪后 token 数)
+    """
+    counts = [count_message_tokens(message) for message in messages]
+    total = sum(counts)
+    if total <= budget or len(messages) < 2:
+        return messages, total, total
+
+    head = 0
+    while head < len(messages) - 1 and messages[head].get('role') == 'system':
+        head += 1
+
+    remaining = total
+    cut = head
+    last = len(messages) - 1
+    while remaining > budget and cut < last:
+        remaining -= counts[cut]
+        cut += 1
+        # 对话不能以孤立的 tool 消息开头
+        while cut < last and messages[cut].get('role') == 'tool':
+            remaining -= counts[cut]
+            cut += 1
+
+    trimmed = messages[:head] + messages[cut:]
+    return trimmed, total, remaining
+
+
+def apply_budget(request_data: Dict[str, Any], messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """
+    在 send_deepseek_request 中调用：按预算裁剪消息，返回裁剪后的消息和要加到响应上的头。
+    参数不合法时抛出 InvalidParameter
+    """
+    if not TOKEN_BUDGET_ENABLED or not isinstance(messages, list):
+        return messages, {}
+    budget = prompt_budget(request_data)
+    if budget is None:
+        return messages, {}
+    trimmed, original_tokens, prompt_tokens = trim_messages(messages, budget)
+    if len(trimmed) != len(messages):
+        logger.info(f"Trimmed {len(messages) - len(trimmed)} messages to fit the prompt budget "
+                    f"({original_tokens} -> {prompt_tokens} tokens, budget {budget})")
+    return trimmed, {
+        'X-Prompt-Tokens': str(prompt_tokens),
+        'X-Prompt-Tokens-Original': str(original_tokens),
+        'X-Prompt-Budget': str(budget),
+        'X-Trimmed-Messages': str(len(messages) - len(trimmed)),
+    }
@@ -0,0 +1,215 @@
+# 上游 LLM 服务的注册表：多个地址/密钥之间按加权轮询或最少进行中请求选择，
+# 被动健康检查——连续失败或延迟过高的上游暂时摘除，重试时自动切换到其他上游
+import logging
+import random
+import time
+from typing import Iterable, List, Optional
+
+from env_helper import EnvHelper
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+STRATEGY_WRR = 'wrr'
+STRATEGY_LEAST_OUTSTANDING = 'least_outstanding'
+
+upstream_requests = metrics.Counter('upstream_requests_total', 'Upstream chat completion attempts',
+                                    ['upstream', 'result'])
+upstream_ejections = metrics.Counter('upstream_ejections_total', 'Upstreams ejected by passive health checks',
+                                     ['upstream', 'reason'])
+upstream_outstanding = metrics.Gauge('upstream_outstanding_requests', 'In-flight requests per upstream',
+                                     ['upstream'])
+
+
+class Upstream:
+    """
+    一个上游地址和它的被动健康状态
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str], weight: float = 1.0, name: Optional[str] = None):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.weight = max(weight, 0.0)
+        self.name = name or self.base_url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # 响应头延迟的指数移动平均（秒）
+        self.latency: Optional[float] = None
+        # 平滑加权轮询的当前权重
+        self.current_weight = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+
+class UpstreamPool:
+    """
+    :param strategy: wrr（平滑加权轮询）或 least_outstanding（进行中请求数 / 权重最小）
+    :param eject_failures: 连续失败多少次摘除
+    :param eject_seconds: 第一次摘除的时长，连续摘除时翻倍，最多 max_eject_seconds
+    :param eject_latency: 延迟移动平均超过多少秒摘除，0 表示不按延迟摘除
+    """
+
+    def __init__(self, upstreams: Iterable[Upstream], name: str = 'default', strategy: str = STRATEGY_WRR,
+                 eject_failures: int = 3, eject_seconds: float = 30.0, max_eject_seconds: float = 300.0,
+                 eject_latency: float = 0.0):
+        self.upstreams: List[Upstream] = list(upstreams)
+        self.name = name
+        self.strategy = strategy
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.eject_latency = eject_latency
+
+    def select(self, exclude: Iterable[Upstream] = ()) -> Optional[Upstream]:
+        """
+        选出一个上游。优先选没有被摘除、也没有在本次请求中试过的；都不可用时选最早恢复的，保证总有上游可用
+        """
+        if not self.upstreams:
+            return None
+        now = time.monotonic()
+        exclude = set(map(id, exclude))
+        candidates = [u for u in self.upstreams if u.available(now) and id(u) not in exclude]
+        if not candidates:
+            candidates = [u for u in self.upstreams if u.available(now)]
+        if not candidates:
+            return min(self.upstreams, key=lambda u: u.ejected_until)
+
+        if self.strategy == STRATEGY_LEAST_OUTSTANDING:
+            return min(candidates, key=lambda u: ((u.outstanding + 1) / (u.weight or 1e-9), random.random()))
+
+        # 平滑加权轮询（nginx 的算法），权重小的上游也会被均匀地穿插选中
+        total = 0.0
+        best = None
+        for upstream in candidates:
+            upstream.current_weight += upstream.weight
+            total += upstream.weight
+            if best is None or upstream.current_weight > best.current_weight:
+                best = upstream
+        best.current_weight -= total
+        return best
+
+    def has_alternative(self, exclude: Iterable[Upstream]) -> bool:
+        """
+        除了 exclude 之外还有没有可用的上游
+        """
+        now = time.monotonic()
+        exclude = set(map(id, exclude))
+        return any(u.available(now) and id(u) not in exclude for u in self.upstreams)
+
+    def start(self, upstream: Upstream):
+        upstream.outstanding += 1
+        upstream_outstanding.set(upstream.outstanding, upstream=upstream.name)
+
+    def finish(self, upstream: Upstream):
+        upstream.outstanding -= 1
+        upstream_outstanding.set(upstream.outstanding, upstream=upstream.name)
+
+    def record_success(self, upstream: Upstream, latency: float):
+        upstream_requests.inc(upstream=upstream.name, result='success')
+        upstream.consecutive_failures = 0
+        upstream.ejections = 0
+        upstream.latency = latency if upstream.latency is None else 0.8 * upstream.latency + 0.2 * latency
+        if self.eject_latency and upstream.latency > self.eject_latency:
+            self._eject(upstream, 'latency')
+
+    def record_failure(self, upstream: Upstream):
+        upstream_requests.inc(upstream=upstream.name, result='failure')
+        upstream.consecutive_failures += 1
+        if upstream.consecutive_failures >= self.eject_failures:
+            self._eject(upstream, 'errors')
+
+    def _eject(self, upstream: Upstream, reason: str):
+        now = time.monotonic()
+        others = [u for u in self.upstreams if u is not upstream and u.available(now)]
+        if not others:
+            # 不摘除最后一个可用的上游
+            return
+        duration = min(self.eject_seconds * (2 ** upstream.ejections), self.max_eject_seconds)
+        upstream.ejected_until = now + duration
+        upstream.ejections += 1
+        upstream.consecutive_failures = 0
+        # 恢复后重新测量延迟
+        upstream.latency = None
+        upstream_ejections.inc(upstream=upstream.name, reason=reason)
+        logger.warning(f"Upstream {upstream.name} ejected for {duration:.0f}s ({reason})")
+
+
+def parse_upstreams(value: str) -> List[Upstream]:
+    """
+    解析 DEEPSEEK_UPSTREAMS：逗号分隔的 地址|密钥所在的配置项|权重，例如
+    https://api.deepseek.com/|API_KEY|3,https://backup.example.com/|BACKUP_API_KEY|1
+    """
+    upstreams = []
+    for entry in value.split(','):
+        parts = [part.strip() for part in entry.split('|')]
+        if not parts[0]:
+            continue
+        key_name = parts[1] if len(parts) > 1 and parts[1] else 'API_KEY'
+        weight = float(parts[2]) if len(parts) > 2 and parts[2] else 1.0
+        upstreams.append(Upstream(parts[0], EnvHelper.get_env_value(key_name), weight))
+    return upstreams
+
+
+_default_pool: Optional[UpstreamPool] = None
+
+
+def create_default_pool() -> UpstreamPool:
+    configured = EnvHelper.get_env_value('DEEPSEEK_UPSTREAMS')
+    if configured:
+        upstreams = parse_upstreams(configured)
+    else:
+        upstreams = [Upstream(EnvHelper.get_env_value('DEEPSEEK_API_URL', 'https://api.deepseek.com/'),
+                              EnvHelper.get_env_value('API_KEY'))]
+    return UpstreamPool(
+        upstreams,
+        strategy=EnvHelper.get_env_value('UPSTREAM_BALANCE', STRATEGY_WRR),
+        eject_failures=EnvHelper.get_int('UPSTREAM_EJECT_FAILURES', 3),
+        eject_seconds=EnvHelper.get_float('UPSTREAM_EJECT_SECONDS', 30),
+        max_eject_seconds=EnvHelper.get_float('UPSTREAM_MAX_EJECT_SECONDS', 300),
+        eject_latency=EnvHelper.get_float('UPSTREAM_EJECT_LATENCY', 0),
+    )
+
+
+def default_pool() -> UpstreamPool:
+    """
+    .env 中配置的上游，健康状态在进程内共享
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = create_default_pool()
+    return _default_pool
+
+
+# 默认上游池用到的配置，DEEPSEEK_UPSTREAMS 中引用的密钥配置项另外计算
+_POOL_KEYS = {
+    'DEEPSEEK_UPSTREAMS', 'DEEPSEEK_API_URL', 'API_KEY', 'UPSTREAM_BALANCE', 'UPSTREAM_EJECT_FAILURES',
+    'UPSTREAM_EJECT_SECONDS', 'UPSTREAM_MAX_EJECT_SECONDS', 'UPSTREAM_EJECT_LATENCY',
+}
+
+
+def _on_config_change(changed):
+    """
+    上游相关的配置变化时丢弃默认上游池，下一个请求按新配置重建
+    """
+    global _default_pool
+    keys = set(_POOL_KEYS)
+    for entry in (EnvHelper.get_env_value('DEEPSEEK_UPSTREAMS') or '').split(','):
+        parts = entry.split('|')
+        if len(parts) > 1 and parts[1].strip():
+            keys.add(parts[1].strip())
+    if _default_pool is not None and changed & keys:
+        _default_pool = None
+        logger.info('Upstream configuration changed, rebuilding the default pool')
+
+
+EnvHelper.on_change(_on_config_change)
+
+
+def reverse_proxy_pool(url: str, password: Optional[str]) -> UpstreamPool:
+    """
+    请求里指定的 reverse_proxy 直接使用，proxy_password 作为密钥
+    """
+    return UpstreamPool([Upstream(url, password)], name=url.rstrip('/'))
@@ -0,0 +1,140 @@
+# 上游调用的用量统计：流式响应边转发边解析 SSE，记录 token 数、首 token 时间、生成速度和结束原因，
+# 导出为 Prometheus 指标，并按 uid + 模型 + 日期汇总写入 SQLite
+import json
+import logging
+import time
+from datetime import date
+from typing import Any, Callable, Dict, Optional
+
+from database import mysql_helper
+from env_helper import EnvHelper
+from utils import metrics
+from .sse import DONE, SSEParser
+
+logger = logging.getLogger(__name__)
+
+# 客户端没有要求时也向配置的上游请求流式 usage（stream_options.include_usage），用于用量统计；
+# 这个只有 usage 的 chunk 不会转发给客户端。关闭时流式响应的 prompt token 数按本地计数，completion token 数按内容 chunk 数近似
+UPSTREAM_INCLUDE_USAGE = EnvHelper.get_bool('UPSTREAM_INCLUDE_USAGE', False)
+
+tokens_total = metrics.Counter('llm_tokens_total', 'Tokens reported by the upstream', ['model', 'type'])
+finish_reasons = metrics.Counter('llm_finish_reason_total', 'Completion finish reasons', ['model', 'reason'])
+time_to_first_token = metrics.Histogram('llm_time_to_first_token_seconds', 'Time to the first content token',
+                                        ['model'])
+chunk_interval = metrics.Histogram('llm_chunk_interval_seconds', 'Time between streamed chunks', ['model'],
+                                   buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+tokens_per_second = metrics.Histogram('llm_tokens_per_second', 'Completion tokens per second after the first token',
+                                      ['model'], buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300))
+
+
+class UsageTracker:
+    """
+    一次上游调用的用量。流式响应逐块调用 feed，非流式响应调用 record_completion，结束时调用 finish
+
+    :param count_prompt: 上游没有返回 usage 时用来在本地统计 prompt token 数，只在需要时调用
+    """
+
+    def __init__(self, model: str, uid: Optional[str] = None, started: Optional[float] = None,
+                 count_prompt: Optional[Callable[[], int]] = None):
+        self.model = model
+        self.uid = uid or ''
+        self.started = started if started is not None else time.monotonic()
+        self.count_prompt = count_prompt
+        self.first_token_at: Optional[float] = None
+        self.last_chunk_at: Optional[float] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.finish_reasons: Dict[int, str] = {}
+        # 上游没有返回 usage 时，用内容 chunk 数近似 completion token 数
+        self.content_chunks = 0
+        self._prompt_estimate: Optional[int] = None
+        self._parser = SSEParser()
+        self._finished = False
+
+    def feed(self, chunk: bytes):
+        now = time.monotonic()
+        for data in self._parser.feed(chunk):
+            if data.strip() == DONE:
+                continue
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if self.last_chunk_at is not None:
+                chunk_interval.observe(now - self.last_chunk_at, model=self.model)
+            self.last_chunk_at = now
+            self._add(event, now)
+
+    def record_completion(self, completion: Dict[str, Any]):
+        self.first_token_at = self.last_chunk_at = time.monotonic()
+        self._add(completion, self.first_token_at)
+
+    def _add(self, event: Dict[str, Any], now: float):
+        if event.get('usage'):
+            self.usage = event['usage']
+        for choice in event.get('choices') or []:
+            delta = choice.get('delta') or choice.get('message') or {}
+            if delta.get('content') or delta.get('reasoning_content') or choice.get('text'):
+                self.content_chunks += 1
+                if self.first_token_at is None:
+                    self.first_token_at = now
+            if choice.get('finish_reason'):
+                self.finish_reasons[choice.get('index', 0)] = choice['finish_reason']
+
+    @property
+    def prompt_tokens(self) -> int:
+        if self.usage is not None:
+            return int(self.usage.get('prompt_tokens') or 0)
+        if self.count_prompt is None:
+            return 0
+        if self._prompt_estimate is None:
+            try:
+                self._prompt_estimate = int(self.count_prompt())
+            except Exception as e:
+                logger.warning(f"Failed to count prompt tokens: {e}")
+                self._prompt_estimate = 0
+        return self._prompt_estimate
+
+    @property
+    def completion_tokens(self) -> int:
+        if self.usage is not None:
+            return int(self.usage.get('completion_tokens') or 0)
+        return self.content_chunks
+
+    def finish(self):
+        """
+        导出指标并写入按 uid 汇总的用量，只执行一次
+        """
+        if self._finished:
+            return
+        self._finished = True
+
+        tokens_total.inc(self.prompt_tokens, model=self.model, type='prompt')
+        tokens_total.inc(self.completion_tokens, model=self.model, type='completion')
+        reasons = list(self.finish_reasons.values()) or ['incomplete']
+        for reason in reasons:
+            finish_reasons.inc(model=self.model, reason=reason)
+
+        ttft = None
+        if self.first_token_at is not None:
+            ttft = self.first_token_at - self.started
+            time_to_first_token.observe(ttft, model=self.model)
+            generating = (self.last_chunk_at or self.first_token_at) - self.first_token_at
+            if generating > 0 and self.completion_tokens > 1:
+                tokens_per_second.observe(self.completion_tokens / generating, model=self.model)
+
+        logger.info(f"LLM usage uid={self.uid} model={self.model} prompt={self.prompt_tokens} "
+                    f"completion={self.completion_tokens} ttft={ttft} finish={reasons}")
+        record_usage(self.uid, self.model, self.prompt_tokens, self.completion_tokens)
+
+
+def record_usage(uid: str, model: str, prompt_tokens: int, completion_tokens: int):
+    try:
+        mysql_helper.write_behind(
+            'INSERT INTO llm_usage (uid, model, day, requests, prompt_tokens, completion_tokens) '
+            'VALUES (?, ?, ?, 1, ?, ?) '
+            'ON CONFLICT (uid, model, day) DO UPDATE SET requests = requests + 1, '
+            'prompt_tokens = prompt_tokens + excluded.prompt_tokens, '
+            'completion_tokens = completion_tokens + excluded.completion_tokens',
+            (uid, model, date.today().isoformat(), prompt_tokens, completion_tokens))
+    except Exception as e:
+        logger.warning(f"Failed to record LLM usage: {e}")
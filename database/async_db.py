@@ -0,0 +1,169 @@
+# mysql_helper 的异步接口：SQLite 调用在专用线程池中执行（每个线程有自己的连接），不阻塞事件循环。
+# 超时后用 sqlite3 的 interrupt 中止仍在执行的语句；大结果集用 iterate 按批读取
+import asyncio
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, List, Optional, Sequence, Tuple
+
+from env_helper import EnvHelper
+from utils import metrics
+from . import mysql_helper
+
+SQLITE_WORKERS = EnvHelper.get_int('SQLITE_WORKERS', 4)
+# 单条语句（iterate 中的每一批）的超时（秒），0 表示不限制
+SQLITE_QUERY_TIMEOUT = EnvHelper.get_float('SQLITE_QUERY_TIMEOUT', 5.0)
+# iterate 每次 fetchmany 的行数
+SQLITE_FETCH_SIZE = EnvHelper.get_int('SQLITE_FETCH_SIZE', 500)
+
+query_seconds = metrics.Histogram('sqlite_query_seconds', 'SQLite calls made through the async facade', ['op'])
+query_timeouts = metrics.Counter('sqlite_query_timeouts_total', 'SQLite calls interrupted after a timeout', ['op'])
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SQLITE_WORKERS, thread_name_prefix='sqlite')
+    return _executor
+
+
+class _Call:
+    """
+    记录执行语句的连接，超时时从事件循环线程 interrupt 它。
+    conn 只在 fn 执行期间不为空，读写都持有 lock，interrupt 不会落到同一线程上的下一个任务
+    """
+    __slots__ = ('conn', 'cancelled', 'lock')
+
+    def __init__(self):
+        self.conn: Optional[sqlite3.Connection] = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+async def _run(op: str, fn: Callable[[sqlite3.Connection], Any], timeout: Optional[float],
+               conn: Optional[sqlite3.Connection] = None) -> Any:
+    """
+    在线程池中执行 fn(conn)，conn 为 None 时使用工作线程自己的连接
+    """
+    call = _Call()
+
+    def work():
+        with call.lock:
+            if call.cancelled:
+                raise sqlite3.OperationalError('interrupted')
+            target = call.conn = conn if conn is not None else mysql_helper.get_connection()
+        try:
+            return fn(target)
+        finally:
+            with call.lock:
+                call.conn = None
+
+    if timeout is None:
+        timeout = SQLITE_QUERY_TIMEOUT
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    future = loop.run_in_executor(_get_executor(), work)
+    # 超时后语句被中止抛出的异常没有人等待，这里取出避免 asyncio 报警
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout or None)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        # 工作线程里的语句不会随协程取消而停止，需要主动中止，否则会一直占用线程
+        call.cancel()
+        if isinstance(e, asyncio.TimeoutError):
+            query_timeouts.inc(op=op)
+        raise
+    finally:
+        query_seconds.observe(loop.time() - started, op=op)
+
+
+def _write(sql: str, params: Sequence[Any], conn: sqlite3.Connection) -> int:
+    with conn:
+        return conn.execute(sql, params).rowcount
+
+
+def _write_many(sql: str, seq_of_params, conn: sqlite3.Connection) -> int:
+    with conn:
+        return conn.executemany(sql, seq_of_params).rowcount
+
+
+def _read(sql: str, params: Sequence[Any], conn: sqlite3.Connection) -> List[Tuple]:
+    return conn.execute(sql, params).fetchall()
+
+
+async def execute(sql: str, params: Sequence[Any] = (), timeout: Optional[float] = None) -> int:
+    """
+    执行一条写语句并提交，返回影响的行数
+    """
+    return await _run('execute', functools.partial(_write, sql, params), timeout)
+
+
+async def execute_many(sql: str, seq_of_params, timeout: Optional[float] = None) -> int:
+    return await _run('execute_many', functools.partial(_write_many, sql, list(seq_of_params)), timeout)
+
+
+async def query(sql: str, params: Sequence[Any] = (), timeout: Optional[float] = None) -> List[Tuple]:
+    return await _run('query', functools.partial(_read, sql, params), timeout)
+
+
+async def query_one(sql: str, params: Sequence[Any] = (), timeout: Optional[float] = None) -> Optional[Tuple]:
+    rows = await _run('query', lambda conn: conn.execute(sql, params).fetchmany(1), timeout)
+    return rows[0] if rows else None
+
+
+async def iterate(sql: str, params: Sequence[Any] = (), batch_size: Optional[int] = None,
+                  timeout: Optional[float] = None) -> AsyncIterator[Tuple]:
+    """
+    按批读取大结果集，每批 batch_size 行，内存中最多只有一批。
+    使用单独的连接，游标不会和线程池中的其他语句交错；提前退出循环时连接会被关闭
+    """
+    batch_size = batch_size or SQLITE_FETCH_SIZE
+    conn = await _in_executor(mysql_helper.connect)
+    try:
+        cursor = await _run('query', lambda c: c.execute(sql, params), timeout, conn=conn)
+        while True:
+            rows = await _run('fetchmany', lambda _: cursor.fetchmany(batch_size), timeout, conn=conn)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        await asyncio.shield(_in_executor(mysql_helper.disconnect, conn))
+
+
+def _in_executor(fn: Callable, *args) -> 'asyncio.Future':
+    return asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+
+
+def write_behind(sql: str, params: Sequence[Any] = ()) -> bool:
+    """
+    不等待结果的写入，见 mysql_helper.write_behind。只是入队，可以直接在事件循环中调用
+    """
+    return mysql_helper.write_behind(sql, params)
+
+
+async def flush(timeout: Optional[float] = None) -> bool:
+    """
+    等待写线程写完已经排队的语句
+    """
+    return await _in_executor(mysql_helper.write_queue.flush, timeout)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
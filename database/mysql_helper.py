@@ -1,39 +1,141 @@
+# SQLite 访问层：每个线程一个连接（sqlite3 连接不能跨线程共享），WAL 模式下读写互不阻塞，
+# busy_timeout 等待其他连接的写锁而不是立即报 "database is locked"。
+# 日志、缓存这类不需要立即看到结果的写入交给 write_behind，由单独的写线程批量在一个事务中提交
+import logging
+import queue
 import sqlite3
+import threading
+import time
+from typing import Any, List, Optional, Sequence, Tuple
 
-# 连接到数据库（如果不存在则创建）
-conn = sqlite3.connect('saga_main.db')
-# 创建游标
-cursor = conn.cursor()
+from env_helper import EnvHelper
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+SQLITE_PATH = EnvHelper.get_env_value('SQLITE_PATH', 'saga_main.db')
+# 等待其他连接释放写锁的时间（毫秒）
+SQLITE_BUSY_TIMEOUT = EnvHelper.get_int('SQLITE_BUSY_TIMEOUT', 5000)
+# 每个连接缓存的预编译语句数
+SQLITE_STATEMENT_CACHE = EnvHelper.get_int('SQLITE_STATEMENT_CACHE', 256)
+# 写线程每个事务最多提交多少条语句
+SQLITE_WRITE_BATCH = EnvHelper.get_int('SQLITE_WRITE_BATCH', 200)
+# 写队列最多排队多少条语句，满了丢弃并记录
+SQLITE_WRITE_QUEUE_MAX = EnvHelper.get_int('SQLITE_WRITE_QUEUE_MAX', 10000)
+
+write_queue_depth = metrics.Gauge('sqlite_write_queue_depth', 'Statements waiting for the SQLite writer thread')
+write_batch_size = metrics.Histogram('sqlite_write_batch_size', 'Statements committed per SQLite write transaction',
+                                     buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+write_dropped = metrics.Counter('sqlite_write_dropped_total', 'Write-behind statements dropped or failed',
+                                ['reason'])
+
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+# close 之后递增，各线程据此丢弃已经关闭的连接
+_generation = 0
+
+
+def connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(SQLITE_PATH, timeout=SQLITE_BUSY_TIMEOUT / 1000,
+                           cached_statements=SQLITE_STATEMENT_CACHE, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # WAL 模式下 NORMAL 在断电时最多丢失最后几个事务，不会损坏数据库
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT)}')
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+
+def disconnect(conn: sqlite3.Connection):
+    """
+    关闭 connect 创建的连接
+    """
+    with _connections_lock:
+        if conn in _connections:
+            _connections.remove(conn)
+    conn.close()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    当前线程的连接，第一次使用时创建
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.generation != _generation:
+        conn = _local.conn = connect()
+        _local.generation = _generation
+    return conn
 
 
 def create_default_tables():
-    # # 创建表
-    # cursor.execute('''CREATE TABLE IF NOT EXISTS `users`
-    #                   (id INTEGER PRIMARY KEY AUTOINCREMENT,
-    #                   username VARCHAR(255) NOT NULL,
-    #                   password  VARCHAR(64) NOT NULL,
-    #                   nick_name VARCHAR(255),
-    #                   email VARCHAR(255) unique,
-    #                   activated INT default 0,
-    #                   create_time datetime default (datetime('now', 'localtime')),
-    #                   uid VARCHAR(64) NOT NULL unique,
-    #                   session_id VARCHAR(255),
-    #                   session_time TIMESTAMP,
-    #                   activate_code INT default 0,
-    #                   activate_prepare_time TIMESTAMP,
-    #                   pay_id VARCHAR(128) NOT NULL)''')
-    return
+    conn = get_connection()
+    with conn:
+        # # 创建表
+        # cursor.execute('''CREATE TABLE IF NOT EXISTS `users`
+        #                   (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        #                   username VARCHAR(255) NOT NULL,
+        #                   password  VARCHAR(64) NOT NULL,
+        #                   nick_name VARCHAR(255),
+        #                   email VARCHAR(255) unique,
+        #                   activated INT default 0,
+        #                   create_time datetime default (datetime('now', 'localtime')),
+        #                   uid VARCHAR(64) NOT NULL unique,
+        #                   session_id VARCHAR(255),
+        #                   session_time TIMESTAMP,
+        #                   activate_code INT default 0,
+        #                   activate_prepare_time TIMESTAMP,
+        #                   pay_id VARCHAR(128) NOT NULL)''')
+
+        # /generate 的响应缓存（磁盘层）
+        conn.execute('''CREATE TABLE IF NOT EXISTS `response_cache`
+                        (cache_key VARCHAR(64) PRIMARY KEY,
+                        body TEXT NOT NULL,
+                        create_time REAL NOT NULL,
+                        access_time REAL NOT NULL)''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS `idx_response_cache_access`
+                        ON `response_cache` (access_time)''')
+
+        # 按 uid + 模型 + 日期汇总的 LLM 用量
+        conn.execute('''CREATE TABLE IF NOT EXISTS `llm_usage`
+                        (uid VARCHAR(64) NOT NULL,
+                        model VARCHAR(128) NOT NULL,
+                        day VARCHAR(10) NOT NULL,
+                        requests INT default 0,
+                        prompt_tokens INT default 0,
+                        completion_tokens INT default 0,
+                        PRIMARY KEY (uid, model, day))''')
+
+
+def execute(sql: str, params: Sequence[Any] = ()) -> int:
+    """
+    执行一条写语句并提交，返回影响的行数
+    """
+    conn = get_connection()
+    with conn:
+        return conn.execute(sql, params).rowcount
+
+
+def execute_many(sql: str, seq_of_params) -> int:
+    """
+    同一条语句的多组参数在一个事务中执行
+    """
+    conn = get_connection()
+    with conn:
+        return conn.executemany(sql, seq_of_params).rowcount
+
+
+def query(sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+    return get_connection().execute(sql, params).fetchall()
 
 
 def write_db(sql: str):
-    cursor.execute(sql)
-    return conn.commit()
+    execute(sql)
 
 
 def params_update_db(sql, data):
-    cursor.execute(sql, data)
-    affected_rows = cursor.rowcount
-    return conn.commit(), affected_rows
+    return None, execute(sql, data)
 
 
 def update_db(sql: str):
@@ -41,21 +143,139 @@ def update_db(sql: str):
     :param sql:
     :return: 异常str(无异常返回None), 影响的行数
     """
-    cursor.execute(sql)
-    affected_rows = cursor.rowcount
-    return conn.commit(), affected_rows
+    return None, execute(sql)
 
 
 def write_db_para(sql: str, params):
-    cursor.execute(sql, params)
-    affected_rows = cursor.rowcount
-    return conn.commit(), affected_rows
+    return None, execute(sql, params)
 
 
 def read_db(sql: str):
-    cursor.execute(sql)
-    return cursor.fetchall()
+    return query(sql)
+
+
+def read_db_para(sql: str, params):
+    return query(sql, params)
+
+
+class WriteBehindQueue:
+    """
+    写线程：submit 立即返回，语句按提交顺序每批最多 batch_size 条在一个事务中提交。
+    一批中有语句出错时回滚，再逐条提交，只丢弃出错的语句
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size: int = 200, max_size: int = 10000):
+        self.batch_size = batch_size
+        self._queue: 'queue.Queue' = queue.Queue(maxsize=max_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, sql: str, params: Sequence[Any] = ()) -> bool:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            write_dropped.inc(reason='queue_full')
+            logger.warning(f"SQLite write queue is full, dropping: {sql[:80]}")
+            return False
+        write_queue_depth.set(self._queue.qsize())
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待已提交的语句全部写入，超时返回 False
+        """
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(self._STOP)
+        thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = get_connection()
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while item is not self._STOP and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            stop = batch[-1] is self._STOP
+            statements = batch[:-1] if stop else batch
+            try:
+                if statements:
+                    self._commit(conn, statements)
+            finally:
+                write_queue_depth.set(self._queue.qsize())
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _commit(self, conn: sqlite3.Connection, statements):
+        try:
+            with conn:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+            write_batch_size.observe(len(statements))
+            return
+        except sqlite3.Error as e:
+            if len(statements) == 1:
+                write_dropped.inc(reason='error')
+                logger.warning(f"SQLite write failed: {e}: {statements[0][0][:80]}")
+                return
+        for statement in statements:
+            self._commit(conn, [statement])
+
+
+write_queue = WriteBehindQueue(SQLITE_WRITE_BATCH, SQLITE_WRITE_QUEUE_MAX)
+
+
+def write_behind(sql: str, params: Sequence[Any] = ()) -> bool:
+    """
+    不等待结果的写入，在写线程中批量提交。队列满时丢弃并返回 False
+    """
+    return write_queue.submit(sql, params)
 
 
 def close():
-    conn.close()
+    """
+    写完排队的语句，关闭所有线程的连接
+    """
+    global _generation
+    write_queue.flush(timeout=10)
+    write_queue.close(timeout=10)
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+        _generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
@@ -1,33 +1,205 @@
 import os
-from typing import Optional
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# 配置变化回调，参数是值有变化的配置键
+ChangeCallback = Callable[[Set[str]], None]
+
+_TRUE_VALUES = ('true', '1', 'yes', 'on')
+_FALSE_VALUES = ('false', '0', 'no', 'off')
+
+
+def parse_env_file(env_path: str) -> Dict[str, str]:
+    """
+    解析 .env 文件：忽略空行和 # 开头的注释，同一个键出现多次时以第一次为准
+    """
+    values = {}
+    with open(env_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                try:
+                    k, v = line.split('=', 1)
+                except ValueError:
+                    continue
+                values.setdefault(k.strip(), v.strip())
+    return values
+
+
+def _file_version(env_path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(env_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Settings:
+    """
+    .env 解析后的只读快照。类型化的读取方法在值不合法时抛出 ValueError，错误信息包含配置键名
+    """
+
+    def __init__(self, values: Dict[str, str], version: Optional[Tuple[int, int]] = None):
+        self._values = values
+        # 解析时 .env 的 (修改时间, 大小)
+        self.version = version
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self._values.get(key, default)
+
+    def get_int(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        value = self._values.get(key)
+        if not value:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"配置项 {key} 应该是整数: {value!r}") from None
+
+    def get_float(self, key: str, default: Optional[float] = None) -> Optional[float]:
+        value = self._values.get(key)
+        if not value:
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"配置项 {key} 应该是数字: {value!r}") from None
+
+    def get_bool(self, key: str, default: Optional[bool] = None) -> Optional[bool]:
+        value = self._values.get(key)
+        if not value:
+            return default
+        if value.lower() in _TRUE_VALUES:
+            return True
+        if value.lower() in _FALSE_VALUES:
+            return False
+        raise ValueError(f"配置项 {key} 应该是 true 或 false: {value!r}")
+
+    def changed_keys(self, other: 'Settings') -> Set[str]:
+        keys = self._values.keys() | other._values.keys()
+        return {key for key in keys if self._values.get(key) != other._values.get(key)}
 
 
 class EnvHelper:
+    """
+    .env 只在第一次读取时解析，之后从内存中的 Settings 读取，不再访问磁盘。
+    start_watching 启动后台线程按修改时间检查 .env，变化时重新加载并调用 on_change 注册的回调
+    """
+
+    _settings: Optional[Settings] = None
+    _env_path: Optional[str] = None
+    _lock = threading.Lock()
+    _callbacks: List[ChangeCallback] = []
+    _watcher: Optional[threading.Thread] = None
+    _stop_watching: Optional[threading.Event] = None
+
     @staticmethod
     def get_env_value(key: str, default: Optional[str] = None) -> Optional[str]:
         """
-        动态读取.env文件中的配置值
+        读取.env文件中的配置值
         :param key: 配置键名
         :param default: 默认值
         :return: 配置值或默认值
         """
-        # 获取当前工作目录（即项目根目录）下的 .env 文件
-        env_path = os.path.join(os.getcwd(), '.env')
-        
+        return EnvHelper.settings().get(key, default)
+
+    @staticmethod
+    def get_int(key: str, default: Optional[int] = None) -> Optional[int]:
+        return EnvHelper.settings().get_int(key, default)
+
+    @staticmethod
+    def get_float(key: str, default: Optional[float] = None) -> Optional[float]:
+        return EnvHelper.settings().get_float(key, default)
+
+    @staticmethod
+    def get_bool(key: str, default: Optional[bool] = None) -> Optional[bool]:
+        return EnvHelper.settings().get_bool(key, default)
+
+    @classmethod
+    def settings(cls) -> Settings:
+        settings = cls._settings
+        if settings is None:
+            with cls._lock:
+                if cls._settings is None:
+                    cls._settings = cls._load()
+                settings = cls._settings
+        return settings
+
+    @classmethod
+    def env_path(cls) -> str:
+        # 当前工作目录（即项目根目录）下的 .env 文件，第一次读取时确定
+        if cls._env_path is None:
+            cls._env_path = os.path.join(os.getcwd(), '.env')
+        return cls._env_path
+
+    @classmethod
+    def _load(cls) -> Settings:
+        env_path = cls.env_path()
         try:
-            with open(env_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        try:
-                            k, v = line.split('=', 1)
-                            if k.strip() == key:
-                                return v.strip()
-                        except ValueError:
-                            continue
+            return Settings(parse_env_file(env_path), _file_version(env_path))
         except FileNotFoundError:
             print(f"警告: 未找到.env文件在路径 {env_path}")
         except Exception as e:
             print(f"读取.env文件时发生错误: {str(e)}")
-            
-        return default
+        return Settings({})
+
+    @classmethod
+    def reload(cls, force: bool = False) -> Set[str]:
+        """
+        .env 的修改时间变化（或 force）时重新解析，返回值有变化的键并调用回调
+        """
+        with cls._lock:
+            old = cls._settings
+            version = _file_version(cls.env_path())
+            # 编辑器保存时文件可能短暂不存在，保留原来的配置
+            if old is not None and (version is None or (version == old.version and not force)):
+                return set()
+            new = cls._load()
+            cls._settings = new
+            callbacks = list(cls._callbacks)
+
+        changed = new.changed_keys(old) if old is not None else set()
+        if changed:
+            print(f".env 已重新加载，变化的配置: {', '.join(sorted(changed))}")
+            for callback in callbacks:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"配置变化回调出错: {str(e)}")
+        return changed
+
+    @classmethod
+    def on_change(cls, callback: ChangeCallback):
+        """
+        注册配置变化回调。回调在监视线程中执行，需要线程安全
+        """
+        with cls._lock:
+            cls._callbacks.append(callback)
+
+    @classmethod
+    def start_watching(cls, interval: Optional[float] = None):
+        """
+        每 interval 秒检查一次 .env 的修改时间，默认读取 ENV_RELOAD_INTERVAL，0 表示不监视
+        """
+        if interval is None:
+            interval = cls.get_float('ENV_RELOAD_INTERVAL', 5.0)
+        if interval <= 0 or cls._watcher is not None:
+            return
+        cls.settings()
+        stop = cls._stop_watching = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                cls.reload()
+
+        cls._watcher = threading.Thread(target=watch, name='env-watcher', daemon=True)
+        cls._watcher.start()
+
+    @classmethod
+    def stop_watching(cls):
+        if cls._watcher is None:
+            return
+        cls._stop_watching.set()
+        cls._watcher.join()
+        cls._watcher = None
+        cls._stop_watching = None
@@ -3,6 +3,7 @@ import logging
 import os
 import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,14 +12,39 @@ from pydantic import ValidationError
 from env_helper import EnvHelper
 
 from router.deepseek import router as deepseek_router
-from router.csm import router as csm_router
+from router.csm import router as csm_router, job_manager
+from router.health import router as health_router, warm_up_models
 
-from database.mysql_helper import create_default_tables
+from database.mysql_helper import create_default_tables, close as close_db
+from database import async_db
+from chat_function import http_client
 
 create_default_tables()
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # .env 修改后自动重新加载
+    EnvHelper.start_watching()
+    # 到上游 LLM 的共享连接池
+    await http_client.startup()
+    # 模型在后台预热，uvicorn 可以立即开始接收请求
+    warmup_task = asyncio.create_task(warm_up_models())
+    yield
+    if not warmup_task.done():
+        warmup_task.cancel()
+    await http_client.shutdown()
+    # 取消还在排队的语音任务，等正在执行的任务结束（它们还会写缓存），不阻塞事件循环
+    await asyncio.to_thread(job_manager.shutdown, True)
+    # 写完排队的用量和缓存记录
+    async_db.shutdown()
+    close_db()
+    EnvHelper.stop_watching()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     '*'
 ]
@@ -30,11 +56,13 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
     # 透传的response header都要放在这里
-    expose_headers=["session_id", "uid", 'pd-version', 'content-type'],
+    expose_headers=["session_id", "uid", 'pd-version', 'content-type', 'X-Request-ID',
+                    'X-Prompt-Tokens', 'X-Prompt-Tokens-Original', 'X-Prompt-Budget', 'X-Trimmed-Messages'],
 )
 
 app.include_router(deepseek_router)
 app.include_router(csm_router)
+app.include_router(health_router)
 
 
 @app.exception_handler(ValidationError)
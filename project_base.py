@@ -8,18 +8,17 @@ need_authenticate = False
 
 from env_helper import EnvHelper
 
-SAGA_VERSION = EnvHelper.get_env_value('SAGA_VERSION')
-
 
 async def authenticate_api(saga_version: str = Header(...)):
-    if saga_version != SAGA_VERSION:
+    # 每次读取当前配置，.env 重新加载后立即生效
+    if saga_version != EnvHelper.get_env_value('SAGA_VERSION'):
         # todo 打印日志，记录攻击
         raise HTTPException(status_code=403, detail="Invalid api version")
     return True
 
 
 async def authenticate_web_chatgpt_api(mc: str = Header(...)):
-    if mc != SAGA_VERSION:
+    if mc != EnvHelper.get_env_value('SAGA_VERSION'):
         # todo 打印日志，记录攻击
         raise HTTPException(status_code=403, detail="Invalid api version")
     return True
@@ -1,13 +1,18 @@
 from fastapi import APIRouter, File, Form, UploadFile, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from project_base import authenticate_api
+from env_helper import EnvHelper
 import os
+import json
 import logging
 from datetime import datetime
 import platform
 from ai_components.AudioSpliter.spliter import Splitter
-from ai_components.Asr.asr import ASR
+from ai_components.Asr.asr import ASR, ASR_MODEL_REVISION, path_asr, path_vad, path_punc
 from utils.session import generate_session_id
+from utils.job_queue import JobManager, QueueFullError
+from utils.voice_cache import VoiceResultCache, make_key
 
 router = APIRouter()
 
@@ -16,6 +21,42 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 logger = logging.getLogger(__name__)
 
+# 切出来的片段是否落盘（split_info 的 key 指向这些文件），ASR 始终直接使用内存中的片段
+CSM_WRITE_CLIPS = EnvHelper.get_bool('CSM_WRITE_CLIPS', True)
+
+# ASR 识别语言
+CSM_ASR_LANGUAGE = 'en'
+
+# 切分+ASR 在有界线程池里执行，接口只负责入队
+job_manager = JobManager(
+    max_workers=EnvHelper.get_int('CSM_JOB_WORKERS', 1),
+    max_pending=EnvHelper.get_int('CSM_JOB_MAX_PENDING', 32),
+    retention=EnvHelper.get_int('CSM_JOB_RETENTION', 3600),
+)
+
+# 相同音频+相同参数的上传直接复用之前的切分和识别结果
+VOICE_CACHE_ENABLED = EnvHelper.get_bool('VOICE_CACHE_ENABLED', True)
+voice_cache = VoiceResultCache(
+    os.path.join(PROJECT_ROOT, 'asr_result', '_cache'),
+    max_bytes=EnvHelper.get_int('VOICE_CACHE_MAX_MB', 2048) * 1024 * 1024,
+    max_age=EnvHelper.get_float('VOICE_CACHE_MAX_AGE_HOURS', 168) * 3600,
+) if VOICE_CACHE_ENABLED else None
+
+
+def _cache_params():
+    # asr_voice 用默认参数切分，直接读取默认值，导入时不创建 Splitter
+    return {
+        'splitter': Splitter.default_params(),
+        'sample_rate': Splitter.sample_rate,
+        'write_clips': CSM_WRITE_CLIPS,
+        'language': CSM_ASR_LANGUAGE,
+        'models': [path_asr, path_vad, path_punc],
+        'model_revision': ASR_MODEL_REVISION,
+    }
+
+
+VOICE_CACHE_PARAMS = _cache_params()
+
 
 @router.post('/csm/voice/update')
 async def upload_ref_voice(voice: UploadFile = File(...), uid: str = Form(...), info: str = Form(...),
@@ -39,19 +80,32 @@ async def upload_ref_voice(voice: UploadFile = File(...), uid: str = Form(...),
 
         # 读取并保存文件
         voice_content = await voice.read()
-        with open(file_path, 'wb') as f:
-            f.write(voice_content)
 
-        # 解析抽取成token， 这是一个key-value的json对象，key是语音文件路径，value是对应文本
-        annotation_info = asr_voice(file_path, uid, session_id=session_id)
-         # todo 调用本地的python服务，完成解析
+        # 同样的音频之前处理过，直接返回缓存的结果
+        cache_key = None
+        if voice_cache is not None:
+            cache_key = await run_in_threadpool(make_key, voice_content, VOICE_CACHE_PARAMS)
+            split_info = await run_in_threadpool(voice_cache.get, cache_key, _split_folder(uid, session_id))
+            if split_info is not None:
+                job = job_manager.completed('asr_voice', split_info,
+                                            meta={'uid': uid, 'session_id': session_id, 'cached': True})
+                return _job_accepted(job)
+
+        await run_in_threadpool(_save_file, file_path, voice_content)
 
+        # 解析抽取成token， 这是一个key-value的json对象，key是语音文件路径，value是对应文本
+        # 结果通过 /csm/jobs/{job_id} 查询
+        try:
+            job = job_manager.submit('asr_voice', asr_voice, file_path, uid, session_id=session_id,
+                                     cache_key=cache_key, meta={'uid': uid, 'session_id': session_id})
+        except QueueFullError:
+            await run_in_threadpool(_remove_file, file_path)
+            return JSONResponse(status_code=503, content={
+                'status': 'error',
+                'message': 'too many voice jobs in progress, please retry later'
+            })
 
-        return JSONResponse(content={
-            'status': 'success',
-            'message': 'upload success',
-            'split_info': annotation_info,
-        })
+        return _job_accepted(job)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -62,31 +116,91 @@ async def upload_ref_voice(voice: UploadFile = File(...), uid: str = Form(...),
         )
 
 
+@router.get('/csm/jobs/{job_id}')
+async def get_job(job_id: str, authenticated: bool = Depends(authenticate_api)):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={'status': 'error', 'message': 'job not found'})
+    return JSONResponse(content=job.to_dict())
+
+
+@router.get('/csm/jobs/{job_id}/events')
+async def get_job_events(job_id: str, authenticated: bool = Depends(authenticate_api)):
+    """
+    以 SSE 推送任务进度，任务结束后关闭连接
+    """
+    if job_manager.get(job_id) is None:
+        return JSONResponse(status_code=404, content={'status': 'error', 'message': 'job not found'})
+
+    async def event_stream():
+        async for snapshot in job_manager.watch(job_id):
+            if snapshot is None:
+                # 心跳，防止代理断开空闲连接
+                yield ': keep-alive\n\n'
+                continue
+            yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.get('/csm/cache/stats')
+async def get_cache_stats(authenticated: bool = Depends(authenticate_api)):
+    if voice_cache is None:
+        return JSONResponse(content={'enabled': False})
+    return JSONResponse(content={'enabled': True, **voice_cache.stats()})
+
+
+def _job_accepted(job):
+    # 命中缓存时任务已经是 success，客户端按同样的方式查询结果
+    return JSONResponse(status_code=202, content={
+        'status': 'accepted',
+        'message': 'upload success',
+        'job_id': job.job_id,
+        'job_status': job.status,
+        'cached': bool(job.meta.get('cached')),
+        'status_url': f'/csm/jobs/{job.job_id}',
+        'events_url': f'/csm/jobs/{job.job_id}/events',
+    })
+
+
+def _save_file(file_path, content):
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+
+def _remove_file(file_path):
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+
 def _path_strip(path_str):
     if platform.system() == 'Windows':
         path_str = path_str.replace('/', '\\')
     return path_str.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
 
 
-def asr_voice(wav_file, uid, session_id):
-    wav_split_folder = _path_strip("%s/asr_result/%s/%s/wav_split" % (PROJECT_ROOT, uid, session_id))
+def _split_folder(uid, session_id):
+    return _path_strip("%s/asr_result/%s/%s/wav_split" % (PROJECT_ROOT, uid, session_id))
 
-    # 确保 wav_split 文件夹存在
-    os.makedirs(wav_split_folder, exist_ok=True)
 
-    splitter = Splitter(wav_file, wav_split_folder)
-    ret = splitter.begin_slice()
-    if ret is not None:
-        logger.warning(ret)
-        raise Exception('analysis voice failed.')
+def asr_voice(wav_file, uid, session_id, progress=None, cache_key=None):
+    if progress is None:
+        progress = _no_progress
 
-    asr_out_folder = _path_strip("%s/asr_result/%s/%s/asr_out" % (PROJECT_ROOT, uid, session_id))
-    # 确保 asr_out 文件夹存在
-    os.makedirs(asr_out_folder, exist_ok=True)
+    wav_split_folder = _split_folder(uid, session_id)
+
+    # 切分和 ASR 串成流水线，切出的片段直接在内存里送去识别
+    progress('split', 0.0)
+    splitter = Splitter(wav_file, wav_split_folder, write_clips=CSM_WRITE_CLIPS)
 
     # step 2 asr分离出语料pairs
-    asr = ASR(wav_split_folder, asr_out_folder, language='en')
-    annotation_info = asr.open_asr()
+    asr = ASR(language=CSM_ASR_LANGUAGE)
+    def asr_progress(done, total):
+        # 片段总数未知时，用切分进度（已经读过的音频比例）近似识别进度
+        progress('asr', done / total if total else splitter.progress)
+
+    annotation_info = asr.transcribe_chunks(splitter.iter_chunks(), progress_callback=asr_progress)
 
     # 删除临时文件夹
     try:
@@ -98,4 +212,11 @@ def asr_voice(wav_file, uid, session_id):
     except Exception as e:
         logger.warning(f"删除临时文件夹失败: {str(e)}")
 
+    if cache_key is not None and voice_cache is not None:
+        voice_cache.put(cache_key, annotation_info)
+
     return annotation_info
+
+
+def _no_progress(stage, fraction=0.0):
+    return None
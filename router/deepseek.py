@@ -1,8 +1,9 @@
 import asyncio
 import logging
-from fastapi import APIRouter, Request, BackgroundTasks, Depends
+from fastapi import APIRouter, Request, Depends
 from fastapi.responses import StreamingResponse, JSONResponse
 from chat_function.deepseek import send_deepseek_request
+from chat_function.cancellation import registry
 from project_base import authenticate_api
 # 日志配置
 logger = logging.getLogger(__name__)
@@ -31,50 +32,75 @@ logger = logging.getLogger(__name__)
 # 创建FastAPI应用
 router = APIRouter()
 
-# 存储活动的请求
-active_requests = {}
-
 
 # 生成路由
 @router.post("/generate")
-async def generate(request: Request, background_tasks: BackgroundTasks,
-                   authenticated: bool = Depends(authenticate_api)):
+async def generate(request: Request, authenticated: bool = Depends(authenticate_api)):
     """
-    处理生成请求
+    处理生成请求，响应头 X-Request-ID 可以用于 DELETE /generate/{request_id} 取消
     """
+    # 生成请求ID并登记取消事件
+    request_id, cancel_event = registry.register()
     try:
         # 解析请求数据
         request_data = await request.json()
 
         # 验证请求数据
         if not request_data:
+            registry.unregister(request_id)
             return JSONResponse(status_code=400, content={"error": True})
 
-        # 生成请求ID
-        request_id = str(id(request))
-
-        # 创建取消事件
-        cancel_event = asyncio.Event()
-        active_requests[request_id] = cancel_event
+        # 等待上游响应期间客户端断开，取消请求
+        watcher = asyncio.create_task(_watch_disconnect(request, request_id))
+        try:
+            uid = request.headers.get('uid') or request_data.get('uid')
+            session_id = request.headers.get('session_id') or request_data.get('session_id')
+            response = await send_deepseek_request(request_data, cancel_event, uid=uid, session_id=session_id)
+        finally:
+            watcher.cancel()
 
-        # 添加清理任务
-        background_tasks.add_task(cleanup_request, request_id)
-
-        response = await send_deepseek_request(request_data, cancel_event)
         # 在响应头中添加请求ID
+        response.headers["X-Request-ID"] = request_id
         if isinstance(response, StreamingResponse):
-            response.headers["X-Request-ID"] = request_id
+            # 流式响应在转发结束时注销；客户端断开时 Starlette 会关闭生成器
+            response.body_iterator = _unregister_after_stream(response.body_iterator, request_id)
+        else:
+            registry.unregister(request_id)
         return response
 
     except Exception as e:
+        registry.unregister(request_id)
         logger.error(f"Error in generate endpoint: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"error": {"message": str(e)}})
+    except asyncio.CancelledError:
+        registry.unregister(request_id)
+        raise
 
 
-async def cleanup_request(request_id: str):
+@router.delete("/generate/{request_id}")
+async def cancel_generate(request_id: str, authenticated: bool = Depends(authenticate_api)):
     """
-    清理请求资源
+    取消进行中的生成请求，排队、重试和流式转发中的上游请求都会被中止
     """
-    await asyncio.sleep(300)  # 5分钟后清理
-    if request_id in active_requests:
-        del active_requests[request_id]
+    if not registry.cancel(request_id):
+        return JSONResponse(status_code=404, content={"error": {"message": "Request not found or already finished"}})
+    return JSONResponse(content={"cancelled": True, "request_id": request_id})
+
+
+async def _watch_disconnect(request: Request, request_id: str):
+    # 请求体已经读完，receive 只会在客户端断开时返回 http.disconnect
+    while True:
+        message = await request.receive()
+        if message['type'] == 'http.disconnect':
+            logger.info(f"Client disconnected, cancelling request {request_id}")
+            registry.cancel(request_id, reason='client_disconnect')
+            return
+
+
+async def _unregister_after_stream(body_iterator, request_id: str):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        registry.unregister(request_id)
+        await body_iterator.aclose()
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+from env_helper import EnvHelper
+from ai_components.Asr import asr
+from utils import metrics
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# 启动后是否在后台预热 ASR 模型；不预热时模型在第一次识别时加载
+ASR_WARMUP = EnvHelper.get_bool('ASR_WARMUP', False)
+
+# 预热状态：模型名 -> loading/loaded/failed
+warmup_state = {}
+
+
+async def warm_up_models():
+    """
+    在线程里加载需要预热的模型，不阻塞 uvicorn 绑定端口
+    """
+    if ASR_WARMUP and not asr.ASR_SERVER_ADDRESS:
+        warmup_state['asr'] = 'loading'
+        try:
+            await asyncio.to_thread(asr.load_model)
+            warmup_state['asr'] = 'loaded'
+        except Exception as e:
+            warmup_state['asr'] = 'failed'
+            logger.error(f"ASR model warm-up failed: {e}", exc_info=True)
+
+
+@router.get('/healthz/ready')
+async def ready():
+    """
+    就绪检查：所有需要预热的模型都加载完成后返回 200，否则返回 503
+    """
+    models = {'asr': asr.model_status()}
+    for name, state in warmup_state.items():
+        models[name]['warmup'] = state
+
+    is_ready = all(state == 'loaded' for state in warmup_state.values())
+    return JSONResponse(status_code=200 if is_ready else 503, content={
+        'ready': is_ready,
+        'models': models,
+    })
+
+
+@router.get('/metrics')
+async def get_metrics():
+    """
+    Prometheus 文本格式的指标
+    """
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
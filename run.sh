@@ -13,4 +13,25 @@ python3.10 -m venv .venv
 source .venv/bin/activate
 export NO_TORCH_COMPILE=1
 
+# 配置了 ASR_SERVER_ADDRESS 时，先启动共享的 ASR 模型服务进程
+if grep -q '^ASR_SERVER_ADDRESS=.\+' .env 2>/dev/null; then
+    asr_pid=$(ps -ef | grep "ai_components.Asr.model_server" | grep -v grep | awk '{print $2}')
+    if [ -z "$asr_pid" ]; then
+        nohup python -m ai_components.Asr.model_server > asr_server.log 2>&1 &
+        echo "Started ASR model server"
+    fi
+fi
+
 nohup python main.py --saga &
+
+# 等待服务就绪（模型预热完成）
+port=$(grep '^SVC_PORT=' .env 2>/dev/null | cut -d '=' -f 2)
+if [ -n "$port" ]; then
+    for _ in $(seq 1 120); do
+        if curl -sf "http://127.0.0.1:$port/healthz/ready" > /dev/null; then
+            echo "Service is ready"
+            break
+        fi
+        sleep 1
+    done
+fi
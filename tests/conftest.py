@@ -0,0 +1,21 @@
+import os
+import sys
+
+# 测试从仓库根目录导入模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """
+    把 SQLite 数据库指向临时目录并建好默认表，测试结束后写完排队的语句并关闭连接
+    """
+    from database import async_db, mysql_helper
+
+    monkeypatch.setattr(mysql_helper, 'SQLITE_PATH', str(tmp_path / 'saga_test.db'))
+    mysql_helper.create_default_tables()
+    yield mysql_helper
+    async_db.shutdown()
+    mysql_helper.close()
@@ -0,0 +1,228 @@
+# 测试和 benchmarks 共用的对照实现和随机数据：优化前的原始实现保留在这里，用来验证新实现的输出完全一致
+import base64
+import random
+
+import numpy as np
+
+from utils.prompt_convert import PROMPT_PLACEHOLDER
+
+MODES = {
+    'merge': (False, False),
+    'semi': (True, False),
+    'strict': (True, True),
+}
+
+
+def legacy_merge_messages(messages, names, strict, placeholders):
+    """
+    原来 utils/prompt_convert.merge_messages 的实现，作为对照。会修改传入的消息
+    """
+    merged_messages = []
+    content_tokens = {}
+
+    for message in messages:
+        if 'content' not in message:
+            message['content'] = ''
+
+        if isinstance(message['content'], list):
+            text_parts = []
+            for content in message['content']:
+                if content['type'] == 'text':
+                    text_parts.append(content['text'])
+                elif content['type'] == 'image_url':
+                    token = base64.b64encode(random.randbytes(32)).decode('utf-8')
+                    content_tokens[token] = content
+                    text_parts.append(token)
+                else:
+                    text_parts.append('')
+            message['content'] = '\n\n'.join(text_parts)
+
+        if message['role'] == 'system' and message.get('name') == 'example_assistant':
+            if names.char_name and not message['content'].startswith(
+                    f"{names.char_name}: ") and not names.starts_with_group_name(message['content']):
+                message['content'] = f"{names.char_name}: {message['content']}"
+
+        if message['role'] == 'system' and message.get('name') == 'example_user':
+            if names.user_name and not message['content'].startswith(f"{names.user_name}: "):
+                message['content'] = f"{names.user_name}: {message['content']}"
+
+        if message.get('name') and message['role'] != 'system':
+            if not message['content'].startswith(f"{message['name']}: "):
+                message['content'] = f"{message['name']}: {message['content']}"
+
+        if message['role'] == 'tool':
+            message['role'] = 'user'
+
+        if 'name' in message:
+            del message['name']
+        if 'tool_calls' in message:
+            del message['tool_calls']
+        if 'tool_call_id' in message:
+            del message['tool_call_id']
+
+    for message in messages:
+        if merged_messages and merged_messages[-1]['role'] == message['role'] and message['content']:
+            merged_messages[-1]['content'] += '\n\n' + message['content']
+        else:
+            merged_messages.append(message)
+
+    if not merged_messages:
+        merged_messages.insert(0, {'role': 'user', 'content': PROMPT_PLACEHOLDER})
+
+    if content_tokens:
+        for message in merged_messages:
+            has_valid_token = any(token in message['content'] for token in content_tokens.keys())
+            if has_valid_token:
+                split_content = message['content'].split('\n\n')
+                merged_content = []
+                for content in split_content:
+                    if content in content_tokens:
+                        merged_content.append(content_tokens[content])
+                    else:
+                        if merged_content and merged_content[-1]['type'] == 'text':
+                            merged_content[-1]['text'] += f"\n\n{content}"
+                        else:
+                            merged_content.append({'type': 'text', 'text': content})
+                message['content'] = merged_content
+
+    if strict:
+        for i in range(len(merged_messages)):
+            if i > 0 and merged_messages[i]['role'] == 'system':
+                merged_messages[i]['role'] = 'user'
+
+        if merged_messages and placeholders:
+            if merged_messages[0]['role'] == 'system' and (
+                    len(merged_messages) == 1 or merged_messages[1]['role'] != 'user'):
+                merged_messages.insert(1, {'role': 'user', 'content': PROMPT_PLACEHOLDER})
+            elif merged_messages[0]['role'] != 'system' and merged_messages[0]['role'] != 'user':
+                merged_messages.insert(0, {'role': 'user', 'content': PROMPT_PLACEHOLDER})
+
+        return legacy_merge_messages(merged_messages, names, False, placeholders)
+
+    return merged_messages
+
+
+def random_text(rng):
+    words = ['hello', 'world', '你好', '*waves*', 'Alice: hi', 'Bob:', '', '\n\n', 'line\n\nbreak', '"quote"']
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(0, 12)))
+
+
+def random_content(rng, named):
+    """
+    随机生成字符串或多段内容。带名称的消息不以图片开头——原实现会把随机令牌当作文本输出，无法比较
+    """
+    kind = rng.random()
+    if kind < 0.6:
+        return random_text(rng)
+    if kind < 0.65:
+        return []
+    parts = []
+    for i in range(rng.randint(1, 5)):
+        part_kind = rng.random()
+        if part_kind < 0.3 and not (named and i == 0):
+            parts.append({'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{rng.random()}'}})
+        elif part_kind < 0.35:
+            parts.append({'type': 'input_audio', 'input_audio': {}})
+        else:
+            parts.append({'type': 'text', 'text': random_text(rng)})
+    return parts
+
+
+def random_history(rng, turns):
+    messages = []
+    for _ in range(turns):
+        role = rng.choice(['system', 'user', 'user', 'assistant', 'assistant', 'tool'])
+        message = {'role': role}
+        name = None
+        if role == 'system' and rng.random() < 0.3:
+            name = rng.choice(['example_assistant', 'example_user'])
+        elif role != 'system' and rng.random() < 0.3:
+            name = rng.choice(['Alice', 'Bob'])
+        if name:
+            message['name'] = name
+        if rng.random() < 0.95:
+            message['content'] = random_content(rng, bool(name))
+        if role == 'assistant' and rng.random() < 0.1:
+            message['tool_calls'] = [{'id': 'call', 'function': {'name': 'f', 'arguments': '{}'}}]
+        if role == 'tool':
+            message['tool_call_id'] = 'call'
+        if rng.random() < 0.05:
+            message['prefix'] = True
+        messages.append(message)
+    return messages
+
+
+def legacy_sil_tags(slicer, rms_list):
+    """
+    原来 Slicer.slice 中逐帧遍历 rms_list 的实现，作为对照
+    """
+    sil_tags = []
+    silence_start = None
+    clip_start = 0
+    for i, rms in enumerate(rms_list):
+        if rms < slicer.threshold:
+            if silence_start is None:
+                silence_start = i
+            continue
+        if silence_start is None:
+            continue
+        is_leading_silence = silence_start == 0 and i > slicer.max_sil_kept
+        need_slice_middle = (
+                i - silence_start >= slicer.min_interval
+                and i - clip_start >= slicer.min_length
+        )
+        if not is_leading_silence and not need_slice_middle:
+            silence_start = None
+            continue
+        if i - silence_start <= slicer.max_sil_kept:
+            pos = rms_list[silence_start: i + 1].argmin() + silence_start
+            if silence_start == 0:
+                sil_tags.append((0, pos))
+            else:
+                sil_tags.append((pos, pos))
+            clip_start = pos
+        elif i - silence_start <= slicer.max_sil_kept * 2:
+            pos = rms_list[i - slicer.max_sil_kept: silence_start + slicer.max_sil_kept + 1].argmin()
+            pos += i - slicer.max_sil_kept
+            pos_l = rms_list[silence_start: silence_start + slicer.max_sil_kept + 1].argmin() + silence_start
+            pos_r = rms_list[i - slicer.max_sil_kept: i + 1].argmin() + i - slicer.max_sil_kept
+            if silence_start == 0:
+                sil_tags.append((0, pos_r))
+                clip_start = pos_r
+            else:
+                sil_tags.append((min(pos_l, pos), max(pos_r, pos)))
+                clip_start = max(pos_r, pos)
+        else:
+            pos_l = rms_list[silence_start: silence_start + slicer.max_sil_kept + 1].argmin() + silence_start
+            pos_r = rms_list[i - slicer.max_sil_kept: i + 1].argmin() + i - slicer.max_sil_kept
+            if silence_start == 0:
+                sil_tags.append((0, pos_r))
+            else:
+                sil_tags.append((pos_l, pos_r))
+            clip_start = pos_r
+        silence_start = None
+    total_frames = rms_list.shape[0]
+    if silence_start is not None and total_frames - silence_start >= slicer.min_interval:
+        silence_end = min(total_frames, silence_start + slicer.max_sil_kept)
+        pos = rms_list[silence_start: silence_end + 1].argmin() + silence_start
+        sil_tags.append((pos, total_frames + 1))
+    return sil_tags
+
+
+def synthetic_rms(frames, rng):
+    """
+    模拟语音的音量曲线：说话段和长短不一的停顿交替出现
+    """
+    rms = np.empty(frames, dtype=np.float32)
+    pos = 0
+    speaking = rng.random() < 0.5
+    while pos < frames:
+        if speaking:
+            length = int(rng.integers(50, 1500))
+            rms[pos: pos + length] = rng.uniform(0.05, 0.5, size=min(length, frames - pos))
+        else:
+            length = int(rng.integers(1, 300))
+            rms[pos: pos + length] = rng.uniform(0.0, 0.015, size=min(length, frames - pos))
+        pos += length
+        speaking = not speaking
+    return rms
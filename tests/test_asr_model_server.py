@@ -0,0 +1,72 @@
+import os
+import stat
+import threading
+
+import pytest
+
+from ai_components.Asr.model_server import ASRModelServer, _PendingRequest, load_authkey
+
+
+class FakeASR:
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+
+    def generate_local(self, inputs, language, batch_seconds):
+        # 第一个批次阻塞，让后面的请求都进入队列
+        self.release.wait()
+        self.batches.append((list(inputs), language, batch_seconds))
+        return [f'text {item}' for item in inputs]
+
+
+def run_batches(server, requests):
+    asr = FakeASR()
+    threading.Thread(target=server._batch_loop, args=(asr,), daemon=True).start()
+    for request in requests:
+        server._queue.put(request)
+    asr.release.set()
+    for request in requests:
+        assert request.done.wait(5)
+    server._closed.set()
+    return asr.batches
+
+
+def pending(name, language='zh', duration=1.0, batch_seconds=10.0):
+    return _PendingRequest([name], language, duration, batch_seconds)
+
+
+def test_mismatched_request_seeds_next_batch():
+    server = ASRModelServer('/tmp/unused.sock', batch_window=0.2, batch_seconds=10.0)
+    requests = [pending('a'), pending('b', language='en'), pending('c'), pending('d', language='en')]
+    batches = run_batches(server, requests)
+    # 语言不同的 b 没有被放回队尾，仍然排在 c 之前
+    assert [inputs for inputs, _, _ in batches][:2] == [['a'], ['b']]
+    assert [request.texts for request in requests] == [['text a'], ['text b'], ['text c'], ['text d']]
+
+
+def test_client_batch_seconds_is_used():
+    server = ASRModelServer('/tmp/unused.sock', batch_window=0.2, batch_seconds=10.0)
+    requests = [pending('a', batch_seconds=0), pending('b', batch_seconds=60.0), pending('c', batch_seconds=60.0)]
+    batches = run_batches(server, requests)
+    assert batches == [(['a'], 'zh', 0), (['b', 'c'], 'zh', 60.0)]
+
+
+def test_overflow_starts_next_batch():
+    server = ASRModelServer('/tmp/unused.sock', batch_window=0.2, batch_seconds=10.0)
+    requests = [pending('a', duration=6), pending('b', duration=6), pending('c', duration=3)]
+    batches = run_batches(server, requests)
+    assert [inputs for inputs, _, _ in batches] == [['a'], ['b', 'c']]
+
+
+def test_generated_authkey_is_private(tmp_path):
+    address = str(tmp_path / 'asr.sock')
+    key = load_authkey(address, create=True)
+    assert len(key) == 32
+    assert stat.S_IMODE(os.stat(f'{address}.key').st_mode) == 0o600
+    assert load_authkey(address) == key
+    assert load_authkey(address, 'configured') == b'configured'
+
+
+def test_missing_authkey_is_an_error(tmp_path):
+    with pytest.raises(RuntimeError):
+        load_authkey(str(tmp_path / 'asr.sock'))
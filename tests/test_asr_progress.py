@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from ai_components.Asr import asr
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    monkeypatch.setattr(asr, '_generate_batch', lambda inputs, language, batch_seconds: [
+        f'text {i}' for i in range(len(inputs))])
+
+
+def test_folder_progress_reports_done_and_total(fake_model, tmp_path):
+    for name in ('a.wav', 'b.wav', 'c.wav'):
+        (tmp_path / name).write_bytes(b'')
+    calls = []
+    asr._execute_asr(str(tmp_path), 'zh', batch_seconds=0, progress_callback=lambda *args: calls.append(args))
+    assert calls == [(1, 3), (2, 3), (3, 3)]
+
+
+def test_chunk_progress_reports_done_without_total(fake_model):
+    chunks = ((key, np.zeros(asr.ASR_SAMPLE_RATE, dtype=np.float32), asr.ASR_SAMPLE_RATE) for key in range(5))
+    calls = []
+    output = asr._execute_asr_chunks(chunks, 'zh', batch_seconds=2, progress_callback=lambda *args: calls.append(args))
+    assert sorted(output) == [0, 1, 2, 3, 4]
+    assert calls == [(2, None), (4, None), (5, None)]
+
+
+def test_chunks_are_batched_by_length_within_window(monkeypatch):
+    batches = []
+
+    def generate(inputs, language, batch_seconds):
+        batches.append([len(audio) / asr.ASR_SAMPLE_RATE for audio in inputs])
+        return [f'{len(audio)}' for audio in inputs]
+
+    monkeypatch.setattr(asr, '_generate_batch', generate)
+    monkeypatch.setattr(asr, 'ASR_SORT_WINDOW_BATCHES', 2)
+    lengths = [0.5, 1.5, 0.5, 1.5, 0.5]
+    chunks = ((key, np.zeros(int(seconds * asr.ASR_SAMPLE_RATE), dtype=np.float32), asr.ASR_SAMPLE_RATE)
+              for key, seconds in enumerate(lengths))
+    output = asr._execute_asr_chunks(chunks, 'zh', batch_seconds=2)
+    # 前四个片段（4 秒）组成一个窗口，短的和短的一批；最后一个片段单独成窗
+    assert batches == [[0.5, 0.5], [1.5], [1.5], [0.5]]
+    assert list(output) == [0, 1, 2, 3, 4]
+    assert output[1] == str(int(1.5 * asr.ASR_SAMPLE_RATE))
+
+
+def test_batch_failure_is_logged(monkeypatch, caplog):
+    def fail(inputs, language, batch_seconds):
+        raise ValueError('boom')
+
+    monkeypatch.setattr(asr, 'model', None)
+    monkeypatch.setattr(asr, 'ASR_SERVER_ADDRESS', '')
+    monkeypatch.setattr(asr, 'generate_local', fail)
+    with caplog.at_level('ERROR', logger=asr.__name__), pytest.raises(RuntimeError, match='boom'):
+        asr._generate_batch(['a.wav'], 'zh', 0)
+    assert caplog.records[-1].exc_info[0] is ValueError
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from database import async_db, mysql_helper
+
+SLOW = ('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000000) '
+        'SELECT count(*) FROM n')
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(mysql_helper, 'SQLITE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(async_db, 'SQLITE_WORKERS', 1)
+    mysql_helper.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)')
+    yield
+    async_db.shutdown()
+    mysql_helper.close()
+
+
+def test_read_write(database):
+    async def run():
+        await async_db.execute_many('INSERT INTO items (id, value) VALUES (?, ?)', ((i, str(i)) for i in range(10)))
+        assert await async_db.query_one('SELECT value FROM items WHERE id = ?', (3,)) == ('3',)
+        assert [row async for row in async_db.iterate('SELECT id FROM items ORDER BY id', batch_size=3)] == [
+            (i,) for i in range(10)]
+
+    asyncio.run(run())
+
+
+def test_timeout_interrupts_statement(database):
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await async_db.query(SLOW, timeout=0.1)
+        # 只有一个工作线程：中止后它可以继续执行下一个任务
+        assert await async_db.query('SELECT 1', timeout=5) == [(1,)]
+
+    asyncio.run(run())
+
@@ -0,0 +1,165 @@
+import asyncio
+import inspect
+import json
+
+import httpx
+import pytest
+from starlette.requests import Request
+
+from chat_function import deepseek
+from chat_function.cancellation import CancellationRegistry, cancelled_requests, registry
+from chat_function.upstreams import Upstream, UpstreamPool
+from router.deepseek import cancel_generate, generate
+
+REQUEST = {'model': 'deepseek-chat', 'messages': [{'role': 'user', 'content': 'hi'}], 'cache': False}
+COMPLETION = {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'hi'}, 'finish_reason': 'stop'}]}
+FIRST_CHUNK = b'data: {"choices": [{"index": 0, "delta": {"content": "hi"}}]}\n\n'
+
+
+class HangingStream(httpx.AsyncByteStream):
+    """
+    发出一个 chunk 后一直等待，记录是否被关闭
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    async def __aiter__(self):
+        yield FIRST_CHUNK
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+class Client:
+    """
+    模拟客户端连接：disconnect 之前 receive 一直等待
+    """
+
+    def __init__(self, body):
+        self.body = json.dumps(body).encode()
+        self.sent = False
+        self.disconnected = asyncio.Event()
+
+    async def receive(self):
+        if not self.sent:
+            self.sent = True
+            return {'type': 'http.request', 'body': self.body, 'more_body': False}
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    def request(self):
+        scope = {'type': 'http', 'method': 'POST', 'path': '/generate', 'headers': [], 'query_string': b''}
+        return Request(scope, self.receive)
+
+
+@pytest.fixture
+def upstream(sqlite_db, monkeypatch):
+    """
+    模拟上游，替换 state['handler'] 改变上游的行为；结束时检查取消登记已经清空
+    """
+    state = {'handler': lambda request: httpx.Response(200, json=COMPLETION)}
+
+    async def handle(request):
+        response = state['handler'](request)
+        return await response if inspect.isawaitable(response) else response
+
+    monkeypatch.setattr(deepseek, 'default_pool',
+                        lambda: UpstreamPool([Upstream('http://a.test', 'a', 1, 'a')], name='test'))
+    monkeypatch.setattr(deepseek, 'get_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handle)))
+    yield state
+    assert len(registry) == 0
+
+
+def test_registry_cancel_and_unregister():
+    requests = CancellationRegistry()
+    request_id, event = requests.register()
+    assert requests.get(request_id) is event
+    assert requests.cancel(request_id)
+    assert event.is_set()
+    # 重复取消也返回 True，但只计数一次
+    assert requests.cancel(request_id)
+    requests.unregister(request_id)
+    assert len(requests) == 0
+    assert not requests.cancel(request_id)
+
+
+def test_delete_unknown_request_returns_404():
+    response = asyncio.run(cancel_generate('missing', True))
+    assert response.status_code == 404
+
+
+def test_registry_is_emptied_after_completion(upstream):
+    async def run():
+        response = await generate(Client(REQUEST).request(), True)
+        assert response.status_code == 200
+        assert json.loads(response.body) == COMPLETION
+        assert registry.get(response.headers['X-Request-ID']) is None
+
+        upstream['handler'] = lambda request: httpx.Response(
+            200, content=FIRST_CHUNK + b'data: [DONE]\n\n', headers={'content-type': 'text/event-stream'})
+        response = await generate(Client({**REQUEST, 'stream': True}).request(), True)
+        request_id = response.headers['X-Request-ID']
+        # 流式响应在转发结束时才注销
+        assert registry.get(request_id) is not None
+        assert b''.join([chunk async for chunk in response.body_iterator]) == FIRST_CHUNK + b'data: [DONE]\n\n'
+        assert registry.get(request_id) is None
+
+    asyncio.run(run())
+
+
+def test_delete_cancels_an_in_flight_stream(upstream):
+    stream = HangingStream()
+    upstream['handler'] = lambda request: httpx.Response(
+        200, stream=stream, headers={'content-type': 'text/event-stream'})
+
+    async def run():
+        response = await generate(Client({**REQUEST, 'stream': True}).request(), True)
+        request_id = response.headers['X-Request-ID']
+        chunks = []
+
+        async def consume():
+            async for chunk in response.body_iterator:
+                chunks.append(chunk)
+
+        consumer = asyncio.ensure_future(consume())
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert chunks == [FIRST_CHUNK]
+
+        before = cancelled_requests.value(reason='api')
+        cancelled = await cancel_generate(request_id, True)
+        assert cancelled.status_code == 200
+        await asyncio.wait_for(consumer, timeout=5)
+        assert stream.closed
+        assert cancelled_requests.value(reason='api') == before + 1
+        assert registry.get(request_id) is None
+
+    asyncio.run(run())
+
+
+def test_client_disconnect_sets_the_cancel_event(upstream):
+    received = []
+
+    async def hang(request):
+        received.append(request)
+        await asyncio.Event().wait()
+
+    upstream['handler'] = hang
+
+    async def run():
+        client = Client(REQUEST)
+        before = cancelled_requests.value(reason='client_disconnect')
+        generating = asyncio.ensure_future(generate(client.request(), True))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert len(received) == 1 and len(registry) == 1
+
+        client.disconnected.set()
+        response = await asyncio.wait_for(generating, timeout=5)
+        assert response.status_code == 499
+        assert cancelled_requests.value(reason='client_disconnect') == before + 1
+
+    asyncio.run(run())
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from project_base import authenticate_api
+from router import csm
+from utils.job_queue import JOB_FAILED, JOB_PENDING, JOB_RUNNING, JOB_SUCCESS, JobManager, QueueFullError
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not met'
+        time.sleep(0.01)
+
+
+class Task:
+    """
+    release 之前一直阻塞的任务
+    """
+
+    def __init__(self, result='ok', error=None):
+        self.result = result
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, progress):
+        self.started.set()
+        progress('working', 0.5)
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture
+def manager():
+    jobs = JobManager(max_workers=1, max_pending=2)
+    yield jobs
+    jobs.shutdown(wait=True)
+
+
+def test_lifecycle_queued_running_done(manager):
+    first, second = Task(result={'a.wav': 'hello'}), Task()
+    job = manager.submit('first', first, meta={'uid': 'u'})
+    queued = manager.submit('second', second)
+    first.started.wait(5)
+
+    assert manager.get(job.job_id).status == JOB_RUNNING
+    assert manager.get(job.job_id).to_dict()['stage'] == 'working'
+    assert manager.get(job.job_id).to_dict()['progress'] == 0.5
+    assert manager.get(queued.job_id).status == JOB_PENDING
+    assert manager.get(queued.job_id).stage == 'queued'
+    assert manager.pending_count() == 2
+    with pytest.raises(QueueFullError):
+        manager.submit('third', Task())
+
+    first.release.set()
+    wait_for(lambda: job.finished)
+    snapshot = manager.get(job.job_id).to_dict()
+    assert (snapshot['status'], snapshot['stage'], snapshot['progress']) == (JOB_SUCCESS, 'done', 1.0)
+    assert snapshot['result'] == {'a.wav': 'hello'}
+    assert snapshot['uid'] == 'u'
+
+    second.release.set()
+    wait_for(lambda: queued.finished)
+    assert manager.pending_count() == 0
+
+
+def test_failed_job_records_the_error(manager):
+    task = Task(error=ValueError('bad audio'))
+    task.release.set()
+    job = manager.submit('broken', task)
+    wait_for(lambda: job.finished)
+    assert (job.status, job.stage, job.error) == (JOB_FAILED, 'failed', 'bad audio')
+
+
+def test_completed_job_is_already_done(manager):
+    job = manager.completed('cached', {'a.wav': 'hello'}, meta={'cached': True})
+    assert manager.get(job.job_id) is job
+    assert job.to_dict()['status'] == JOB_SUCCESS
+    assert job.to_dict()['cached'] is True
+    assert manager.pending_count() == 0
+
+
+def test_finished_jobs_expire_after_retention():
+    manager = JobManager(retention=0)
+    try:
+        job = manager.completed('cached', None)
+        job.updated_at -= 1
+        manager.completed('other', None)
+        assert manager.get(job.job_id) is None
+    finally:
+        manager.shutdown()
+
+
+def test_watch_yields_each_change_then_stops(manager):
+    task = Task()
+
+    async def run():
+        job = manager.submit('watched', task)
+        events = []
+        async for snapshot in manager.watch(job.job_id, heartbeat=0.05):
+            if snapshot is None:
+                events.append('heartbeat')
+                if task.started.is_set():
+                    task.release.set()
+                continue
+            events.append((snapshot['status'], snapshot['stage']))
+        return events
+
+    events = asyncio.run(run())
+    assert events[-1] == (JOB_SUCCESS, 'done')
+    assert (JOB_RUNNING, 'working') in events
+    assert 'heartbeat' in events
+    statuses = [event[0] for event in events if event != 'heartbeat']
+    assert statuses.index(JOB_RUNNING) < statuses.index(JOB_SUCCESS)
+
+
+def test_watch_unknown_job_yields_nothing(manager):
+    async def run():
+        return [snapshot async for snapshot in manager.watch('missing')]
+
+    assert asyncio.run(run()) == []
+
+
+def test_shutdown_waits_for_running_and_fails_queued_jobs():
+    manager = JobManager(max_workers=1, max_pending=4)
+    running, queued = Task(), Task()
+    first = manager.submit('running', running)
+    second = manager.submit('queued', queued)
+    running.started.wait(5)
+
+    threading.Timer(0.1, running.release.set).start()
+    manager.shutdown(wait=True)
+    assert first.status == JOB_SUCCESS
+    assert not queued.started.is_set()
+    assert (second.status, second.error) == (JOB_FAILED, 'server is shutting down')
+    with pytest.raises(RuntimeError):
+        manager.submit('late', Task())
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(csm, 'job_manager', JobManager(max_workers=1, max_pending=2))
+    app = FastAPI()
+    app.include_router(csm.router)
+    app.dependency_overrides[authenticate_api] = lambda: True
+    yield TestClient(app)
+    csm.job_manager.shutdown(wait=True)
+
+
+class FakeCache:
+    def __init__(self, split_info=None):
+        self.split_info = split_info
+        self.stored = []
+
+    def get(self, key, folder):
+        return self.split_info
+
+    def put(self, key, split_info):
+        self.stored.append((key, split_info))
+
+
+def upload(client):
+    return client.post('/csm/voice/update', data={'uid': 'u', 'info': 'test'},
+                       files={'voice': ('a.wav', b'RIFF', 'audio/wav')})
+
+
+def test_upload_returns_the_same_envelope_for_a_cache_hit(client, monkeypatch):
+    monkeypatch.setattr(csm, 'voice_cache', FakeCache({'clip.wav': 'hello'}))
+    response = upload(client)
+    assert response.status_code == 202
+    body = response.json()
+    assert (body['job_status'], body['cached']) == (JOB_SUCCESS, True)
+
+    job = client.get(body['status_url']).json()
+    assert (job['status'], job['result']) == (JOB_SUCCESS, {'clip.wav': 'hello'})
+    events = client.get(body['events_url']).text
+    assert events.startswith('event: success\n')
+    assert json.loads(events.split('data: ', 1)[1])['result'] == {'clip.wav': 'hello'}
+
+
+def test_upload_queues_a_job_on_a_cache_miss(client, monkeypatch):
+    cache = FakeCache()
+    monkeypatch.setattr(csm, 'voice_cache', cache)
+    monkeypatch.setattr(csm, 'asr_voice', lambda wav_file, uid, session_id, progress, cache_key: {'clip.wav': 'hi'})
+    response = upload(client)
+    assert response.status_code == 202
+    body = response.json()
+    assert body['cached'] is False
+    assert body['job_status'] in (JOB_PENDING, JOB_RUNNING, JOB_SUCCESS)
+
+    # SSE 推送到任务结束为止
+    events = client.get(body['events_url']).text
+    assert 'event: success\n' in events
+    assert client.get(body['status_url']).json()['result'] == {'clip.wav': 'hi'}
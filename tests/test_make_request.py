@@ -0,0 +1,155 @@
+import asyncio
+import json
+
+import httpx
+
+from chat_function import deepseek
+from chat_function.deepseek import make_request
+from chat_function.retry import RetryPolicy
+from chat_function.upstreams import Upstream, UpstreamPool
+
+COMPLETION = {'id': 'c', 'object': 'chat.completion',
+              'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'hi'}, 'finish_reason': 'stop'}]}
+STREAM = (b'data: {"choices": [{"index": 0, "delta": {"content": "hi"}}]}\n\n'
+          b'data: {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}\n\n'
+          b'data: [DONE]\n\n')
+NO_DELAY = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+
+
+def pool(*keys):
+    return UpstreamPool([Upstream(f'http://{key}.test', key, 1, key) for key in keys], name='test')
+
+
+def send(upstreams, handler, stream=False, cancel_event=None, retry_policy=NO_DELAY):
+    """
+    用 MockTransport 模拟上游调用 make_request，返回 (状态码, 响应体, 上游收到的请求)
+    """
+    requests = []
+
+    def record(request):
+        requests.append(request)
+        return handler(request)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(record)) as client:
+            response = await make_request(upstreams=upstreams, headers={}, request_body={'model': 'm', 'stream': stream},
+                                          cancel_event=cancel_event or asyncio.Event(), stream=stream,
+                                          retry_policy=retry_policy, client=client)
+            if hasattr(response, 'body_iterator'):
+                body = b''.join([chunk async for chunk in response.body_iterator])
+            else:
+                body = response.body
+            return response.status_code, body
+
+    status, body = asyncio.run(run())
+    return status, body, requests
+
+
+def test_non_stream_response():
+    upstreams = pool('a')
+    status, body, requests = send(upstreams, lambda request: httpx.Response(200, json=COMPLETION))
+    assert status == 200
+    assert json.loads(body) == COMPLETION
+    assert str(requests[0].url) == 'http://a.test/chat/completions'
+    assert requests[0].headers['Authorization'] == 'Bearer a'
+    assert json.loads(requests[0].content) == {'model': 'm', 'stream': False}
+    assert upstreams.upstreams[0].outstanding == 0
+
+
+def test_stream_is_forwarded_unchanged():
+    upstreams = pool('a')
+    status, body, _ = send(upstreams, lambda request: httpx.Response(
+        200, content=STREAM, headers={'content-type': 'text/event-stream'}), stream=True)
+    assert status == 200
+    assert body == STREAM
+    # 流结束后进行中的请求数归零
+    assert upstreams.upstreams[0].outstanding == 0
+
+
+def test_server_error_is_retried():
+    statuses = iter([503, 200])
+    status, _, requests = send(pool('a'), lambda request: httpx.Response(next(statuses), json=COMPLETION))
+    assert status == 200
+    assert len(requests) == 2
+
+
+def test_connect_error_fails_over_to_other_upstream():
+    def handler(request):
+        if request.url.host == 'a.test':
+            raise httpx.ConnectError('refused', request=request)
+        return httpx.Response(200, json=COMPLETION)
+
+    upstreams = pool('a', 'b')
+    status, _, requests = send(upstreams, handler)
+    assert status == 200
+    assert requests[-1].url.host == 'b.test'
+    assert all(upstream.outstanding == 0 for upstream in upstreams.upstreams)
+
+
+def test_client_error_is_not_retried():
+    status, _, requests = send(pool('a'), lambda request: httpx.Response(400, json={'error': {'message': 'bad'}}))
+    assert status == 400
+    assert len(requests) == 1
+
+
+def test_retries_stop_after_max_attempts():
+    status, _, requests = send(pool('a'), lambda request: httpx.Response(502, text='bad gateway'))
+    assert status == 502
+    assert len(requests) == NO_DELAY.max_attempts
+
+
+def test_cancelled_request_is_not_sent():
+    cancel_event = asyncio.Event()
+    cancel_event.set()
+    status, _, requests = send(pool('a'), lambda request: httpx.Response(200, json=COMPLETION),
+                               cancel_event=cancel_event)
+    assert status == 499
+    assert requests == []
+
+
+def test_remote_protocol_error_is_not_retried():
+    def handler(request):
+        raise httpx.RemoteProtocolError('server disconnected', request=request)
+
+    upstreams = pool('a', 'b')
+    status, _, requests = send(upstreams, handler)
+    assert status == 502
+    assert len(requests) == 1
+    assert all(upstream.outstanding == 0 for upstream in upstreams.upstreams)
+
+
+class BrokenStream(httpx.AsyncByteStream):
+    """
+    先发出一个 chunk，然后连接中断
+    """
+
+    async def __aiter__(self):
+        yield STREAM.split(b'\n\n')[0] + b'\n\n'
+        raise httpx.RemoteProtocolError('peer closed connection')
+
+
+def test_stream_is_not_retried_after_it_started():
+    upstreams = pool('a', 'b')
+    status, body, requests = send(upstreams, lambda request: httpx.Response(
+        200, stream=BrokenStream(), headers={'content-type': 'text/event-stream'}), stream=True)
+    assert status == 200
+    assert body == STREAM.split(b'\n\n')[0] + b'\n\n'
+    assert len(requests) == 1
+    assert all(upstream.outstanding == 0 for upstream in upstreams.upstreams)
+
+
+def test_retry_after_header_sets_the_delay(monkeypatch):
+    delays = []
+
+    async def no_wait(delay, cancel_event):
+        delays.append(delay)
+        return False
+
+    monkeypatch.setattr(deepseek, 'wait_or_cancel', no_wait)
+    statuses = iter([429, 200])
+    status, _, requests = send(pool('a'), lambda request: httpx.Response(
+        next(statuses), json=COMPLETION, headers={'Retry-After': '2'}),
+        retry_policy=RetryPolicy(max_attempts=3, base_delay=0, max_delay=10))
+    assert status == 200
+    assert len(requests) == 2
+    assert delays == [2]
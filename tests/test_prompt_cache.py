@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import httpx
+
+from chat_function.deepseek import ProcessedMessages, post_process_prompt
+from chat_function.prompt_cache import SessionPromptCache, prompt_cache_requests
+
+NAMES = {'system': 'system', 'user': 'user', 'char': 'assistant'}
+
+
+def history(turns):
+    messages = [{'role': 'system', 'content': 'system prompt'}]
+    for i in range(turns):
+        messages.append({'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'turn {i}'})
+    return messages
+
+
+def process(cache, messages):
+    return cache.process('session', messages, 'deepseek', lambda: ProcessedMessages('deepseek', NAMES))
+
+
+def hits():
+    return prompt_cache_requests.value(result='hit')
+
+
+def test_appended_history_is_a_hit():
+    cache = SessionPromptCache(max_sessions=10, ttl=60)
+    process(cache, history(10))
+    before = hits()
+    messages = history(12)
+    assert process(cache, messages) == post_process_prompt(messages, 'deepseek', NAMES)
+    assert hits() == before + 1
+
+
+def test_changed_tail_is_a_miss():
+    cache = SessionPromptCache(max_sessions=10, ttl=60)
+    process(cache, history(10))
+    before = hits()
+
+    # 重新生成：最后一条被替换
+    regenerated = history(10)
+    regenerated[-1] = {'role': 'assistant', 'content': 'another reply'}
+    assert process(cache, regenerated) == post_process_prompt(regenerated, 'deepseek', NAMES)
+    # 删除最近的一轮
+    assert process(cache, history(8)) == post_process_prompt(history(8), 'deepseek', NAMES)
+    # 系统提示词被修改
+    edited = history(10)
+    edited[0] = {'role': 'system', 'content': 'new system prompt'}
+    assert process(cache, edited) == post_process_prompt(edited, 'deepseek', NAMES)
+    assert hits() == before
+
+
+def test_signature_change_is_a_miss():
+    cache = SessionPromptCache(max_sessions=10, ttl=60)
+    process(cache, history(4))
+    before = hits()
+    cache.process('session', history(6), 'other', lambda: ProcessedMessages('deepseek', NAMES))
+    assert hits() == before
+
+
+def test_processed_messages_branches_do_not_share_appends():
+    prefix = ProcessedMessages('deepseek', NAMES).extend(history(2))
+    first = prefix.extend([{'role': 'user', 'content': 'a'}])
+    second = prefix.extend([{'role': 'user', 'content': 'b'}])
+    assert prefix.result() == history(2)
+    assert first.result()[-1]['content'] == 'a'
+    assert second.result()[-1]['content'] == 'b'
+    assert len(first.result()) == len(second.result()) == 4
+
+
+def test_edited_history_reaches_upstream(sqlite_db, monkeypatch):
+    from chat_function import deepseek
+    from chat_function.upstreams import Upstream, UpstreamPool
+
+    bodies = []
+
+    def handler(request):
+        bodies.append(json.loads(request.content))
+        return httpx.Response(200, json={'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'ok'}}]})
+
+    monkeypatch.setattr(deepseek, 'default_pool',
+                        lambda: UpstreamPool([Upstream('http://a.test', 'a', 1, 'a')], name='test'))
+
+    async def run(messages):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            monkeypatch.setattr(deepseek, 'get_client', lambda: client)
+            request = {'model': 'deepseek-chat', 'messages': messages, 'cache': False}
+            response = await deepseek.send_deepseek_request(request, asyncio.Event(), uid='u', session_id='edit-test')
+            assert response.status_code == 200
+
+    asyncio.run(run(history(9)))
+    # 编辑第 1 条消息（第一轮用户消息），其余不变
+    edited = history(9)
+    edited[1] = {'role': 'user', 'content': 'edited turn 0'}
+    asyncio.run(run(edited))
+
+    assert len(history(9)) == 10
+    assert bodies[0]['messages'][1]['content'] == 'turn 0'
+    assert bodies[1]['messages'] == post_process_prompt(edited, 'deepseek', NAMES)
+    assert bodies[1]['messages'][1]['content'] == 'edited turn 0'
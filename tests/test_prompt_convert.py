@@ -0,0 +1,57 @@
+import copy
+import random
+
+import pytest
+
+from reference import MODES, legacy_merge_messages, random_history
+from utils.prompt_convert import PROMPT_PLACEHOLDER, MessageMerger, PromptNames, merge_messages
+
+NAMES = PromptNames(char_name='Alice', user_name='Bob', group_names=['Alice', 'Carol'])
+IMAGE = {'type': 'image_url', 'image_url': {'url': 'data:image/png;base64,AAAA'}}
+
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('seed', range(10))
+def test_matches_legacy_implementation(mode, seed):
+    strict, placeholders = MODES[mode]
+    rng = random.Random(seed)
+    for _ in range(30):
+        messages = random_history(rng, rng.randint(0, 40))
+        snapshot = copy.deepcopy(messages)
+        expected = legacy_merge_messages(copy.deepcopy(messages), NAMES, strict, placeholders)
+        assert merge_messages(messages, NAMES, strict, placeholders) == expected
+        # 不修改传入的消息
+        assert messages == snapshot
+
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('seed', range(5))
+def test_incremental_extend_matches_full_merge(mode, seed):
+    strict, placeholders = MODES[mode]
+    rng = random.Random(seed)
+    for _ in range(30):
+        messages = random_history(rng, rng.randint(0, 40))
+        split = rng.randint(0, len(messages))
+        prefix = MessageMerger(NAMES, strict, placeholders).extend(messages[:split])
+        prefix_result = prefix.result()
+        assert prefix.extend(messages[split:]).result() == merge_messages(messages, NAMES, strict, placeholders)
+        # extend 不影响已经缓存的前缀
+        assert prefix.result() == prefix_result
+
+
+def test_empty_history_gets_placeholder():
+    assert merge_messages([], NAMES, False, False) == [{'role': 'user', 'content': PROMPT_PLACEHOLDER}]
+
+
+def test_named_message_starting_with_image_keeps_image():
+    """
+    有意和原实现不同：原实现把图片换成随机令牌后再加名称前缀，令牌不再能被还原，图片变成一段随机文本
+    """
+    messages = [{'role': 'user', 'name': 'Carol', 'content': [IMAGE, {'type': 'text', 'text': 'look'}]}]
+    assert merge_messages(messages, NAMES, False, False) == [
+        {'role': 'user', 'content': [{'type': 'text', 'text': 'Carol: '}, IMAGE, {'type': 'text', 'text': 'look'}]},
+    ]
+
+    legacy = legacy_merge_messages(copy.deepcopy(messages), NAMES, False, False)
+    assert [part['type'] for part in legacy[0]['content']] == ['text']
+    assert legacy[0]['content'][0]['text'].startswith('Carol: ')
@@ -0,0 +1,91 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+from chat_function import rate_limit
+from chat_function.rate_limit import Admission, queue_params
+from chat_function.request_params import InvalidParameter
+
+
+def test_queue_params_defaults():
+    assert queue_params({}) == (0, rate_limit.RATE_LIMIT_QUEUE_TIMEOUT)
+
+
+def test_queue_timeout_is_clamped(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_MAX_QUEUE_TIMEOUT', 60)
+    assert queue_params({'priority': '5', 'queue_timeout': 1e9}) == (5, 60)
+
+
+@pytest.mark.parametrize('request_data', [
+    {'priority': 'high'},
+    {'priority': 1.5},
+    {'priority': True},
+    {'priority': 10 ** 9},
+    {'queue_timeout': -1},
+    {'queue_timeout': 'soon'},
+    {'queue_timeout': float('nan')},
+    {'queue_timeout': [1]},
+])
+def test_invalid_queue_params(request_data):
+    with pytest.raises(InvalidParameter):
+        queue_params(request_data)
+
+
+def test_admission_switches_limiter_per_account(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_CONCURRENCY', 1)
+    monkeypatch.setattr(rate_limit, '_limiters', OrderedDict())
+
+    async def run():
+        admission = Admission('model', 10, queue_timeout=1)
+        assert await admission.acquire('key-1')
+        first = admission.limiter
+        # 同一账号重试时不重复占用名额
+        assert await admission.acquire('key-1')
+        assert first._active == 1
+        assert await admission.acquire('key-2')
+        assert admission.limiter is not first
+        assert first._active == 0
+        admission.release()
+        assert rate_limit.limiter_for('key-2', 'model')._active == 0
+
+    asyncio.run(run())
+
+
+def test_unknown_models_share_one_limiter(monkeypatch):
+    monkeypatch.setattr(rate_limit, '_limiters', OrderedDict())
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_MODELS', frozenset({'deepseek-chat'}))
+    known = rate_limit.limiter_for('key', 'deepseek-chat')
+    other = rate_limit.limiter_for('key', 'made-up-1')
+    assert rate_limit.limiter_for('key', 'made-up-2') is other
+    assert other is not known
+    assert other.model == rate_limit.OTHER_MODEL
+    assert len(rate_limit._limiters) == 2
+
+
+def test_limiters_are_bounded_by_lru_of_idle_limiters(monkeypatch):
+    monkeypatch.setattr(rate_limit, '_limiters', OrderedDict())
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_MAX_LIMITERS', 2)
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_CONCURRENCY', 1)
+
+    async def run():
+        busy = rate_limit.limiter_for('busy', 'deepseek-chat')
+        assert await busy.acquire(1)
+        idle = rate_limit.limiter_for('idle', 'deepseek-chat')
+        rate_limit.limiter_for('new', 'deepseek-chat')
+        # 使用中的限流器不会被丢弃，丢弃最久没有使用的空闲限流器
+        assert len(rate_limit._limiters) == 2
+        assert rate_limit.limiter_for('busy', 'deepseek-chat') is busy
+        again = rate_limit.limiter_for('idle', 'deepseek-chat')
+        assert again is not idle
+        assert len(rate_limit._limiters) == 2
+
+        # 都在使用中时暂时超出上限，刚创建的限流器不会被丢弃
+        assert await again.acquire(1)
+        crowded = rate_limit.limiter_for('crowded', 'deepseek-chat')
+        assert len(rate_limit._limiters) == 3
+        assert rate_limit.limiter_for('crowded', 'deepseek-chat') is crowded
+        busy.release()
+        again.release()
+
+    asyncio.run(run())
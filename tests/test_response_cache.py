@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import pytest
+
+from chat_function import response_cache as cache_module
+from chat_function.response_cache import ResponseCache, cached_response, is_cacheable, make_key
+from chat_function.sse import CompletionAssembler, SSEParser
+
+BODY = {'model': 'm', 'messages': [{'role': 'user', 'content': 'hi'}], 'temperature': 0}
+COMPLETION = {'id': 'c', 'object': 'chat.completion', 'created': 1, 'model': 'm',
+              'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'hello'}, 'logprobs': None,
+                           'finish_reason': 'stop'}],
+              'usage': {'prompt_tokens': 3, 'completion_tokens': 1, 'total_tokens': 4}}
+
+
+def memory_cache(**kwargs):
+    options = dict(max_entries=10, max_bytes=1 << 20, ttl=60)
+    options.update(kwargs)
+    return ResponseCache(**options)
+
+
+def test_key_ignores_stream_fields_none_values_and_order():
+    key = make_key('http://a.test/', BODY)
+    reordered = dict(reversed(list(BODY.items())))
+    assert make_key('http://a.test', reordered) == key
+    assert make_key('http://a.test', {**BODY, 'stream': True, 'stream_options': {'include_usage': True}}) == key
+    assert make_key('http://a.test', {**BODY, 'seed': None, 'stop': None}) == key
+
+
+def test_key_distinguishes_body_upstream_and_credential():
+    key = make_key('http://a.test', BODY, 'secret')
+    assert make_key('http://b.test', BODY, 'secret') != key
+    assert make_key('http://a.test', BODY, 'other') != key
+    assert make_key('http://a.test', BODY) != key
+    assert make_key('http://a.test', {**BODY, 'n': 2}, 'secret') != key
+    assert make_key('http://a.test', {**BODY, 'logprobs': True}, 'secret') != key
+    assert make_key('http://a.test', {**BODY, 'tools': [{'type': 'function'}]}, 'secret') != key
+    assert 'secret' not in key
+
+
+@pytest.mark.parametrize('body, cacheable', [
+    ({'temperature': 0}, True),
+    ({'temperature': 0.7}, False),
+    ({'temperature': 0.7, 'seed': 1}, True),
+    ({'temperature': 0, 'n': 3}, True),
+    ({'temperature': 0.7, 'seed': 1, 'n': 3}, False),
+    ({'temperature': 0.7, 'n': 1, 'seed': 1}, True),
+    ({'temperature': 0, 'tools': [{'type': 'function'}]}, True),
+    ({'temperature': 0.7, 'tools': [{'type': 'function'}]}, False),
+])
+def test_is_cacheable(body, cacheable):
+    assert is_cacheable(body) is cacheable
+
+
+def test_memory_hit_and_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now[0])
+    cache = memory_cache(ttl=10)
+    cache.put('k', COMPLETION)
+    assert asyncio.run(cache.get('k')) == COMPLETION
+    now[0] += 11
+    assert asyncio.run(cache.get('k')) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_memory_limits_evict_least_recently_used():
+    cache = memory_cache(max_entries=2)
+    cache.put('a', COMPLETION)
+    cache.put('b', COMPLETION)
+    asyncio.run(cache.get('a'))
+    cache.put('c', COMPLETION)
+    assert asyncio.run(cache.get('b')) is None
+    assert asyncio.run(cache.get('a')) == COMPLETION
+
+
+def test_memory_miss_falls_back_to_sqlite(sqlite_db):
+    cache = memory_cache(disk=True)
+    cache.put('k', COMPLETION)
+    sqlite_db.write_queue.flush(timeout=5)
+
+    # 新的实例内存层是空的，从 SQLite 读到后放回内存
+    restarted = memory_cache(disk=True)
+    before = cache_module.cache_requests.value(result='hit_disk')
+    assert asyncio.run(restarted.get('k')) == COMPLETION
+    assert cache_module.cache_requests.value(result='hit_disk') == before + 1
+    assert restarted.stats()['entries'] == 1
+
+
+def test_expired_sqlite_entry_is_a_miss(sqlite_db, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now[0])
+    memory_cache(disk=True, ttl=10).put('k', COMPLETION)
+    sqlite_db.write_queue.flush(timeout=5)
+    now[0] += 11
+    assert asyncio.run(memory_cache(disk=True, ttl=10).get('k')) is None
+    sqlite_db.write_queue.flush(timeout=5)
+    assert sqlite_db.query('SELECT count(*) FROM response_cache') == [(0,)]
+
+
+def replay(completion, include_usage=True):
+    async def run():
+        response = cached_response(completion, True, include_usage)
+        assert response.headers['X-Cache'] == 'HIT'
+        return b''.join([chunk.encode() if isinstance(chunk, str) else chunk
+                         async for chunk in response.body_iterator])
+
+    parser = SSEParser()
+    assembler = CompletionAssembler()
+    events = parser.feed(asyncio.run(run()))
+    for data in events:
+        assembler.add(data)
+    return assembler, events
+
+
+def test_stream_replay_rebuilds_the_cached_completion():
+    assembler, events = replay(COMPLETION)
+    assert assembler.finished
+    assert assembler.result()['choices'] == COMPLETION['choices']
+    assert assembler.result()['usage'] == COMPLETION['usage']
+
+    _, events = replay(COMPLETION, include_usage=False)
+    assert not any('usage' in json.loads(data) for data in events if data.strip() != '[DONE]')
+
+
+def test_non_stream_hit_returns_the_body():
+    response = cached_response(COMPLETION, False)
+    assert response.headers['X-Cache'] == 'HIT'
+    assert json.loads(response.body) == COMPLETION
@@ -0,0 +1,81 @@
+import email.utils
+import time
+
+import httpx
+import pytest
+
+from chat_function import retry
+from chat_function.retry import RetryBudget, RetryPolicy, parse_retry_after
+
+
+def test_full_jitter_backoff_bounds():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    for attempt, cap in ((1, 1.0), (2, 2.0), (3, 4.0), (4, 5.0), (10, 5.0)):
+        delays = [policy.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        # full jitter：在 [0, 上限] 中均匀取值，不会都挤在上限附近
+        assert min(delays) < cap / 2 < max(delays)
+
+
+def test_full_jitter_draws_from_zero_to_the_cap(monkeypatch):
+    calls = []
+    monkeypatch.setattr(retry.random, 'uniform', lambda low, high: calls.append((low, high)) or high)
+    policy = RetryPolicy(base_delay=0.5, max_delay=3.0)
+    assert [policy.backoff(attempt) for attempt in (1, 2, 3, 4)] == [0.5, 1.0, 2.0, 3.0]
+    assert all(low == 0 for low, _ in calls)
+
+
+def test_retry_after_overrides_backoff_within_max_delay():
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+    assert policy.backoff(1, retry_after=7) == 7
+    assert policy.backoff(1, retry_after=60) == 10
+    assert policy.backoff(1, retry_after=-3) == 0
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after('5') == 5
+    assert parse_retry_after(' 1.5 ') == 1.5
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after('soon') is None
+
+
+def test_parse_retry_after_http_date():
+    value = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 <= parse_retry_after(value) <= 31
+    past = email.utils.formatdate(time.time() - 30, usegmt=True)
+    assert parse_retry_after(past) < 0
+    assert RetryPolicy(max_delay=10).backoff(1, parse_retry_after(past)) == 0
+
+
+def test_max_attempts():
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.should_retry(1, status_code=503)
+    assert policy.should_retry(2, status_code=503)
+    assert not policy.should_retry(3, status_code=503)
+
+
+@pytest.mark.parametrize('status, retried', [(429, True), (500, True), (503, True), (400, False), (404, False)])
+def test_retry_statuses(status, retried):
+    assert RetryPolicy().should_retry(1, status_code=status) is retried
+
+
+def test_only_connection_errors_are_retried():
+    request = httpx.Request('POST', 'http://a.test')
+    policy = RetryPolicy()
+    assert policy.should_retry(1, error=httpx.ConnectError('refused', request=request))
+    assert policy.should_retry(1, error=httpx.ConnectTimeout('timeout', request=request))
+    # 请求可能已经发出，重试会让上游再生成一次
+    assert not policy.should_retry(1, error=httpx.RemoteProtocolError('disconnected', request=request))
+    assert not policy.should_retry(1, error=httpx.ReadTimeout('timeout', request=request))
+
+
+def test_budget_limits_retries_in_the_window(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(retry.time, 'monotonic', lambda: now[0])
+    policy = RetryPolicy(budget=RetryBudget(max_retries=2, window=10))
+    assert policy.should_retry(1, status_code=503)
+    assert policy.should_retry(1, status_code=503)
+    assert not policy.should_retry(1, status_code=503)
+    now[0] += 11
+    assert policy.should_retry(1, status_code=503)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from chat_function.single_flight import SingleFlight
+
+
+class Upstream:
+    """
+    模拟上游：记录调用次数，release 之前不返回；流式响应的 chunk 由 send 逐个放出
+    """
+
+    def __init__(self, stream=False, error=None):
+        self.stream = stream
+        self.error = error
+        self.calls = 0
+        self.cancel_events = []
+        self.released = asyncio.Event()
+        self.chunks: 'asyncio.Queue' = asyncio.Queue()
+        self.closed = False
+
+    async def fetch(self, cancel_event):
+        self.calls += 1
+        self.cancel_events.append(cancel_event)
+        await self.released.wait()
+        if self.error is not None:
+            raise self.error
+        if self.stream:
+            return StreamingResponse(self._body(), media_type='text/event-stream')
+        return JSONResponse(content={'text': 'hello'})
+
+    async def _body(self):
+        try:
+            while True:
+                chunk = await self.chunks.get()
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.closed = True
+
+    def send(self, *chunks):
+        for chunk in chunks:
+            self.chunks.put_nowait(chunk)
+
+
+async def read(response):
+    if isinstance(response, StreamingResponse):
+        return response.status_code, b''.join([chunk async for chunk in response.body_iterator])
+    return response.status_code, response.body
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_requests_share_one_upstream_call():
+    async def run():
+        flights = SingleFlight()
+        upstream = Upstream()
+        tasks = [asyncio.ensure_future(flights.do('k', upstream.fetch, asyncio.Event())) for _ in range(5)]
+        await settle()
+        upstream.released.set()
+        results = [await read(response) for response in await asyncio.gather(*tasks)]
+        assert upstream.calls == 1
+        assert results == [(200, json.dumps({'text': 'hello'}, separators=(',', ':')).encode())] * 5
+
+        # 结束后同一个 key 重新请求上游
+        await read(await flights.do('k', upstream.fetch, asyncio.Event()))
+        assert upstream.calls == 2
+
+    asyncio.run(run())
+
+
+def test_followers_receive_the_whole_stream():
+    async def run():
+        flights = SingleFlight()
+        upstream = Upstream(stream=True)
+        leader = asyncio.ensure_future(flights.do('k', upstream.fetch, asyncio.Event()))
+        await settle()
+        upstream.released.set()
+        leader_body = asyncio.ensure_future(read(await leader))
+        upstream.send(b'data: 1\n\n')
+        await settle()
+
+        # 已经转发过 chunk 之后才加入的订阅者也从第一个 chunk 开始收到
+        follower = await flights.do('k', upstream.fetch, asyncio.Event())
+        follower_body = asyncio.ensure_future(read(follower))
+        upstream.send(b'data: 2\n\n', b'data: [DONE]\n\n', None)
+
+        expected = (200, b'data: 1\n\ndata: 2\n\ndata: [DONE]\n\n')
+        assert await leader_body == expected
+        assert await follower_body == expected
+        assert upstream.calls == 1
+        assert upstream.closed
+
+    asyncio.run(run())
+
+
+def test_leader_error_reaches_every_waiter():
+    async def run():
+        flights = SingleFlight()
+        upstream = Upstream(error=RuntimeError('upstream broke'))
+        tasks = [asyncio.ensure_future(flights.do('k', upstream.fetch, asyncio.Event())) for _ in range(3)]
+        await settle()
+        upstream.released.set()
+        results = [await read(response) for response in await asyncio.gather(*tasks)]
+        assert upstream.calls == 1
+        for status, body in results:
+            assert status == 502
+            assert json.loads(body)['error']['message'] == 'upstream broke'
+
+    asyncio.run(run())
+
+
+def test_cancelling_a_follower_does_not_cancel_the_leader():
+    async def run():
+        flights = SingleFlight()
+        upstream = Upstream()
+        leader = asyncio.ensure_future(flights.do('k', upstream.fetch, asyncio.Event()))
+        follower_cancel = asyncio.Event()
+        follower = asyncio.ensure_future(flights.do('k', upstream.fetch, follower_cancel))
+        aborted = asyncio.ensure_future(flights.do('k', upstream.fetch, asyncio.Event()))
+        await settle()
+
+        # 一个跟随者的客户端断开，另一个跟随者的任务被取消
+        follower_cancel.set()
+        aborted.cancel()
+        assert (await read(await follower))[0] == 499
+        await settle()
+        assert aborted.cancelled()
+        assert not upstream.cancel_events[0].is_set()
+
+        upstream.released.set()
+        assert (await read(await leader))[0] == 200
+        assert upstream.calls == 1
+
+    asyncio.run(run())
+
+
+def test_upstream_is_cancelled_when_every_subscriber_leaves():
+    async def run():
+        flights = SingleFlight()
+        upstream = Upstream()
+        cancels = [asyncio.Event(), asyncio.Event()]
+        tasks = [asyncio.ensure_future(flights.do('k', upstream.fetch, cancel)) for cancel in cancels]
+        await settle()
+        for cancel in cancels:
+            cancel.set()
+        assert [(await read(await task))[0] for task in tasks] == [499, 499]
+        assert upstream.cancel_events[0].is_set()
+        upstream.released.set()
+        await settle()
+
+    asyncio.run(run())
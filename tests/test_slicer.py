@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from ai_components.AudioSpliter.slicer import Slicer, _window_argmin
+from reference import legacy_sil_tags, synthetic_rms
+
+SR = 16000
+
+
+def synthetic_waveform(seconds, rng):
+    """
+    说话段（噪声）和长短不一的停顿交替出现
+    """
+    samples = np.zeros(int(seconds * SR), dtype=np.float32)
+    pos = 0
+    speaking = rng.random() < 0.5
+    while pos < samples.shape[0]:
+        if speaking:
+            length = int(rng.uniform(0.2, 6) * SR)
+            samples[pos: pos + length] = rng.uniform(-0.5, 0.5, size=samples[pos: pos + length].shape[0])
+        else:
+            length = int(rng.uniform(0.01, 3) * SR)
+        pos += length
+        speaking = not speaking
+    return samples
+
+
+def make_slicer():
+    # Splitter 使用的参数
+    return Slicer(sr=SR, threshold=-34, min_length=4000, min_interval=300, hop_size=10, max_sil_kept=500)
+
+
+def as_tuples(clips):
+    return [(begin, end, clip.tobytes()) for clip, begin, end in clips]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sil_tags_match_frame_loop(seed):
+    slicer = make_slicer()
+    rms_list = synthetic_rms(60 * 100, np.random.default_rng(seed))
+    expected = [tuple(map(int, tag)) for tag in legacy_sil_tags(slicer, rms_list)]
+    assert [tuple(map(int, tag)) for tag in slicer._get_sil_tags(rms_list)] == expected
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('block_size', [1000, 4096, 160 * 37, 10 ** 7])
+def test_stream_matches_iter_slice(seed, block_size):
+    slicer = make_slicer()
+    waveform = synthetic_waveform(40, np.random.default_rng(seed))
+    blocks = (waveform[i: i + block_size] for i in range(0, waveform.shape[0], block_size))
+    assert as_tuples(slicer.iter_slice_stream(blocks)) == as_tuples(slicer.iter_slice(waveform))
+
+
+@pytest.mark.parametrize('seconds', [0, 0.1, 3])
+def test_stream_matches_iter_slice_for_short_audio(seconds):
+    slicer = make_slicer()
+    waveform = synthetic_waveform(seconds, np.random.default_rng(0))
+    blocks = (waveform[i: i + 1000] for i in range(0, waveform.shape[0], 1000))
+    assert as_tuples(slicer.iter_slice_stream(blocks)) == as_tuples(slicer.iter_slice(waveform))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_sil_tags_match_frame_loop_with_ties(seed):
+    # 量化后的音量有大量相同的值，argmin 必须取第一个最小值
+    slicer = make_slicer()
+    rms_list = np.round(synthetic_rms(30 * 100, np.random.default_rng(seed)), 2)
+    expected = [tuple(map(int, tag)) for tag in legacy_sil_tags(slicer, rms_list)]
+    assert [tuple(map(int, tag)) for tag in slicer._get_sil_tags(rms_list)] == expected
+
+
+def test_window_argmin_takes_the_first_minimum_of_each_window():
+    values = np.array([3, 1, 2, 1, 0, 0, 5, 4], dtype=np.float32)
+    starts = np.array([0, 2, 3, 6])
+    ends = np.array([4, 6, 5, 8])
+    assert _window_argmin(values, starts, ends).tolist() == [1, 4, 4, 7]
+    assert _window_argmin(values, starts[:0], ends[:0]).tolist() == []
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+from scipy.io import wavfile
+
+from ai_components.AudioSpliter import spliter
+from ai_components.AudioSpliter.spliter import Splitter, _split_file_worker
+
+
+def write_speech(path, seconds, seed):
+    rng = np.random.default_rng(seed)
+    samples = np.zeros(int(seconds * Splitter.sample_rate), dtype=np.float32)
+    pos = 0
+    while pos < samples.shape[0]:
+        length = int(rng.uniform(1, 5) * Splitter.sample_rate)
+        samples[pos: pos + length] = rng.uniform(-0.5, 0.5, size=samples[pos: pos + length].shape[0])
+        pos += length + int(rng.uniform(0.5, 1.5) * Splitter.sample_rate)
+    wavfile.write(path, Splitter.sample_rate, (samples * 32767).astype(np.int16))
+
+
+def test_worker_uses_passed_params(tmp_path):
+    source = str(tmp_path / 'speech.wav')
+    write_speech(source, 30, 0)
+    splitter = Splitter(source, str(tmp_path / 'out'), min_length=8000, alpha_mix=0.5)
+    params = splitter._params()
+    assert params['min_length'] == 8000 and params['alpha_mix'] == 0.5
+
+    os.makedirs(splitter.output_path, exist_ok=True)
+    expected = [(path, chunk.tobytes()) for path, chunk, _ in splitter._iter_file_chunks(source)]
+    assert _split_file_worker(source, splitter.output_path, params) == len(expected)
+    assert len(expected) < len([1 for _ in Splitter(source, str(tmp_path / 'out'))._iter_file_chunks(source)])
+
+
+def test_parallel_split_matches_serial(tmp_path):
+    source = tmp_path / 'in'
+    source.mkdir()
+    for seed in range(3):
+        write_speech(str(source / f'{seed}.wav'), 20, seed)
+
+    for workers in (1, 3):
+        output = str(tmp_path / f'out{workers}')
+        assert Splitter(str(source), output, max_workers=workers, min_length=6000).begin_slice() is None
+    assert sorted(os.listdir(tmp_path / 'out1')) == sorted(os.listdir(tmp_path / 'out3'))
+    assert os.listdir(tmp_path / 'out1')
+
+
+def test_default_params_match_a_default_splitter():
+    assert Splitter.default_params() == Splitter(max_workers=1)._params()
+
+
+def test_silent_chunk_is_not_normalised(tmp_path, monkeypatch):
+    source = str(tmp_path / 'speech.wav')
+    write_speech(source, 5, 0)
+    silent = np.zeros(Splitter.sample_rate, dtype=np.float32)
+    monkeypatch.setattr(spliter.Slicer, 'iter_slice_stream', lambda self, blocks: iter([(silent.copy(), 0, silent.shape[0])]))
+    splitter = Splitter(source, str(tmp_path / 'out'))
+    os.makedirs(splitter.output_path, exist_ok=True)
+    with np.errstate(all='raise'):
+        chunks = [chunk for _, chunk, _ in splitter._iter_file_chunks(source)]
+    assert len(chunks) == 1 and chunks[0].dtype == np.int16 and not chunks[0].any()
@@ -0,0 +1,32 @@
+from chat_function.sse import UsageChunkFilter, format_event, replay_completion
+
+CONTENT = format_event({'choices': [{'index': 0, 'delta': {'content': 'hi'}, 'finish_reason': None}]})
+FINISH = format_event({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+USAGE = format_event({'choices': [], 'usage': {'prompt_tokens': 3, 'completion_tokens': 1}})
+DONE = format_event('[DONE]')
+
+
+def filtered(stream: bytes, size: int) -> bytes:
+    usage_filter = UsageChunkFilter()
+    output = b''.join(usage_filter.feed(stream[i:i + size]) for i in range(0, len(stream), size))
+    return output + usage_filter.flush()
+
+
+def test_usage_chunk_is_dropped_at_any_chunk_boundary():
+    stream = CONTENT + FINISH + USAGE + DONE
+    for size in (1, 2, 7, 64, len(stream)):
+        assert filtered(stream, size) == CONTENT + FINISH + DONE
+
+
+def test_other_events_are_forwarded_unchanged():
+    stream = (b': keep-alive\r\n\r\n' + CONTENT.replace(b'\n', b'\r\n')
+              + format_event({'choices': [{'index': 0, 'delta': {}}], 'usage': {'completion_tokens': 1}})[:-1] + b'\n' + b'data: {"partial')
+    assert filtered(stream, 5) == stream
+
+
+def test_replay_without_usage():
+    completion = {'object': 'chat.completion', 'choices': [{'index': 0, 'message': {'content': 'hi'}}],
+                  'usage': {'prompt_tokens': 3}}
+    events = list(replay_completion(completion, include_usage=False))
+    assert all(b'usage' not in event for event in events)
+    assert any(b'usage' in event for event in replay_completion(completion))
@@ -0,0 +1,67 @@
+import pytest
+
+from chat_function import token_budget
+from chat_function.request_params import InvalidParameter
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(token_budget, 'TOKEN_BUDGET_ENABLED', True)
+
+
+def history(turns):
+    messages = [{'role': 'system', 'content': 'system prompt'}]
+    for i in range(turns):
+        messages.append({'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'turn {i} ' + 'word ' * 50})
+    return messages
+
+
+def test_disabled_by_default():
+    messages = history(10)
+    assert token_budget.apply_budget({'max_context': 100, 'max_tokens': 50}, messages) == (messages, {})
+
+
+def test_large_max_tokens_does_not_empty_history(enabled):
+    messages = history(10)
+    trimmed, headers = token_budget.apply_budget({'model': 'deepseek-chat', 'max_tokens': 8192}, messages)
+    assert trimmed == messages
+    assert headers['X-Trimmed-Messages'] == '0'
+
+
+def test_default_context_smaller_than_response_skips_trimming(enabled):
+    messages = history(10)
+    assert token_budget.apply_budget({'max_tokens': 100000}, messages) == (messages, {})
+
+
+def test_trims_oldest_turns_and_keeps_system_and_last(enabled):
+    messages = history(10)
+    trimmed, headers = token_budget.apply_budget({'max_context': 300, 'max_tokens': 100}, messages)
+    assert trimmed[0] == messages[0]
+    assert trimmed[-1] == messages[-1]
+    assert len(trimmed) < len(messages)
+    assert int(headers['X-Prompt-Tokens']) <= 200
+    assert headers['X-Trimmed-Messages'] == str(len(messages) - len(trimmed))
+
+
+def test_drops_orphan_tool_messages(enabled):
+    messages = [
+        {'role': 'system', 'content': 's'},
+        {'role': 'assistant', 'content': None, 'tool_calls': [{'function': {'name': 'f', 'arguments': '{}'}}]},
+        {'role': 'tool', 'content': 'result ' * 100},
+        {'role': 'user', 'content': 'last'},
+    ]
+    trimmed, _, _ = token_budget.trim_messages(messages, 20)
+    assert [m['role'] for m in trimmed] == ['system', 'user']
+
+
+@pytest.mark.parametrize('request_data', [
+    {'max_context': 'abc'},
+    {'max_context': 0},
+    {'max_context': 100, 'max_tokens': 100},
+    {'max_tokens': -1},
+    {'max_tokens': True},
+    {'max_completion_tokens': 1.5},
+])
+def test_invalid_parameters(enabled, request_data):
+    with pytest.raises(InvalidParameter):
+        token_budget.apply_budget(request_data, history(2))
@@ -0,0 +1,143 @@
+from collections import Counter
+
+import pytest
+
+from chat_function import upstreams as upstreams_module
+from chat_function.upstreams import STRATEGY_LEAST_OUTSTANDING, Upstream, UpstreamPool, parse_upstreams
+from env_helper import EnvHelper
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(upstreams_module.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def pool(*weights, **kwargs):
+    return UpstreamPool([Upstream(f'http://{name}.test', name, weight, name)
+                         for name, weight in zip('abcd', weights)], name='test', **kwargs)
+
+
+def names(upstreams, count):
+    return [upstreams.select().name for _ in range(count)]
+
+
+def test_weighted_round_robin_distribution():
+    upstreams = pool(5, 1, 1)
+    picks = names(upstreams, 70)
+    assert Counter(picks) == {'a': 50, 'b': 10, 'c': 10}
+    # 平滑加权轮询：权重小的上游均匀穿插，不会连续选中同一个上游 5 次
+    assert 'aaaaa' not in ''.join(picks)
+
+
+def test_zero_weight_upstream_is_not_selected_while_others_are_available():
+    assert set(names(pool(1, 0), 10)) == {'a'}
+
+
+def test_least_outstanding_prefers_the_idle_upstream():
+    upstreams = pool(1, 1, strategy=STRATEGY_LEAST_OUTSTANDING)
+    a, b = upstreams.upstreams
+    upstreams.start(a)
+    assert upstreams.select() is b
+    upstreams.start(b)
+    upstreams.start(b)
+    assert upstreams.select() is a
+    upstreams.finish(a)
+    upstreams.finish(b)
+    upstreams.finish(b)
+
+
+def test_consecutive_failures_eject_until_cooldown(clock):
+    upstreams = pool(1, 1, eject_failures=3, eject_seconds=30, max_eject_seconds=60)
+    a, b = upstreams.upstreams
+    upstreams.record_failure(a)
+    upstreams.record_failure(a)
+    assert a.available(clock[0])
+    # 成功会清零连续失败次数
+    upstreams.record_success(a, 0.1)
+    upstreams.record_failure(a)
+    upstreams.record_failure(a)
+    assert a.available(clock[0])
+    upstreams.record_failure(a)
+    assert not a.available(clock[0])
+    assert set(names(upstreams, 4)) == {'b'}
+
+    clock[0] += 30
+    assert a.available(clock[0])
+    assert set(names(upstreams, 4)) == {'a', 'b'}
+
+    # 恢复后再次被摘除，时长翻倍，不超过 max_eject_seconds
+    for _ in range(3):
+        upstreams.record_failure(a)
+    assert a.ejected_until == clock[0] + 60
+    clock[0] += 60
+    for _ in range(3):
+        upstreams.record_failure(a)
+    assert a.ejected_until == clock[0] + 60
+
+
+def test_last_available_upstream_is_not_ejected(clock):
+    upstreams = pool(1, eject_failures=1)
+    upstreams.record_failure(upstreams.upstreams[0])
+    assert upstreams.upstreams[0].available(clock[0])
+
+
+def test_high_latency_ejects(clock):
+    upstreams = pool(1, 1, eject_latency=2.0)
+    a, _ = upstreams.upstreams
+    upstreams.record_success(a, 1.0)
+    assert a.available(clock[0])
+    upstreams.record_success(a, 20.0)
+    assert not a.available(clock[0])
+    assert a.latency is None
+
+
+def test_failover_to_the_next_upstream(clock):
+    upstreams = pool(1, 1, 1)
+    a, b, c = upstreams.upstreams
+    assert upstreams.select(exclude=[a]) is not a
+    assert upstreams.select(exclude=[a, b]) is c
+    assert upstreams.has_alternative([a, b])
+    assert not upstreams.has_alternative([a, b, c])
+    # 都试过时仍然返回一个可用的上游
+    assert upstreams.select(exclude=[a, b, c]) is not None
+
+
+def test_all_ejected_selects_the_earliest_to_recover(clock):
+    upstreams = pool(1, 1)
+    a, b = upstreams.upstreams
+    a.ejected_until = clock[0] + 20
+    b.ejected_until = clock[0] + 10
+    assert upstreams.select() is b
+
+
+def test_parse_upstreams(monkeypatch):
+    monkeypatch.setattr(EnvHelper, 'get_env_value', staticmethod(lambda key, default=None: f'key-of-{key}'))
+    parsed = parse_upstreams('https://a.test/|A_KEY|3, https://b.test||,')
+    assert [(u.base_url, u.api_key, u.weight) for u in parsed] == [
+        ('https://a.test', 'key-of-A_KEY', 3.0), ('https://b.test', 'key-of-API_KEY', 1.0)]
+
+
+def test_config_change_rebuilds_the_default_pool(tmp_path, monkeypatch):
+    env = tmp_path / '.env'
+    env.write_text('DEEPSEEK_UPSTREAMS=https://a.test/|A_KEY|1\nA_KEY=one\nOTHER=x\n')
+    monkeypatch.setattr(EnvHelper, '_env_path', str(env))
+    monkeypatch.setattr(EnvHelper, '_settings', None)
+    monkeypatch.setattr(upstreams_module, '_default_pool', None)
+
+    first = upstreams_module.default_pool()
+    assert [u.api_key for u in first.upstreams] == ['one']
+    assert upstreams_module.default_pool() is first
+
+    # 无关的配置变化不重建，健康状态保留
+    env.write_text('DEEPSEEK_UPSTREAMS=https://a.test/|A_KEY|1\nA_KEY=one\nOTHER=y\n')
+    assert EnvHelper.reload(force=True) == {'OTHER'}
+    assert upstreams_module.default_pool() is first
+
+    # DEEPSEEK_UPSTREAMS 引用的密钥变化时重建
+    env.write_text('DEEPSEEK_UPSTREAMS=https://a.test/|A_KEY|1\nA_KEY=two\nOTHER=y\n')
+    assert EnvHelper.reload(force=True) == {'A_KEY'}
+    rebuilt = upstreams_module.default_pool()
+    assert rebuilt is not first
+    assert [u.api_key for u in rebuilt.upstreams] == ['two']
@@ -0,0 +1,34 @@
+from chat_function.usage import UsageTracker
+
+STREAM = (b'data: {"choices": [{"index": 0, "delta": {"content": "a"}}]}\n\n'
+          b'data: {"choices": [{"index": 0, "delta": {"content": "b"}, "finish_reason": "stop"}]}\n\n'
+          b'data: [DONE]\n\n')
+USAGE = b'data: {"choices": [], "usage": {"prompt_tokens": 7, "completion_tokens": 2}}\n\n'
+
+
+def usage_rows(db):
+    db.write_queue.flush(timeout=5)
+    return db.query('SELECT uid, model, requests, prompt_tokens, completion_tokens FROM llm_usage')
+
+
+def test_stream_without_usage_counts_prompt_locally(sqlite_db):
+    calls = []
+    tracker = UsageTracker('m', 'u', count_prompt=lambda: calls.append(1) or 42)
+    tracker.feed(STREAM)
+    tracker.finish()
+    assert usage_rows(sqlite_db) == [('u', 'm', 1, 42, 2)]
+    assert len(calls) == 1
+
+
+def test_upstream_usage_is_preferred(sqlite_db):
+    tracker = UsageTracker('m', 'u', count_prompt=lambda: 1 / 0)
+    tracker.feed(STREAM + USAGE)
+    tracker.finish()
+    assert usage_rows(sqlite_db) == [('u', 'm', 1, 7, 2)]
+
+
+def test_failed_local_count_records_zero(sqlite_db):
+    tracker = UsageTracker('m', 'u', count_prompt=lambda: 1 / 0)
+    tracker.feed(STREAM)
+    tracker.finish()
+    assert usage_rows(sqlite_db) == [('u', 'm', 1, 0, 2)]
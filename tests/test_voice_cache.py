@@ -0,0 +1,126 @@
+import json
+import os
+
+from utils import voice_cache as voice_cache_module
+from utils.voice_cache import RESULT_FILE, VoiceResultCache, cache_evictions, make_key
+
+PARAMS = {'splitter': {'min_length': 5000}, 'language': 'en'}
+
+
+def clips(folder, sizes):
+    """
+    在 folder 里写几个片段文件，返回 split_info
+    """
+    os.makedirs(folder, exist_ok=True)
+    split_info = {}
+    for index, size in enumerate(sizes):
+        path = os.path.join(folder, f'clip_{index}.wav')
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        split_info[path] = f'text {index}'
+    return split_info
+
+
+def evictions(reason):
+    return cache_evictions.value(reason=reason)
+
+
+def test_key_depends_on_content_and_params():
+    key = make_key(b'audio', PARAMS)
+    assert make_key(b'audio', dict(reversed(list(PARAMS.items())))) == key
+    assert make_key(b'other audio', PARAMS) != key
+    assert make_key(b'audio', {**PARAMS, 'language': 'zh'}) != key
+
+
+def test_hit_links_clips_into_the_new_folder(tmp_path):
+    cache = VoiceResultCache(str(tmp_path / 'cache'), max_bytes=1 << 20, max_age=3600)
+    key = make_key(b'audio', PARAMS)
+    source = clips(str(tmp_path / 'first'), [10, 20])
+
+    assert cache.get(key, str(tmp_path / 'missed')) is None
+    cache.put(key, source)
+
+    dest = tmp_path / 'second'
+    split_info = cache.get(key, str(dest))
+    assert split_info == {str(dest / 'clip_0.wav'): 'text 0', str(dest / 'clip_1.wav'): 'text 1'}
+    for path in split_info:
+        assert os.path.getsize(path) in (10, 20)
+        # 同一个文件系统上是硬链接，不复制音频
+        assert os.stat(path).st_nlink > 1
+
+    # 不同的音频内容不会命中
+    assert cache.get(make_key(b'other audio', PARAMS), str(tmp_path / 'third')) is None
+
+
+def test_hard_link_falls_back_to_copy(tmp_path, monkeypatch):
+    def no_link(src, dst):
+        raise OSError('cross-device link')
+
+    monkeypatch.setattr(voice_cache_module.os, 'link', no_link)
+    cache = VoiceResultCache(str(tmp_path / 'cache'), max_bytes=1 << 20, max_age=3600)
+    cache.put('key', clips(str(tmp_path / 'first'), [10]))
+    split_info = cache.get('key', str(tmp_path / 'second'))
+    path = next(iter(split_info))
+    assert os.path.getsize(path) == 10
+    assert os.stat(path).st_nlink == 1
+
+
+def test_size_bound_evicts_least_recently_used(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(voice_cache_module.time, 'time', lambda: now[0])
+    cache = VoiceResultCache(str(tmp_path / 'cache'), max_bytes=250, max_age=3600)
+    before = evictions('size')
+
+    for key in ('a', 'b'):
+        cache.put(key, clips(str(tmp_path / key), [100]))
+        now[0] += 1
+    # 访问 a，b 成为最久未访问的
+    assert cache.get('a', str(tmp_path / 'a_again')) is not None
+    now[0] += 1
+    cache.put('c', clips(str(tmp_path / 'c'), [100]))
+
+    assert cache.get('b', str(tmp_path / 'b_again')) is None
+    assert cache.get('a', str(tmp_path / 'a_third')) is not None
+    assert not os.path.exists(tmp_path / 'cache' / 'b')
+    assert evictions('size') == before + 1
+    assert cache.stats()['entries'] == 2
+
+
+def test_entries_expire_after_max_age(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(voice_cache_module.time, 'time', lambda: now[0])
+    cache = VoiceResultCache(str(tmp_path / 'cache'), max_bytes=1 << 20, max_age=60)
+    cache.put('a', clips(str(tmp_path / 'a'), [10]))
+    now[0] += 61
+    assert cache.get('a', str(tmp_path / 'a_again')) is None
+
+    before = evictions('expired')
+    cache.put('b', clips(str(tmp_path / 'b'), [10]))
+    assert evictions('expired') == before + 1
+    assert cache.stats()['entries'] == 1
+
+
+def test_broken_entry_is_dropped_but_not_counted_as_eviction(tmp_path):
+    cache = VoiceResultCache(str(tmp_path / 'cache'), max_bytes=1 << 20, max_age=3600)
+    cache.put('a', clips(str(tmp_path / 'a'), [10]))
+    with open(tmp_path / 'cache' / 'a' / RESULT_FILE, 'w') as f:
+        f.write('not json')
+
+    stats = cache.stats()
+    assert cache.get('a', str(tmp_path / 'a_again')) is None
+    after = cache.stats()
+    assert after['broken'] == stats['broken'] + 1
+    assert after['evictions'] == stats['evictions']
+    assert after['entries'] == 0
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    root = str(tmp_path / 'cache')
+    VoiceResultCache(root, max_bytes=1 << 20, max_age=3600).put('a', clips(str(tmp_path / 'a'), [10]))
+    os.makedirs(os.path.join(root, '.tmp_unfinished'))
+
+    cache = VoiceResultCache(root, max_bytes=1 << 20, max_age=3600)
+    assert not os.path.exists(os.path.join(root, '.tmp_unfinished'))
+    with open(os.path.join(root, 'a', RESULT_FILE), encoding='utf-8') as f:
+        assert json.load(f) == {'clip_0.wav': 'text 0'}
+    assert cache.get('a', str(tmp_path / 'a_again')) is not None
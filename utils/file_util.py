@@ -4,6 +4,7 @@ import ffmpeg
 import traceback
 import numpy as np
 import json
+import wave
 
 
 def newest_file_in_folder(folder):
@@ -26,6 +27,46 @@ def path_strip(path_str):
     return path_str.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
 
 
+def wav_duration(file_path):
+    """
+    只读 wav 头获取时长（秒），不是 PCM wav 时返回 0
+    """
+    try:
+        with wave.open(file_path, 'rb') as f:
+            return f.getnframes() / float(f.getframerate())
+    except (wave.Error, EOFError, OSError):
+        return 0.0
+
+
+def read_pcm_wav(file, sr):
+    """
+    单声道 16bit PCM wav 且采样率等于 sr 时直接在进程内读取，结果和 ffmpeg 解码一致；
+    其它格式返回 None，由调用方走 ffmpeg
+    """
+    f = _open_pcm_wav(file, sr)
+    if f is None:
+        return None
+    with f:
+        return _pcm16_to_float(f.readframes(f.getnframes()))
+
+
+def _open_pcm_wav(file, sr):
+    try:
+        f = wave.open(file, 'rb')
+    except (wave.Error, EOFError, OSError):
+        return None
+    if f.getnchannels() != 1 or f.getsampwidth() != 2 or f.getframerate() != sr or f.getcomptype() != 'NONE':
+        f.close()
+        return None
+    return f
+
+
+def _pcm16_to_float(data):
+    # 和 ffmpeg 的 s16 -> f32 转换相同：除以 32768
+    data = data[:len(data) - len(data) % 2]
+    return np.frombuffer(data, '<i2').astype(np.float32) / 32768.0
+
+
 def load_audio(file, sr):
     try:
         # https://github.com/openai/whisper/blob/main/whisper/audio.py#L26
@@ -36,6 +77,10 @@ def load_audio(file, sr):
             raise RuntimeError(
                 "You input a wrong audio path that does not exists, please fix it!"
             )
+        # 已经是目标采样率的 PCM wav 时不需要启动 ffmpeg 子进程
+        audio = read_pcm_wav(file, sr)
+        if audio is not None:
+            return audio
         out, _ = (
             ffmpeg.input(file, threads=0)
             .output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=sr)
@@ -48,6 +93,64 @@ def load_audio(file, sr):
     return np.frombuffer(out, np.float32).flatten()
 
 
+def iter_audio_blocks(file, sr, block_size=None):
+    """
+    流式解码音频：从 ffmpeg 的 stdout 管道按块读取单声道 float32 音频，不把整个文件读进内存
+    :param block_size: 每块的采样点数，默认 10 秒
+    """
+    file = path_strip(file)
+    if not os.path.exists(file):
+        raise RuntimeError(
+            "You input a wrong audio path that does not exists, please fix it!"
+        )
+    block_size = int(block_size or sr * 10)
+
+    wav = _open_pcm_wav(file, sr)
+    if wav is not None:
+        with wav:
+            while True:
+                data = wav.readframes(block_size)
+                if not data:
+                    return
+                yield _pcm16_to_float(data)
+
+    block_bytes = block_size * 4
+    try:
+        process = (
+            ffmpeg.input(file, threads=0)
+            .output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=sr)
+            .global_args("-hide_banner", "-loglevel", "error")
+            .run_async(cmd=["ffmpeg", "-nostdin"], pipe_stdout=True, pipe_stderr=True)
+        )
+    except Exception as e:
+        traceback.print_exc()
+        raise RuntimeError(f"Failed to load audio: {e}")
+
+    finished = False
+    try:
+        leftover = b""
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % 4
+            leftover = data[usable:]
+            if usable:
+                yield np.frombuffer(data[:usable], np.float32)
+        finished = True
+    finally:
+        if not finished:
+            # 调用方提前结束迭代
+            process.kill()
+        process.stdout.close()
+        err = process.stderr.read()
+        process.stderr.close()
+        ret = process.wait()
+    if ret != 0:
+        raise RuntimeError(f"Failed to load audio: {err.decode('utf-8', 'ignore')}")
+
+
 def get_hparams_from_file(config_path):
     with open(config_path, "r") as f:
         data = f.read()
@@ -0,0 +1,205 @@
+# 后台任务队列：把耗时的切分/ASR 放到有界线程池里执行，避免阻塞事件循环
+import asyncio
+import logging
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_SUCCESS = 'success'
+JOB_FAILED = 'failed'
+
+FINISHED_STATES = (JOB_SUCCESS, JOB_FAILED)
+
+
+class QueueFullError(Exception):
+    """排队任务数超过上限"""
+
+
+class Job:
+    def __init__(self, job_id: str, name: str, meta: Optional[Dict[str, Any]] = None):
+        self.job_id = job_id
+        self.name = name
+        self.meta = meta or {}
+        self.status = JOB_PENDING
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # 每次状态变化自增，SSE 用它判断是否需要推送
+        self.version = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'name': self.name,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 4),
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            **self.meta,
+        }
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+
+class JobManager:
+    """
+    有界的后台任务管理器
+    :param max_workers: 同时执行的任务数
+    :param max_pending: 排队+执行中的任务上限，超过后 submit 抛 QueueFullError
+    :param retention: 已完成任务保留多少秒供查询
+    """
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 32, retention: int = 3600):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='csm-job')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        # job_id -> [(loop, asyncio.Event)]，用于把工作线程的更新通知到事件循环
+        self._watchers: Dict[str, list] = {}
+        # 还没有执行完的任务，shutdown 时把没有开始的标记为失败
+        self._futures: Dict[str, Future] = {}
+
+    def submit(self, name: str, fn: Callable[..., Any], *args, meta: Optional[Dict[str, Any]] = None,
+               **kwargs) -> Job:
+        """
+        提交任务，fn 的最后一个关键字参数 progress 是进度回调 progress(stage, fraction)
+        """
+        with self._lock:
+            self._purge_locked()
+            active = sum(1 for job in self._jobs.values() if not job.finished)
+            if active >= self.max_pending:
+                raise QueueFullError(f'too many pending jobs: {active}')
+            job = Job(uuid.uuid4().hex, name, meta)
+            # 工作线程更新状态前要拿锁，登记 future 之前任务不会开始
+            future = self._executor.submit(self._run, job, fn, args, kwargs)
+            self._jobs[job.job_id] = job
+            self._futures[job.job_id] = future
+        future.add_done_callback(lambda _: self._forget_future(job.job_id))
+        return job
+
+    def completed(self, name: str, result: Any, meta: Optional[Dict[str, Any]] = None) -> Job:
+        """
+        登记一个已经有结果的任务（例如命中缓存），查询接口和直接提交的任务一致，不占用排队名额
+        """
+        job = Job(uuid.uuid4().hex, name, meta)
+        job.status = JOB_SUCCESS
+        job.stage = 'done'
+        job.progress = 1.0
+        job.result = result
+        with self._lock:
+            self._purge_locked()
+            self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    async def watch(self, job_id: str, heartbeat: float = 15.0):
+        """
+        异步生成任务快照，每次状态变化产出一次，任务结束后停止；超时无变化时产出 None 作为心跳
+        """
+        job = self.get(job_id)
+        if job is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._lock:
+            self._watchers.setdefault(job_id, []).append((loop, event))
+
+        try:
+            seen = -1
+            while True:
+                with self._lock:
+                    snapshot = job.to_dict() if job.version != seen else None
+                    seen = job.version
+                    finished = job.finished
+                if snapshot is not None:
+                    yield snapshot
+                if finished:
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                event.clear()
+        finally:
+            with self._lock:
+                watchers = self._watchers.get(job_id, [])
+                if (loop, event) in watchers:
+                    watchers.remove((loop, event))
+                if not watchers:
+                    self._watchers.pop(job_id, None)
+
+    def shutdown(self, wait: bool = False):
+        """
+        停止接收任务，排队中的任务取消并标记为失败；wait 为 True 时等待执行中的任务结束
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        with self._lock:
+            cancelled = [self._jobs[job_id] for job_id, future in self._futures.items()
+                         if future.cancelled() and job_id in self._jobs]
+        for job in cancelled:
+            self._update(job, status=JOB_FAILED, stage='failed', error='server is shutting down')
+
+    def _forget_future(self, job_id: str):
+        with self._lock:
+            future = self._futures.get(job_id)
+            if future is not None and not future.cancelled():
+                del self._futures[job_id]
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs):
+        def progress(stage: str, fraction: float = 0.0):
+            self._update(job, stage=stage, progress=min(max(float(fraction), 0.0), 1.0))
+
+        self._update(job, status=JOB_RUNNING, stage='running')
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+        except Exception as e:
+            logger.error(f"Job {job.job_id} ({job.name}) failed: {e}\n{traceback.format_exc()}")
+            self._update(job, status=JOB_FAILED, stage='failed', error=str(e))
+            return
+        self._update(job, status=JOB_SUCCESS, stage='done', progress=1.0, result=result)
+
+    def _update(self, job: Job, **fields):
+        with self._lock:
+            for k, v in fields.items():
+                setattr(job, k, v)
+            job.updated_at = time.time()
+            job.version += 1
+            watchers = list(self._watchers.get(job.job_id, []))
+
+        for loop, event in watchers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 事件循环已经关闭
+                pass
+
+    def _purge_locked(self):
+        deadline = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.updated_at < deadline]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -1,6 +1,4 @@
-import random
-import base64
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # 常量定义
 PROMPT_PLACEHOLDER = "Let's get started."  # 这里应该从配置中获取
@@ -64,11 +62,194 @@ def post_process_prompt(messages: List[Dict[str, Any]], in_type: str, names: Pro
         return messages
 
 
+# 合并时从消息中删除的字段
+_DROPPED_FIELDS = ('name', 'tool_calls', 'tool_call_id')
+# _MergedMessage 还没有生成内容
+_UNRENDERED = object()
+
+
+class _MergedMessage:
+    """
+    合并中的一条消息：message 是第一条原始消息去掉多余字段后的副本，
+    parts 是按顺序排列的内容片段——文本（str）或图片（image_url 内容对象），相邻片段之间用 '\n\n' 连接。
+    被 MessageMerger 缓存后不再修改，需要追加内容时先 copy
+    """
+    __slots__ = ('message', 'parts', 'has_image', '_content')
+
+    def __init__(self, message: Dict[str, Any], parts: List[Any], has_image: bool):
+        self.message = message
+        self.parts = parts
+        self.has_image = has_image
+        self._content = _UNRENDERED
+
+    @property
+    def role(self) -> str:
+        return self.message['role']
+
+    def has_content(self) -> bool:
+        # 等价于展平后的内容字符串非空
+        return len(self.parts) > 1 or bool(self.parts and self.parts[0])
+
+    def copy(self) -> '_MergedMessage':
+        return _MergedMessage(self.message, list(self.parts), self.has_image)
+
+    def extend(self, other: '_MergedMessage'):
+        self.parts.extend(other.parts)
+        self.has_image = self.has_image or other.has_image
+        self._content = _UNRENDERED
+
+    def content(self) -> Any:
+        if self._content is not _UNRENDERED:
+            return self._content
+        parts = self.parts
+        if not self.has_image:
+            # 单条消息原样保留内容（包括 None），多条用 '\n\n' 连接
+            content = parts[0] if len(parts) == 1 else '\n\n'.join(part or '' for part in parts)
+        else:
+            # 相邻的文本片段合成一个 text 对象，图片对象原样放回
+            content = []
+            texts = []
+            for part in parts:
+                if isinstance(part, dict):
+                    if texts:
+                        content.append({'type': 'text', 'text': '\n\n'.join(texts)})
+                        texts = []
+                    content.append(part)
+                else:
+                    texts.append(part or '')
+            if texts:
+                content.append({'type': 'text', 'text': '\n\n'.join(texts)})
+        self._content = content
+        return content
+
+    def render(self, role: Optional[str] = None) -> Dict[str, Any]:
+        message = dict(self.message)
+        message['content'] = self.content()
+        if role is not None:
+            message['role'] = role
+        return message
+
+
+def _prefix_name(parts: List[Any], name: str):
+    """
+    内容没有以 "名称: " 开头时加上前缀。内容以图片开头时前缀作为单独的文本片段
+    """
+    prefix = f"{name}: "
+    first = parts[0]
+    if isinstance(first, dict):
+        parts.insert(0, prefix)
+    elif isinstance(first, str) and not first.startswith(prefix):
+        parts[0] = prefix + first
+
+
+def _normalize_message(message: Dict[str, Any], names: PromptNames) -> _MergedMessage:
+    """
+    复制消息、展开内容片段、加上名称前缀并删除不需要的字段，不修改传入的消息
+    """
+    normalized = {key: value for key, value in message.items() if key not in _DROPPED_FIELDS}
+    content = message.get('content', '')
+    has_image = False
+    if isinstance(content, list):
+        parts = []
+        for item in content:
+            if item['type'] == 'text':
+                parts.append(item['text'])
+            elif item['type'] == 'image_url':
+                parts.append(item)
+                has_image = True
+            else:
+                parts.append('')
+        if not parts:
+            parts.append('')
+    else:
+        parts = [content]
+
+    role = message['role']
+    name = message.get('name')
+    if role == 'system' and name == 'example_assistant':
+        if names.char_name and not (isinstance(parts[0], str) and names.starts_with_group_name(parts[0])):
+            _prefix_name(parts, names.char_name)
+    elif role == 'system' and name == 'example_user':
+        if names.user_name:
+            _prefix_name(parts, names.user_name)
+    elif name and role != 'system':
+        _prefix_name(parts, name)
+
+    if role == 'tool':
+        normalized['role'] = 'user'
+    normalized.setdefault('content', '')
+    return _MergedMessage(normalized, parts, has_image)
+
+
+def _placeholder() -> _MergedMessage:
+    return _MergedMessage({'role': 'user', 'content': PROMPT_PLACEHOLDER}, [PROMPT_PLACEHOLDER], False)
+
+
+class MessageMerger:
+    """
+    merge_messages 的增量形式。extend 返回追加了消息的新 MessageMerger，原对象不变，
+    所以可以缓存一段对话前缀的合并结果，后续请求只处理新增的消息
+    """
+
+    def __init__(self, names: PromptNames, strict: bool, placeholders: bool, groups: List[_MergedMessage] = None):
+        self.names = names
+        self.strict = strict
+        self.placeholders = placeholders
+        # 合并了相同连续角色后的消息
+        self._groups = groups or []
+
+    def extend(self, messages: List[Dict[str, Any]]) -> 'MessageMerger':
+        groups = list(self._groups)
+        # 本次新建或复制的最后一条，可以直接修改
+        owned = None
+        for message in messages:
+            normalized = _normalize_message(message, self.names)
+            # 内容为空的消息不会并入前一条
+            if groups and groups[-1].role == normalized.role and normalized.has_content():
+                if groups[-1] is not owned:
+                    owned = groups[-1] = groups[-1].copy()
+                owned.extend(normalized)
+            else:
+                groups.append(normalized)
+                owned = normalized
+        return MessageMerger(self.names, self.strict, self.placeholders, groups)
+
+    def result(self) -> List[Dict[str, Any]]:
+        # 防止合并后的消息数组为空
+        groups = self._groups or [_placeholder()]
+        if not self.strict:
+            return [group.render() for group in groups]
+
+        # 严格模式：强制将中间提示的系统消息转换为用户消息
+        items = [('user' if i > 0 and group.role == 'system' else group.role, group) for i, group in enumerate(groups)]
+        if self.placeholders:
+            first_role = items[0][0]
+            if first_role == 'system' and (len(items) == 1 or items[1][0] != 'user'):
+                items.insert(1, ('user', _placeholder()))
+            elif first_role != 'system' and first_role != 'user':
+                items.insert(0, ('user', _placeholder()))
+
+        # 系统消息转换后可能出现新的连续用户消息，合并到副本上，不影响缓存的消息
+        merged = []
+        owned = None
+        for role, group in items:
+            if merged and merged[-1][0] == role and group.has_content():
+                if merged[-1][1] is not owned:
+                    owned = merged[-1][1].copy()
+                    merged[-1] = (role, owned)
+                owned.extend(group)
+            else:
+                merged.append((role, group))
+        return [group.render(role) for role, group in merged]
+
+
 def merge_messages(messages: List[Dict[str, Any]], names: PromptNames, strict: bool, placeholders: bool) -> List[
     Dict[str, Any]]:
     """
     合并具有相同连续角色的消息，如果存在则删除名称
 
+    内容按片段列表合并，最后一次性 join，图片对象直接保留在片段中；不修改传入的消息
+
     Args:
         messages: 要合并的消息
         names: 提示名称对象
@@ -78,102 +259,4 @@ def merge_messages(messages: List[Dict[str, Any]], names: PromptNames, strict: b
     Returns:
         合并后的消息列表
     """
-    merged_messages = []
-    content_tokens = {}  # 用于存储内容令牌
-
-    # 从消息中删除名称
-    for message in messages:
-        if 'content' not in message:
-            message['content'] = ''
-
-        # 展平内容并用随机令牌替换图片URL
-        if isinstance(message['content'], list):
-            text_parts = []
-            for content in message['content']:
-                if content['type'] == 'text':
-                    text_parts.append(content['text'])
-                elif content['type'] == 'image_url':
-                    # 生成随机令牌
-                    token = base64.b64encode(random.randbytes(32)).decode('utf-8')
-                    content_tokens[token] = content
-                    text_parts.append(token)
-                else:
-                    text_parts.append('')
-            message['content'] = '\n\n'.join(text_parts)
-
-        # 处理角色名称
-        if message['role'] == 'system' and message.get('name') == 'example_assistant':
-            if names.char_name and not message['content'].startswith(
-                    f"{names.char_name}: ") and not names.starts_with_group_name(message['content']):
-                message['content'] = f"{names.char_name}: {message['content']}"
-
-        if message['role'] == 'system' and message.get('name') == 'example_user':
-            if names.user_name and not message['content'].startswith(f"{names.user_name}: "):
-                message['content'] = f"{names.user_name}: {message['content']}"
-
-        if message.get('name') and message['role'] != 'system':
-            if not message['content'].startswith(f"{message['name']}: "):
-                message['content'] = f"{message['name']}: {message['content']}"
-
-        if message['role'] == 'tool':
-            message['role'] = 'user'
-
-        # 删除不需要的字段
-        if 'name' in message:
-            del message['name']
-        if 'tool_calls' in message:
-            del message['tool_calls']
-        if 'tool_call_id' in message:
-            del message['tool_call_id']
-
-    # 合并具有相同角色的连续消息
-    for message in messages:
-        if merged_messages and merged_messages[-1]['role'] == message['role'] and message['content']:
-            merged_messages[-1]['content'] += '\n\n' + message['content']
-        else:
-            merged_messages.append(message)
-
-    # 防止合并后的消息数组为空
-    if not merged_messages:
-        merged_messages.insert(0, {
-            'role': 'user',
-            'content': PROMPT_PLACEHOLDER
-        })
-
-    # 检查内容令牌并用实际内容对象替换它们
-    if content_tokens:
-        for message in merged_messages:
-            has_valid_token = any(token in message['content'] for token in content_tokens.keys())
-
-            if has_valid_token:
-                split_content = message['content'].split('\n\n')
-                merged_content = []
-
-                for content in split_content:
-                    if content in content_tokens:
-                        merged_content.append(content_tokens[content])
-                    else:
-                        if merged_content and merged_content[-1]['type'] == 'text':
-                            merged_content[-1]['text'] += f"\n\n{content}"
-                        else:
-                            merged_content.append({'type': 'text', 'text': content})
-
-                message['content'] = merged_content
-
-    # 处理严格模式
-    if strict:
-        for i in range(len(merged_messages)):
-            # 强制将中间提示的系统消息转换为用户消息
-            if i > 0 and merged_messages[i]['role'] == 'system':
-                merged_messages[i]['role'] = 'user'
-
-        if merged_messages and placeholders:
-            if merged_messages[0]['role'] == 'system' and (
-                    len(merged_messages) == 1 or merged_messages[1]['role'] != 'user'):
-                merged_messages.insert(1, {'role': 'user', 'content': PROMPT_PLACEHOLDER})
-            elif merged_messages[0]['role'] != 'system' and merged_messages[0]['role'] != 'user':
-                merged_messages.insert(0, {'role': 'user', 'content': PROMPT_PLACEHOLDER})
-
-        return merge_messages(merged_messages, names, False, placeholders)
-
-    return merged_messages
+    return MessageMerger(names, strict, placeholders).extend(messages).result()
@@ -0,0 +1,179 @@
+# 参考语音的切分+ASR 结果缓存：按音频内容和处理参数的哈希寻址，重复上传直接复用结果
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+RESULT_FILE = 'split_info.json'
+
+cache_requests = metrics.Counter('voice_cache_requests_total', 'Voice result cache lookups', ['result'])
+# reason：expired（超过 max_age）、size（超过 max_bytes）、broken（条目损坏被丢弃，不算淘汰）
+cache_evictions = metrics.Counter('voice_cache_evictions_total', 'Voice result cache removed entries', ['reason'])
+cache_bytes = metrics.Gauge('voice_cache_bytes', 'Voice result cache size in bytes')
+cache_entries = metrics.Gauge('voice_cache_entries', 'Voice result cache entry count')
+
+
+def make_key(audio: bytes, params: Dict[str, Any]) -> str:
+    """
+    缓存键：音频字节 + 切分/ASR 参数 + 模型版本
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(audio)
+    return digest.hexdigest()
+
+
+class VoiceResultCache:
+    """
+    每个条目是 root/<key>/ 目录，包含切出的片段和 split_info.json。
+    超过 max_age 秒未访问的条目、以及总大小超过 max_bytes 时最久未访问的条目会被淘汰
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_age: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # key -> [大小, 最近访问时间]
+        self._index: Dict[str, list] = {}
+        self._load_index()
+
+    def get(self, key: str, dest_folder: str) -> Optional[Dict[str, str]]:
+        """
+        命中时把缓存的片段链接到 dest_folder，返回 key 指向 dest_folder 的 split_info
+        """
+        entry_dir = os.path.join(self.root, key)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or time.time() - entry[1] > self.max_age:
+                cache_requests.inc(result='miss')
+                return None
+            entry[1] = time.time()
+
+        try:
+            with open(os.path.join(entry_dir, RESULT_FILE), 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            os.makedirs(dest_folder, exist_ok=True)
+            split_info = {}
+            for name, text in cached.items():
+                src = os.path.join(entry_dir, name)
+                dst = os.path.join(dest_folder, name)
+                if os.path.exists(src) and not os.path.exists(dst):
+                    _link_or_copy(src, dst)
+                split_info[dst] = text
+            os.utime(entry_dir)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Voice cache entry {key} is broken, dropping it: {e}")
+            self._remove(key, 'broken')
+            cache_requests.inc(result='miss')
+            return None
+
+        cache_requests.inc(result='hit')
+        return split_info
+
+    def put(self, key: str, split_info: Dict[str, str]):
+        """
+        保存一次处理结果，split_info 的 key 是片段文件路径（文件不存在时只保存文本）
+        """
+        tmp_dir = os.path.join(self.root, f'.tmp_{uuid.uuid4().hex}')
+        entry_dir = os.path.join(self.root, key)
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            cached = {}
+            for path, text in split_info.items():
+                name = os.path.basename(path)
+                if os.path.exists(path):
+                    _link_or_copy(path, os.path.join(tmp_dir, name))
+                cached[name] = text
+            with open(os.path.join(tmp_dir, RESULT_FILE), 'w', encoding='utf-8') as f:
+                json.dump(cached, f, ensure_ascii=False)
+
+            with self._lock:
+                if key in self._index:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return
+                os.rename(tmp_dir, entry_dir)
+                self._index[key] = [_dir_size(entry_dir), time.time()]
+                self._evict_locked()
+        except OSError as e:
+            logger.warning(f"Failed to cache voice result {key}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'bytes': sum(entry[0] for entry in self._index.values()),
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'hits': cache_requests.value(result='hit'),
+                'misses': cache_requests.value(result='miss'),
+                'evictions': cache_evictions.value(reason='expired') + cache_evictions.value(reason='size'),
+                'broken': cache_evictions.value(reason='broken'),
+            }
+
+    def _load_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.tmp_'):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isfile(os.path.join(path, RESULT_FILE)):
+                self._index[name] = [_dir_size(path), os.path.getmtime(path)]
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        now = time.time()
+        expired = [key for key, entry in self._index.items() if now - entry[1] > self.max_age]
+        for key in expired:
+            self._remove_locked(key, 'expired')
+
+        total = sum(entry[0] for entry in self._index.values())
+        if total > self.max_bytes:
+            for key, entry in sorted(self._index.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+                total -= entry[0]
+                self._remove_locked(key, 'size')
+
+        cache_bytes.set(sum(entry[0] for entry in self._index.values()))
+        cache_entries.set(len(self._index))
+
+    def _remove(self, key: str, reason: str):
+        with self._lock:
+            self._remove_locked(key, reason)
+            cache_bytes.set(sum(entry[0] for entry in self._index.values()))
+            cache_entries.set(len(self._index))
+
+    def _remove_locked(self, key: str, reason: str):
+        if self._index.pop(key, None) is not None:
+            cache_evictions.inc(reason=reason)
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+
+def _link_or_copy(src: str, dst: str):
+    # 同一个文件系统上用硬链接，避免复制音频
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for name in os.listdir(path):
+        file_path = os.path.join(path, name)
+        if os.path.isfile(file_path):
+            total += os.path.getsize(file_path)
+    return total
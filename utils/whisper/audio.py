@@ -7,6 +7,8 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 
+from utils.file_util import read_pcm_wav
+
 from .utils import exact_div
 
 # hard-coded audio hyperparameters
@@ -39,6 +41,11 @@ def load_audio(file: str, sr: int = SAMPLE_RATE):
     A NumPy array containing the audio waveform, in float32 dtype.
     """
 
+    # 16bit mono PCM wav already at the target rate is read in-process
+    audio = read_pcm_wav(file, sr)
+    if audio is not None:
+        return audio
+
     # This launches a subprocess to decode audio while down-mixing
     # and resampling as necessary.  Requires the ffmpeg CLI in PATH.
     # fmt: off